@@ -0,0 +1,250 @@
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Dict
+
+import numpy as np
+
+try:
+    from base_ble.calc import compute_kinematics, compute_kinematics_batch, Geometry, KinematicsIntegrator
+    from base_ble.data_analyze import calculate_bout, calculate_stroke_metrics, Metrics
+    from base_ble.calibrate import minimize_function
+    from base_ble.minimize_traj import minimize_turnaround
+except ModuleNotFoundError:
+    from calc import compute_kinematics, compute_kinematics_batch, Geometry, KinematicsIntegrator
+    from data_analyze import calculate_bout, calculate_stroke_metrics, Metrics
+    from calibrate import minimize_function
+    from minimize_traj import minimize_turnaround
+
+
+# recording lengths (minutes) the suite runs by default
+DURATIONS_MIN = (1, 10, 60)
+# samples per second coming off each smarthub
+SAMPLE_RATE_HZ = 68
+# a function is flagged when it is this much slower / bigger than the baseline (0.25 = 25%)
+DEFAULT_THRESHOLD = 0.25
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+
+def parse_args() -> Dict:
+    parser = argparse.ArgumentParser(description='benchmark the calc, metrics and calibration hot paths on synthetic recordings')
+    parser.add_argument("--durations", '-d',
+                        help='recording lengths to run, in minutes',
+                        nargs='+',
+                        default=list(DURATIONS_MIN),
+                        type=float)
+    parser.add_argument("--repeat", '-r',
+                        help='timing runs per function, the fastest one is reported',
+                        default=3,
+                        type=int)
+    parser.add_argument("--baseline", '-b',
+                        help='baseline json file to compare against',
+                        default=DEFAULT_BASELINE,
+                        type=str)
+    parser.add_argument("--threshold", '-t',
+                        help='allowed slowdown / memory growth over the baseline before failing (0.25 = 25%%)',
+                        default=DEFAULT_THRESHOLD,
+                        type=float)
+    parser.add_argument("--save_baseline",
+                        help='write the results to the baseline file instead of comparing',
+                        action='store_true')
+    parser.add_argument("--output", '-o',
+                        help='also write the results to this json file',
+                        required=False,
+                        type=str)
+    return vars(parser.parse_args())
+
+
+def synthetic_recording(minutes, rate=SAMPLE_RATE_HZ, seed=0) -> Dict:
+    """
+    :param minutes: length of the recording
+             rate: samples per second
+             seed: seed for the sensor noise, same seed gives the same recording
+    :returns test dictionary shaped like the ones saved by the record tab
+
+    30 s bouts of pushing (strokes about once a second) separated by 5 s pauses,
+    with a 3 s spin in place halfway through so the turnaround calibration has a turn to find
+    """
+    rng = np.random.default_rng(seed)
+    n = max(int(minutes * 60 * rate), 2)
+    time_from_start = np.arange(n) / rate
+
+    # strokes on top of a cruising speed, zeroed out during the pauses
+    bout_phase = time_from_start % 35
+    moving = bout_phase < 30
+    stroke = 2.5 + 1.5 * np.sin(np.pi * time_from_start)**2
+    gyro_left = np.where(moving, stroke, 0.0)
+    gyro_right = gyro_left.copy()
+
+    # spin in place halfway through
+    turn = (time_from_start >= time_from_start[-1] / 2) & (time_from_start < time_from_start[-1] / 2 + 3)
+    gyro_left[turn] = -1.0
+    gyro_right[turn] = 1.0
+
+    gyro_left_smoothed = gyro_left + rng.normal(0, 0.01, n)
+    gyro_right_smoothed = gyro_right + rng.normal(0, 0.01, n)
+
+    return {
+        'elapsed_time_s': time_from_start,
+        'gyro_left': gyro_left + rng.normal(0, 0.05, n),
+        'gyro_right': gyro_right + rng.normal(0, 0.05, n),
+        'gyro_left_smoothed': gyro_left_smoothed,
+        'gyro_right_smoothed': gyro_right_smoothed,
+    }
+
+
+def calibration_sequence(test, steps=('forward1', 'forward2', 'forward3', 'forward4', 'turnright1', 'turnleft1')):
+    """
+    :param test: synthetic recording from synthetic_recording
+             steps: names of the calibration steps to cut the recording into
+    :returns calibration list in the layout minimize_function expects
+    """
+    calibration_list = []
+    for name, index in zip(steps, np.array_split(np.arange(len(test['elapsed_time_s'])), len(steps))):
+        calibration_list.append({
+            'name': name,
+            'time_from_start': test['elapsed_time_s'][index].tolist(),
+            'gyro_left': test['gyro_left'][index].tolist(),
+            'gyro_right': test['gyro_right'][index].tolist(),
+        })
+    return calibration_list
+
+
+def reset_turnaround():
+    # minimize_turnaround remembers where the turn is between solver calls, forget it between recordings
+    for attr in ('start_turn', 'end_turn'):
+        if hasattr(minimize_turnaround, attr):
+            delattr(minimize_turnaround, attr)
+
+
+def benchmark_cases(test) -> Dict:
+    """
+    :param test: synthetic recording from synthetic_recording
+    :returns dictionary of benchmark name -> function with no arguments
+    """
+    time_from_start = test['elapsed_time_s']
+    rot_l = test['gyro_left_smoothed']
+    rot_r = test['gyro_right_smoothed']
+    kinematics = compute_kinematics(time_from_start, rot_l, rot_r)
+    calibration_list = calibration_sequence(test)
+    # the first bout of the recording for the stroke metrics on their own
+    bout = slice(0, min(len(time_from_start), 30 * SAMPLE_RATE_HZ))
+
+    def streaming():
+        integrator = KinematicsIntegrator()
+        # one graph update worth of samples (400 ms) at a time, the same as the record tab
+        chunk = int(SAMPLE_RATE_HZ * 0.4)
+        for start in range(0, len(time_from_start), chunk):
+            integrator.update(time_from_start[start:start + chunk], rot_l[start:start + chunk], rot_r[start:start + chunk])
+        return integrator.result
+
+    def turnaround():
+        reset_turnaround()
+        return minimize_turnaround([20, 20, 20], test)
+
+    return {
+        'calc.compute_kinematics': lambda: compute_kinematics(time_from_start, rot_l, rot_r),
+        'calc.compute_kinematics_batch[16]': lambda: compute_kinematics_batch(time_from_start, rot_l, rot_r, Geometry(np.linspace(20, 28, 16), 26)),
+        'calc.KinematicsIntegrator': streaming,
+        'data_analyze.calculate_bout': lambda: calculate_bout(time_from_start, kinematics.distance, kinematics.velocity),
+        'data_analyze.calculate_stroke_metrics': lambda: calculate_stroke_metrics(Metrics(), kinematics.velocity[bout], time_from_start[bout], kinematics.distance[bout]),
+        'calibrate.minimize_function': lambda: minimize_function([24, 26, 1, 1], calibration_list),
+        'minimize_traj.minimize_turnaround': turnaround,
+    }
+
+
+def measure(function, repeat) -> Dict:
+    """
+    :param function: function with no arguments to measure
+             repeat: number of timing runs
+    :returns dictionary with the fastest wall time (sec) and the peak memory (bytes) of one run
+
+    memory gets its own run since tracemalloc slows everything down
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'wall_s': min(times), 'peak_bytes': peak}
+
+
+def run_suite(durations, repeat) -> Dict:
+    """
+    :param durations: recording lengths to run, in minutes
+             repeat: timing runs per function
+    :returns nested dictionary of recording length -> benchmark name -> measurements
+    """
+    results = {}
+    for minutes in durations:
+        label = f'{minutes:g}min'
+        test = synthetic_recording(minutes)
+        results[label] = {}
+        for name, function in benchmark_cases(test).items():
+            results[label][name] = measure(function, repeat)
+            result = results[label][name]
+            print(f"{label:>7} {name:<40} {result['wall_s']*1000:10.2f} ms {result['peak_bytes']/2**20:10.2f} MiB")
+    reset_turnaround()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    :param results: output of run_suite
+             baseline: output of run_suite stored earlier
+             threshold: allowed growth over the baseline (0.25 = 25%)
+    :returns list of strings describing each regression, empty if there are none
+    """
+    regressions = []
+    for label, cases in results.items():
+        for name, result in cases.items():
+            previous = baseline.get(label, {}).get(name)
+            if previous is None:
+                continue
+            for key in ('wall_s', 'peak_bytes'):
+                if previous[key] > 0 and result[key] > previous[key] * (1 + threshold):
+                    regressions.append(f"{label} {name} {key}: {previous[key]:.6g} -> {result[key]:.6g} (+{(result[key]/previous[key] - 1)*100:.0f}%)")
+    return regressions
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    results = run_suite(args['durations'], args['repeat'])
+
+    if args['output']:
+        with open(args['output'], 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args['save_baseline']:
+        with open(args['baseline'], 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"baseline saved to {args['baseline']}")
+        sys.exit(0)
+
+    if not os.path.exists(args['baseline']):
+        print(f"no baseline at {args['baseline']}, run with --save_baseline to make one")
+        sys.exit(0)
+
+    with open(args['baseline'], 'r') as f:
+        baseline = json.load(f)
+
+    regressions = compare(results, baseline, args['threshold'])
+    if regressions:
+        print(f"{len(regressions)} regression(s) over {args['threshold']*100:.0f}%:")
+        for regression in regressions:
+            print('  ' + regression)
+        sys.exit(1)
+
+    print('no regressions')
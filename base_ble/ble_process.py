@@ -0,0 +1,392 @@
+import asyncio
+import collections
+import multiprocessing as mp
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from base_ble.params import DATE_DIR
+    from base_ble.recording_control import RecordingControl
+    from base_ble.stream_merger import StreamMerger, sample_offsets
+    from base_ble.packet_log import PacketLog, raw_log_path
+    from base_ble.telemetry import LinkTelemetry, stats_log_path
+    from base_ble.scanner import AddressCache, SmarthubsNotFound, connect_pair, connect_smarthubs, reconnect_dropped
+except ModuleNotFoundError:
+    from params import DATE_DIR
+    from recording_control import RecordingControl
+    from stream_merger import StreamMerger, sample_offsets
+    from packet_log import PacketLog, raw_log_path
+    from telemetry import LinkTelemetry, stats_log_path
+    from scanner import AddressCache, SmarthubsNotFound, connect_pair, connect_smarthubs, reconnect_dropped
+
+
+# what each column of the ring holds, in the same names as RecordData's sample store
+CHANNELS = ('time_from_start', 'accel_left', 'accel_right', 'gyro_left', 'gyro_right')
+# how each channel is stored, here and in the SampleStores it ends up in. everything gets saved, so it all stays float64:
+# float32 can't hold the decoded values exactly (0.13 would be saved as 0.12999999523162842)
+CHANNEL_DTYPES = {channel: np.float64 for channel in CHANNELS}
+# uuid the smarthubs put their data on
+DATA_CHARACTERISTIC = "00002a56-0000-1000-8000-00805f9b34fb"
+# about an hour of samples at 68 Hz, 10 MB
+DEFAULT_CAPACITY = 2**18
+# int64 words in front of the samples: samples written so far, capacity
+HEADER_WORDS = 2
+
+
+class SampleRing:
+    """
+    decoded samples passed from the ble process to the gui in shared memory, one writer and one reader
+
+    functions:
+    write -> appends samples (ble process)
+    read -> views of everything written since the last read (gui), no copying
+
+    the writer only bumps the sample count once the samples are in place, so the reader never sees half a write.
+    views from read are only good until the writer comes back around to them (capacity samples later),
+    copy them somewhere (SampleStore.extend does) before reading again
+    if the reader falls more than capacity behind, the oldest samples are skipped and counted in overruns
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, name=None):
+        """
+        :param capacity: samples the ring holds, only used when making a new one
+                 name: shared memory block of an existing ring to attach to, None makes a new one
+        """
+        self._owner = name is None
+        if self._owner:
+            size = 8 * HEADER_WORDS + sum(np.dtype(dtype).itemsize for dtype in CHANNEL_DTYPES.values()) * capacity
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            # a spawned process shares its parent's resource tracker, so attaching here doesn't hand the block to anyone else
+            self._shm = shared_memory.SharedMemory(name=name)
+
+        self._header = np.ndarray((HEADER_WORDS,), dtype=np.int64, buffer=self._shm.buf)
+        if self._owner:
+            self._header[:] = (0, capacity)
+        self.capacity = int(self._header[1])
+        # one column per channel, one after the other, so each channel's slice of the ring is contiguous
+        self._columns = []
+        offset = 8 * HEADER_WORDS
+        for channel in CHANNELS:
+            dtype = np.dtype(CHANNEL_DTYPES[channel])
+            self._columns.append(np.ndarray((self.capacity,), dtype=dtype, buffer=self._shm.buf, offset=offset))
+            offset += dtype.itemsize * self.capacity
+
+        self._read = int(self._header[0])
+        self.overruns = 0
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @property
+    def written(self) -> int:
+        return int(self._header[0])
+
+    def __len__(self):
+        return self.written - self._read
+
+    def write(self, samples) -> None:
+        """
+        :param samples: (channels, k) array, rows in the order of CHANNELS
+        :returns None
+        """
+        samples = np.asarray(samples)[:, -self.capacity:]
+        k = samples.shape[1]
+        start = self.written
+        position = start % self.capacity
+        first = min(k, self.capacity - position)
+        for column, row in zip(self._columns, samples):
+            column[position:position + first] = row[:first]
+            column[:k - first] = row[first:]
+        # publish once the samples are in place
+        self._header[0] = start + k
+
+    def read(self) -> List[List[np.ndarray]]:
+        """
+        :returns read only views of everything written since the last read, one per channel in CHANNELS order,
+                 two lists of them if it wrapped around
+        """
+        end = self.written
+        start = self._read
+        if end - start > self.capacity:
+            self.overruns += end - start - self.capacity
+            start = end - self.capacity
+        self._read = end
+
+        segments = []
+        while start < end:
+            position = start % self.capacity
+            k = min(end - start, self.capacity - position)
+            views = [column[position:position + k] for column in self._columns]
+            for view in views:
+                view.flags.writeable = False
+            segments.append(views)
+            start += k
+        return segments
+
+    def close(self) -> None:
+        """
+        :param None
+        :returns None
+
+        views from read can't be held onto past this, the ring that made the block also removes it
+        """
+        if self._shm is None:
+            return
+        del self._header, self._columns
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+        self._shm = None
+
+
+def ingest_main(ring_name, commands, status, smarthub_id=None, addresses=None, ble_client=None, log_dir=DATE_DIR, publish_interval_s=0.05) -> None:
+    """
+    :param ring_name: shared memory name of the SampleRing to write into
+             commands: queue of ('start', log settings), 'stop' and 'close' from the gui
+             status: queue to send status messages back on, see IngestProcess
+             smarthub_id: id to connect to, from the address cache if it's there otherwise by scanning
+             addresses: (left, right) to connect to without scanning or the cache
+             ble_client: BleakClient or something that acts like it (SmarthubSimulator.client), defaults to BleakClient
+             log_dir: folder for the raw packet logs
+             publish_interval_s: how often decoded samples get written to the ring while recording
+    :returns None
+
+    entry point of the ble process, everything the record tab's ble thread does except touching tkinter
+    """
+    asyncio.run(_ingest(ring_name, commands, status, smarthub_id, addresses, ble_client, log_dir, publish_interval_s))
+
+
+async def _ingest(ring_name, commands, status, smarthub_id, addresses, ble_client, log_dir, publish_interval_s):
+    if ble_client is None:
+        from bleak import BleakClient as ble_client
+
+    ring = SampleRing(name=ring_name)
+    control = RecordingControl()
+    control.attach()
+    # log_settings for the next recording's packet log, the gui sends them along with 'start'
+    recording = {'settings': None}
+
+    def listen():
+        # blocking on the queue in its own thread keeps the event loop free for notifications
+        while True:
+            command = commands.get()
+            if isinstance(command, tuple):
+                command, recording['settings'] = command
+            if command == 'start':
+                control.start()
+            elif command == 'stop':
+                control.stop()
+            else:
+                control.close()
+                return
+
+    threading.Thread(target=listen, daemon=True).start()
+
+    if addresses is None:
+        pair = connect_smarthubs(smarthub_id, ble_client, AddressCache(), disconnected_callback=control.dropped)
+    else:
+        pair = connect_pair(ble_client, *addresses, disconnected_callback=control.dropped)
+
+    try:
+        async with pair as (left_client, right_client):
+            status.put(('connected', 'left'))
+            status.put(('connected', 'right'))
+
+            while await control.wait_until(RecordingControl.RECORDING, RecordingControl.CLOSED) == RecordingControl.RECORDING:
+                packet_log = PacketLog(raw_log_path(log_dir), recording['settings'])
+                status.put(('recording', packet_log.path))
+                stats, link_stats = await record_pair(control, left_client, right_client, packet_log, ring.write, publish_interval_s,
+                                                      on_link_stats=lambda snapshot: status.put(('link', snapshot)))
+                status.put(('recorded', stats, link_stats))
+
+            for side, client in (('left', left_client), ('right', right_client)):
+                if not client.is_connected:
+                    status.put(('disconnected', side))
+
+    except SmarthubsNotFound as e:
+        status.put(('found', e.left_found, e.right_found))
+    # bleak errors don't share a base class with anything we can import without bleak, so take everything
+    except Exception as e:
+        status.put(('error', f'{type(e).__name__}: {e}'))
+    finally:
+        ring.close()
+        status.put(('exited',))
+
+
+async def record_pair(control, left_client, right_client, packet_log, on_samples, publish_interval_s=0.05,
+                      on_link_stats=None, link_interval_s=1.0) -> Tuple[Dict, Dict]:
+    """
+    :param control: RecordingControl, recording runs until it leaves RECORDING
+             left_client, right_client: connected clients
+             packet_log: PacketLog for the raw notifications, closed once we're done
+             on_samples: called with a (channels, k) array (rows in CHANNELS order) whenever there are new samples
+             publish_interval_s: how often samples get merged and handed to on_samples
+             on_link_stats: called with a LinkTelemetry snapshot every link_interval_s while recording
+             link_interval_s: time (sec) between link stats, in the stats log next to the packet log as well
+    :returns StreamMerger stats and the final LinkTelemetry snapshot for the recording
+
+    one recording from a connected pair, from the start command until stop (or a disconnect we couldn't come back from)
+    times are sec since this was called, a smarthub dropping out leaves a gap in them (listed in the stats)
+    """
+    start_time = time.time()
+    merger = StreamMerger()
+    telemetry = LinkTelemetry(merger, stats_log_path(packet_log.path), link_interval_s)
+    last_link_stats = 0.0
+
+    def notify(side):
+        def callback(_, data):
+            time_received = time.time() - start_time
+            packet_log.append(side, time_received, data)
+            telemetry.notified(side, time_received, merger.push(side, time_received, data))
+        return callback
+
+    def publish(flush=False):
+        nonlocal last_link_stats
+        now = time.time() - start_time
+        merged = merger.drain(now, flush=flush)
+        telemetry.drained(now, merged.time)
+        if on_link_stats is not None and now - last_link_stats >= link_interval_s:
+            last_link_stats = now
+            on_link_stats(telemetry.snapshot())
+        if len(merged.time) > 0:
+            time_vals = merged.time[:, np.newaxis] - sample_offsets()
+            on_samples(np.stack([time_vals.ravel(), merged.accel_left.ravel(), merged.accel_right.ravel(),
+                                 merged.gyro_left.ravel(), merged.gyro_right.ravel()]))
+
+    async def resubscribe(side, client):
+        await client.start_notify(DATA_CHARACTERISTIC, notify(side))
+
+    await resubscribe('left', left_client)
+    await resubscribe('right', right_client)
+
+    while True:
+        state = await control.wait_until(RecordingControl.IDLE, RecordingControl.CLOSED, RecordingControl.RECONNECTING, timeout=publish_interval_s)
+        if state == RecordingControl.RECONNECTING:
+            await reconnect_dropped(control, {'left': left_client, 'right': right_client}, resubscribe,
+                                    lambda: time.time() - start_time, (merger, packet_log))
+        elif state == RecordingControl.RECORDING:
+            publish()
+        else:
+            break
+
+    for client in (left_client, right_client):
+        if client.is_connected:
+            await client.stop_notify(DATA_CHARACTERISTIC)
+    publish(flush=True)
+    packet_log.close()
+    telemetry.close()
+    return dict(merger.stats), telemetry.snapshot()
+
+
+class IngestProcess:
+    """
+    runs ble ingestion in its own process so redrawing the graphs can't hold up notifications
+
+    functions:
+    start -> launches the process, which scans (or goes straight to the given addresses) and connects
+    start_recording, stop_recording -> the same as the record button
+    messages -> status messages that have come in, doesn't block
+    wait_for -> blocks until a message of one kind comes in
+    close -> disconnects and shuts the process down
+
+    status messages are tuples, the first item says what happened:
+    ('found', left found, right found), ('connected', side), ('recording', packet log path),
+    ('link', LinkTelemetry snapshot) every second while recording, ('recorded', merge stats, final link stats),
+    ('disconnected', side), ('error', text), ('exited',)
+
+    samples show up in self.ring as they're decoded
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        # spawn on every os so the ble process never inherits a copy of tkinter
+        self._context = mp.get_context('spawn')
+        self.ring = SampleRing(capacity)
+        self._commands = self._context.Queue()
+        self._status = self._context.Queue()
+        self._waiting = collections.deque()
+        self._process = None
+
+    @property
+    def alive(self) -> bool:
+        return self._process is not None and self._process.is_alive()
+
+    def start(self, smarthub_id=None, addresses=None, ble_client=None, log_dir=DATE_DIR) -> None:
+        """
+        :param smarthub_id: id to scan for
+                 addresses: (left, right) to connect to without scanning
+                 ble_client: passed to the process, has to be picklable
+                 log_dir: folder for the raw packet logs
+        :returns None
+        """
+        self._process = self._context.Process(target=ingest_main,
+                                              args=(self.ring.name, self._commands, self._status),
+                                              kwargs={'smarthub_id': smarthub_id, 'addresses': addresses,
+                                                      'ble_client': ble_client, 'log_dir': log_dir},
+                                              daemon=True)
+        self._process.start()
+
+    def start_recording(self, settings=None) -> None:
+        """
+        :param settings: packet_log.log_settings the test is being recorded with, None for the defaults
+        :returns None
+        """
+        self._commands.put(('start', settings))
+
+    def stop_recording(self) -> None:
+        self._commands.put('stop')
+
+    def messages(self) -> List[Tuple]:
+        """
+        :returns every status message that has come in since the last call, oldest first
+        """
+        messages = list(self._waiting)
+        self._waiting.clear()
+        while True:
+            try:
+                messages.append(self._status.get_nowait())
+            except queue.Empty:
+                return messages
+
+    def wait_for(self, kind, timeout=2.0) -> Optional[Tuple]:
+        """
+        :param kind: first item of the message to wait for
+                 timeout: seconds to give up after
+        :returns the message, or None if it didn't come (other messages are kept for messages())
+        """
+        for i, message in enumerate(self._waiting):
+            if message[0] == kind:
+                del self._waiting[i]
+                return message
+
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                message = self._status.get(timeout=remaining)
+            except queue.Empty:
+                return None
+            if message[0] == kind:
+                return message
+            self._waiting.append(message)
+
+    def close(self, timeout=5.0) -> None:
+        """
+        :param timeout: seconds to let the process disconnect before it gets killed
+        :returns None
+        """
+        if self._process is not None:
+            self._commands.put('close')
+            self._process.join(timeout)
+            if self._process.is_alive():
+                self._process.terminate()
+            self._process = None
+        self.ring.close()
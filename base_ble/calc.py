@@ -1,4 +1,6 @@
 # Imports:
+from typing import NamedTuple
+
 import numpy as np
 
 # Load Wheelchair Measurements:
@@ -16,100 +18,350 @@ except ModuleNotFoundError:
     )
 
 
-def get_displacement_m(time_from_start, rot_l, rot_r, diameter=WHEEL_DIAM_IN, dist_wheels=DIST_WHEELS_IN):
-    rot_l = np.array(rot_l)  # Rotation of left wheel (converted to rps by Arduino)
-    rot_r = np.array(rot_r)  # Rotation of right wheel (converted to rps by Arduino)
-    time_from_start = np.array(time_from_start)  # Time (sec)
+class Geometry(NamedTuple):
+    """
+    wheelchair measurements used by the kinematics
+    diameter: wheel diameter (in)
+    dist_wheels: distance between the wheels (in)
+    """
+    diameter: float = WHEEL_DIAM_IN
+    dist_wheels: float = DIST_WHEELS_IN
 
-    # remove spikes
-    # gyro_data[gyro_data > 20] = 0
 
-    dist_m = [0]
-    for i in range(len(rot_r) - 1):
-        # Wheel rotation in time step:
-        dx_r = (rot_l[i]+rot_r[i])/2 * (time_from_start[i + 1] - time_from_start[i])
-        # Change in displacement over time step:
-        dx_m = dx_r * (diameter * IN_TO_M / 2)
-        # Append last change to overall Displacement:
-        dist_m.append(dx_m + dist_m[-1])
-    return dist_m
+class Kinematics(NamedTuple):
+    """
+    everything derived from one recording, one array per quantity
+    distance, displacement, velocity and heading have one value per sample
+    x and y have one value per time step (one less than the number of samples)
+    """
+    distance: np.ndarray
+    displacement: np.ndarray
+    velocity: np.ndarray
+    heading: np.ndarray
+    x: np.ndarray
+    y: np.ndarray
 
 
-def get_distance_m(time_from_start, rot_l, rot_r, diameter=WHEEL_DIAM_IN, dist_wheels=DIST_WHEELS_IN):
-    rot_l = np.array(rot_l)  # Rotation of left wheel (converted to rps by Arduino)
-    rot_r = np.array(rot_r)  # Rotation of right wheel (converted to rps by Arduino)
-    time_from_start = np.array(time_from_start)  # Time (sec)
-    # Remove direction to just get distance travelled:
-    rot_l = abs(rot_l)
-    rot_r = abs(rot_r)
+def _time_steps(time_from_start, n):
+    # Time elapsed between consecutive samples, one entry per integration step:
+    time_from_start = np.asarray(time_from_start, dtype=float)[:n]
+    return np.diff(time_from_start)
+
+
+def _integrate(steps, start=0.0):
+    # Running sum beginning at start, the same way the old loops appended to [start]
+    # (accumulating onto start keeps results identical whether the steps arrive at once or in pieces).
+    # Sums along the last axis, so a batch of recordings is one row each:
+    steps = np.asarray(steps, dtype=float)
+    start = np.broadcast_to(start, steps.shape[:-1] + (1,))
+    return np.cumsum(np.concatenate((start, steps), axis=-1), axis=-1)
+
+
+def _displacement_steps(rot_l, rot_r, dt, diameter):
+    # Wheel rotation in each time step:
+    dx_r = (rot_l + rot_r) / 2 * dt
+    # Change in displacement over each time step:
+    return dx_r * (diameter * IN_TO_M / 2)
 
-    # remove spikes
-    # gyro_data[gyro_data > 20] = 0
 
-    dist_m = [0]
-    for i in range(len(rot_r) - 1):
-        # Wheel rotation in time step:
-        dx_r = (rot_l[i]+rot_r[i])/2 * (time_from_start[i + 1] - time_from_start[i])
-        # Change in distance over time step:
-        dx_m = dx_r * (diameter * IN_TO_M / 2)
-        # Append last change to overall distance travelled:
-        dist_m.append(dx_m + dist_m[-1])
-    return dist_m
+def _velocity_values(rot_l, rot_r, diameter):
+    # Right wheel velocity:
+    v_r = rot_r * diameter/2*IN_TO_M
+    # Left wheel velocity:
+    v_l = rot_l * diameter/2*IN_TO_M
+    # Velocity of wheelchair:
+    return (v_r+v_l)/2
+
+
+def _heading_steps(rot_l, rot_r, dt, diameter, dist_wheels):
+    # Angular Velocity in each time step (rotating left is positive):
+    w = ((rot_r-rot_l) * diameter*IN_TO_M/2) / (dist_wheels*IN_TO_M)
+    # Change in heading angle over each time step:
+    dh = w * dt
+    # convert to degrees:
+    return dh*180/np.pi
+
+
+def _trajectory_steps(vel_ms, heading_deg, dt):
+    # Change in x and y position over each time step:
+    heading_rad = heading_deg*np.pi/180
+    return vel_ms*np.cos(heading_rad) * dt, vel_ms*np.sin(heading_rad) * dt
+
+
+def get_displacement_m(time_from_start, rot_l, rot_r, diameter=WHEEL_DIAM_IN, dist_wheels=DIST_WHEELS_IN):
+    rot_l = np.asarray(rot_l, dtype=float)  # Rotation of left wheel (converted to rps by Arduino)
+    rot_r = np.asarray(rot_r, dtype=float)  # Rotation of right wheel (converted to rps by Arduino)
+    n = len(rot_r)
+    if n < 1:
+        return np.zeros(1)
+    dt = _time_steps(time_from_start, n)  # Time (sec)
+
+    # Accumulate changes into overall displacement:
+    return _integrate(_displacement_steps(rot_l[:n - 1], rot_r[:n - 1], dt, diameter))
+
+
+def get_distance_m(time_from_start, rot_l, rot_r, diameter=WHEEL_DIAM_IN, dist_wheels=DIST_WHEELS_IN):
+    # Remove direction to just get distance travelled:
+    rot_l = np.abs(np.asarray(rot_l, dtype=float))
+    rot_r = np.abs(np.asarray(rot_r, dtype=float))
+    return get_displacement_m(time_from_start, rot_l, rot_r, diameter=diameter, dist_wheels=dist_wheels)
 
 
 def get_velocity_m_s(time_from_start, rot_l, rot_r, diameter=WHEEL_DIAM_IN, dist_wheels=DIST_WHEELS_IN):
-    rot_l = np.array(rot_l)  # Rotation of left wheel (converted to rps by Arduino)
-    rot_r = np.array(rot_r)  # Rotation of right wheel (converted to rps by Arduino)
-    time_from_start = np.array(time_from_start)  # Time (sec)
-
-    # remove spikes
-    # gyro_data[gyro_data > 20] = 0
-
-    vel_ms = [0]
-    for i in range(len(rot_r) - 1):
-        # Right wheel velocity:
-        v_r = (rot_r[i]) * diameter/2*IN_TO_M
-        # Left wheel velocity:
-        v_l = (rot_l[i]) * diameter/2*IN_TO_M
-        # Velocity of wheelchair over time:
-        v_curr = (v_r+v_l)/2
-        # Append last change to overall Displacement:
-        vel_ms.append(v_curr)
+    rot_l = np.asarray(rot_l, dtype=float)  # Rotation of left wheel (converted to rps by Arduino)
+    rot_r = np.asarray(rot_r, dtype=float)  # Rotation of right wheel (converted to rps by Arduino)
+    n = len(rot_r)
+
+    # Velocity of wheelchair over time, lagged by one sample:
+    vel_ms = np.zeros(max(n, 1))
+    vel_ms[1:] = _velocity_values(rot_l[:n - 1], rot_r[:n - 1], diameter)
     return vel_ms
 
 
 def get_heading_deg(time_from_start, rot_l, rot_r, diameter=WHEEL_DIAM_IN, dist_wheels=DIST_WHEELS_IN):
-    rot_l = np.array(rot_l)  # Rotation of left wheel (converted to rps by Arduino)
-    rot_r = np.array(rot_r)  # Rotation of right wheel (converted to rps by Arduino)
-    time_from_start = np.array(time_from_start)  # Time (sec)
-
-    heading_deg = [0]
-    for i in range(len(rot_r) - 1):
-        # Angular Velocity in time step (rotating left is positive):
-        w = ((rot_r[i]-rot_l[i]) * diameter*IN_TO_M/2) / (dist_wheels*IN_TO_M)
-        # Change in heading angle over time step:
-        dh = w * (time_from_start[i + 1] - time_from_start[i])
-        # convert to degrees:
-        dh = dh*180/np.pi
-        # Append last change to overall heading angle:
-        heading_deg.append(dh + heading_deg[-1])
-    return heading_deg
+    rot_l = np.asarray(rot_l, dtype=float)  # Rotation of left wheel (converted to rps by Arduino)
+    rot_r = np.asarray(rot_r, dtype=float)  # Rotation of right wheel (converted to rps by Arduino)
+    n = len(rot_r)
+    if n < 1:
+        return np.zeros(1)
+    dt = _time_steps(time_from_start, n)  # Time (sec)
+
+    # Accumulate changes into overall heading angle:
+    return _integrate(_heading_steps(rot_l[:n - 1], rot_r[:n - 1], dt, diameter, dist_wheels))
 
 
 def get_top_traj(disp_m, vel_ms, heading_deg, time_from_start, diameter=WHEEL_DIAM_IN, dist_wheels=DIST_WHEELS_IN):
-    x, y = [], []
-    dx, dy = 0, 0
-
-    for i in range(len(disp_m) - 1):
-        '''
-        dr = disp_m[i + 1] - disp_m[i]
-        dh = heading_deg[i] * np.pi / 180  # radian
-        dx += dr * np.cos(dh)
-        dy += dr * np.sin(dh)
-        '''
-        dx += vel_ms[i]*np.cos(heading_deg[i]*np.pi/180) * (time_from_start[i + 1] - time_from_start[i])
-        dy += vel_ms[i]*np.sin(heading_deg[i]*np.pi/180) * (time_from_start[i + 1] - time_from_start[i])
-        x.append(dx)
-        y.append(dy)
-    traj = [[x[i], y[i]] for i in range(len(x))]
+    """
+    returns an (n - 1, 2) array of [x, y] positions, one per time step
+    """
+    steps = max(len(disp_m) - 1, 0)
+    vel_ms = np.asarray(vel_ms, dtype=float)[:steps]
+    heading_deg = np.asarray(heading_deg, dtype=float)[:steps]
+    dt = _time_steps(time_from_start, steps + 1)
+
+    dx, dy = _trajectory_steps(vel_ms, heading_deg, dt)
+    traj = np.empty((steps, 2))
+    np.cumsum(dx, out=traj[:, 0])
+    np.cumsum(dy, out=traj[:, 1])
     return traj
+
+
+def compute_kinematics(time_from_start, rot_l, rot_r, geometry=Geometry(), trajectory=True) -> Kinematics:
+    """
+    :param time_from_start: sample times (sec)
+             rot_l: rotation of left wheel (rps)
+             rot_r: rotation of right wheel (rps)
+             geometry: Geometry with the wheel diameter and distance between the wheels
+             trajectory: set to False to skip x and y (returned as None) when only the other values are needed
+    :returns Kinematics with distance, displacement, velocity, heading, x and y
+
+    one pass version of get_distance_m, get_displacement_m, get_velocity_m_s, get_heading_deg and get_top_traj
+    gives the same numbers as calling each of them, but only converts the inputs and takes the time steps once
+    """
+    rot_l = np.asarray(rot_l, dtype=float)
+    rot_r = np.asarray(rot_r, dtype=float)
+    n = len(rot_r)
+    if n < 1:
+        empty = np.zeros(0) if trajectory else None
+        return Kinematics(np.zeros(1), np.zeros(1), np.zeros(1), np.zeros(1), empty, empty)
+    dt = _time_steps(time_from_start, n)
+    diameter, dist_wheels = geometry
+    l, r = rot_l[:n - 1], rot_r[:n - 1]
+
+    distance = _integrate(_displacement_steps(np.abs(l), np.abs(r), dt, diameter))
+    displacement = _integrate(_displacement_steps(l, r, dt, diameter))
+    heading = _integrate(_heading_steps(l, r, dt, diameter, dist_wheels))
+    velocity = np.zeros(n)
+    velocity[1:] = _velocity_values(l, r, diameter)
+
+    x, y = None, None
+    if trajectory:
+        dx, dy = _trajectory_steps(velocity[:n - 1], heading[:n - 1], dt)
+        x, y = np.cumsum(dx), np.cumsum(dy)
+
+    return Kinematics(distance, displacement, velocity, heading, x, y)
+
+
+def compute_kinematics_batch(time_from_start, rot_l, rot_r, geometry=Geometry(), left_gain=1.0, right_gain=1.0, trajectory=True) -> Kinematics:
+    """
+    :param time_from_start: sample times (sec) of the one recording
+             rot_l: rotation of left wheel (rps), before the gain
+             rot_r: rotation of right wheel (rps), before the gain
+             geometry: Geometry where diameter and dist_wheels can be arrays of candidate values
+             left_gain: left wheel gain, number or array of candidate values
+             right_gain: right wheel gain, number or array of candidate values
+             trajectory: set to False to skip x and y (returned as None)
+    :returns Kinematics where every field has one row per parameter set, shaped (params, samples)
+
+    runs compute_kinematics for many parameter sets against the same recording in one broadcast computation
+    the parameters get broadcast against each other, so any of them can stay a single number
+    row i matches compute_kinematics(time_from_start, rot_l*left_gain[i], rot_r*right_gain[i], Geometry(diameter[i], dist_wheels[i]))
+    this is meant for calibration, where the solver and its finite difference probes all look at the same data
+    """
+    rot_l = np.asarray(rot_l, dtype=float)
+    rot_r = np.asarray(rot_r, dtype=float)
+    # one column per parameter set, so they broadcast across the samples
+    params = np.broadcast_arrays(*(np.atleast_1d(np.asarray(v, dtype=float)) for v in (*geometry, left_gain, right_gain)))
+    diameter, dist_wheels, left_gain, right_gain = (param[:, np.newaxis] for param in params)
+    n_params = len(diameter)
+    n = len(rot_r)
+    if n < 1:
+        empty = np.zeros((n_params, 0)) if trajectory else None
+        return Kinematics(np.zeros((n_params, 1)), np.zeros((n_params, 1)), np.zeros((n_params, 1)), np.zeros((n_params, 1)), empty, empty)
+    dt = _time_steps(time_from_start, n)
+    l, r = rot_l[np.newaxis, :n - 1] * left_gain, rot_r[np.newaxis, :n - 1] * right_gain
+
+    distance = _integrate(_displacement_steps(np.abs(l), np.abs(r), dt, diameter))
+    displacement = _integrate(_displacement_steps(l, r, dt, diameter))
+    heading = _integrate(_heading_steps(l, r, dt, diameter, dist_wheels))
+    velocity = np.zeros((n_params, n))
+    velocity[:, 1:] = _velocity_values(l, r, diameter)
+
+    x, y = None, None
+    if trajectory:
+        dx, dy = _trajectory_steps(velocity[:, :n - 1], heading[:, :n - 1], dt)
+        x, y = np.cumsum(dx, axis=1), np.cumsum(dy, axis=1)
+
+    return Kinematics(distance, displacement, velocity, heading, x, y)
+
+
+def forward_difference_jacobian(batch_function, params, *args):
+    """
+    :param batch_function: function(params, *args) taking a (params, n) array and returning one row of results per parameter set
+             params: point to take the jacobian at
+             args: passed through to batch_function
+    :returns (results, n) jacobian, in the layout fsolve wants from fprime
+
+    forward differences like fsolve takes by default, but with every probe scored in a single batch_function call
+    """
+    params = np.asarray(params, dtype=float)
+    # same step size MINPACK picks when it estimates the jacobian itself
+    steps = np.sqrt(np.finfo(float).eps) * np.abs(params)
+    steps[steps == 0] = np.sqrt(np.finfo(float).eps)
+    probes = np.vstack((params, params + np.diag(steps)))
+    values = np.asarray(batch_function(probes, *args), dtype=float)
+    return ((values[1:] - values[0]) / steps[:, np.newaxis]).T
+
+
+class KinematicsIntegrator:
+    """
+    streaming version of compute_kinematics for live recording
+
+    functions:
+    update -> integrates only the samples that arrived since the last call
+    result -> Kinematics for everything integrated so far (read only views)
+
+    keeps the last sample and the running distance, displacement, heading and position between calls,
+    so every update costs the number of new samples instead of the length of the recording
+    feeding a recording through update in any number of pieces gives the exact same numbers as
+    compute_kinematics on the whole thing
+    """
+
+    _BUFFERS = ('_distance', '_displacement', '_velocity', '_heading', '_x', '_y')
+
+    def __init__(self, geometry=Geometry()):
+        self.geometry = geometry
+
+        # number of samples integrated so far
+        self.count = 0
+
+        # last sample seen, each integration step needs the next sample's time
+        self._last_time = None
+        self._last_rot_l = None
+        self._last_rot_r = None
+
+        # output buffers, grown by doubling so appending stays cheap
+        self._capacity = 0
+        for name in self._BUFFERS:
+            setattr(self, name, np.zeros(0))
+
+    def _reserve(self, n):
+        """
+        :param n: number of samples we need room for
+        :returns None
+
+        doubles the output buffers until n samples fit
+        """
+        if n <= self._capacity:
+            return
+        capacity = max(self._capacity, 1024)
+        while capacity < n:
+            capacity *= 2
+        for name in self._BUFFERS:
+            old = getattr(self, name)
+            new = np.empty(capacity)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        self._capacity = capacity
+
+    def update(self, time_from_start, rot_l, rot_r) -> int:
+        """
+        :param time_from_start: times (sec) of the new samples only
+                 rot_l: new left wheel rotation samples (rps)
+                 rot_r: new right wheel rotation samples (rps)
+        :returns number of new samples integrated
+
+        integrates the new samples onto the end of the running results
+        """
+        time_from_start = np.asarray(time_from_start, dtype=float)
+        rot_l = np.asarray(rot_l, dtype=float)
+        rot_r = np.asarray(rot_r, dtype=float)
+        k = min(len(time_from_start), len(rot_l), len(rot_r))
+        if k < 1:
+            return 0
+
+        diameter, dist_wheels = self.geometry
+        m = self.count
+        self._reserve(m + k)
+
+        if m == 0:
+            # first sample starts everything at zero
+            for buffer in (self._distance, self._displacement, self._velocity, self._heading):
+                buffer[0] = 0
+            t, l, r = time_from_start[:k], rot_l[:k], rot_r[:k]
+            start = 1
+        else:
+            # prepend the last sample we saw so the first step bridges the two calls
+            t = np.concatenate(([self._last_time], time_from_start[:k]))
+            l = np.concatenate(([self._last_rot_l], rot_l[:k]))
+            r = np.concatenate(([self._last_rot_r], rot_r[:k]))
+            start = m
+
+        dt = np.diff(t)
+        end = m + k
+        # index of the sample the first new step starts from
+        prev = start - 1
+        l, r = l[:-1], r[:-1]
+
+        # distance, displacement, heading and velocity for the new samples
+        self._distance[start:end] = _integrate(_displacement_steps(np.abs(l), np.abs(r), dt, diameter), self._distance[prev])[1:]
+        self._displacement[start:end] = _integrate(_displacement_steps(l, r, dt, diameter), self._displacement[prev])[1:]
+        self._heading[start:end] = _integrate(_heading_steps(l, r, dt, diameter, dist_wheels), self._heading[prev])[1:]
+        self._velocity[start:end] = _velocity_values(l, r, diameter)
+
+        # trajectory has one point per step (it trails the other outputs by one sample) and starts from 0, 0
+        dx, dy = _trajectory_steps(self._velocity[prev:end - 1], self._heading[prev:end - 1], dt)
+        x0, y0 = (self._x[prev - 1], self._y[prev - 1]) if prev > 0 else (0.0, 0.0)
+        self._x[prev:end - 1] = _integrate(dx, x0)[1:]
+        self._y[prev:end - 1] = _integrate(dy, y0)[1:]
+
+        self._last_time = time_from_start[k - 1]
+        self._last_rot_l = rot_l[k - 1]
+        self._last_rot_r = rot_r[k - 1]
+        self.count = end
+        return k
+
+    @property
+    def result(self) -> Kinematics:
+        """
+        :returns Kinematics of read only views into the buffers, they stay valid after later updates
+        """
+        if self.count == 0:
+            return compute_kinematics([], [], [], self.geometry)
+        views = []
+        for name in self._BUFFERS:
+            n = self.count - 1 if name in ('_x', '_y') else self.count
+            view = getattr(self, name)[:n]
+            view.flags.writeable = False
+            views.append(view)
+        return Kinematics(*views)
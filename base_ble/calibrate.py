@@ -10,11 +10,10 @@ try:
         IN_TO_M
     )
     from base_ble.calc import (
-        get_displacement_m,
-        get_distance_m,
-        get_velocity_m_s,
-        get_heading_deg,
-        get_top_traj
+        compute_kinematics,
+        compute_kinematics_batch,
+        forward_difference_jacobian,
+        Geometry
     )
 except ModuleNotFoundError:
     from params import (
@@ -23,11 +22,10 @@ except ModuleNotFoundError:
         IN_TO_M
     )
     from calc import (
-        get_displacement_m,
-        get_distance_m,
-        get_velocity_m_s,
-        get_heading_deg,
-        get_top_traj
+        compute_kinematics,
+        compute_kinematics_batch,
+        forward_difference_jacobian,
+        Geometry
     )
 
 def calibration_setup(calibration_list):
@@ -80,8 +78,8 @@ def minimize_function_broken(params, readings):
         #     distance_left += (gyro_left[i]*ml + bl) * (times[i+1] - times[i])
         #     distance_right += (gyro_right[i]*mr + br) * (times[i+1] - times[i])
 
-        distance_left = get_distance_m(times, gyro_left*ml+bl, gyro_left*ml+bl, D, W)
-        distance_right = get_distance_m(times, gyro_right*mr+br, gyro_right*mr+br, D, W)
+        distance_left = compute_kinematics(times, gyro_left*ml+bl, gyro_left*ml+bl, Geometry(D, W), trajectory=False).distance
+        distance_right = compute_kinematics(times, gyro_right*mr+br, gyro_right*mr+br, Geometry(D, W), trajectory=False).distance
 
         # dist_m = [0]
         # for i in range(len(gyro_right) - 1):
@@ -109,7 +107,7 @@ def minimize_function_broken(params, readings):
 
         length = len(times)
 
-        heading_left = get_heading_deg(times, gyro_left*ml+bl, gyro_right*mr+br, D, W)
+        heading_left = compute_kinematics(times, gyro_left*ml+bl, gyro_right*mr+br, Geometry(D, W), trajectory=False).heading
 
         left_headings += heading_left[-1]
 
@@ -125,7 +123,7 @@ def minimize_function_broken(params, readings):
 
         length = len(times)
 
-        heading_right = get_heading_deg(times, gyro_left*ml+bl, gyro_right*mr+br, D, W)
+        heading_right = compute_kinematics(times, gyro_left*ml+bl, gyro_right*mr+br, Geometry(D, W), trajectory=False).heading
         print(turnright['name'])
         print('headings: ', heading_right[-1])
 
@@ -154,9 +152,10 @@ def manual_calibration(params, calibration_list):
         gyro_left = pause['gyro_left']
         gyro_right = pause['gyro_right']
 
-        distance_left = get_distance_m(times, gyro_left, gyro_right, D, W)
-        distance_right = get_distance_m(times, gyro_right, gyro_right, D, W)
-        heading = get_heading_deg(times, gyro_left, gyro_right, D, W)
+        kinematics = compute_kinematics(times, gyro_left, gyro_right, Geometry(D, W), trajectory=False)
+        distance_left = kinematics.distance
+        distance_right = compute_kinematics(times, gyro_right, gyro_right, Geometry(D, W), trajectory=False).distance
+        heading = kinematics.heading
 
         print(distance_left[-1])
         print(distance_right[-1])
@@ -168,11 +167,11 @@ def manual_calibration(params, calibration_list):
     right_distances = []
     for forward in forwards:
         times = forward['time_from_start']
-        gyro_left = forward['gyro_left']
-        gyro_right = forward['gyro_right']
+        gyro_left = np.asarray(forward['gyro_left'])
+        gyro_right = np.asarray(forward['gyro_right'])
 
-        left_distances.append(get_distance_m(times, gyro_left*ml, gyro_left*ml, D, W)[-1])
-        right_distances.append(get_distance_m(times, gyro_right*mr, gyro_right*mr, D, W)[-1])
+        left_distances.append(compute_kinematics(times, gyro_left*ml, gyro_left*ml, Geometry(D, W), trajectory=False).distance[-1])
+        right_distances.append(compute_kinematics(times, gyro_right*mr, gyro_right*mr, Geometry(D, W), trajectory=False).distance[-1])
 
         print(left_distances[-1])
         print(right_distances[-1])
@@ -193,7 +192,7 @@ def manual_calibration(params, calibration_list):
 
         # distance_left = get_distance_m(times, gyro_left, gyro_right, D, W)
         # distance_right = get_distance_m(times, gyro_right, gyro_right, D, W)
-        headings.append(get_heading_deg(times, np.array(gyro_left)*ml, np.array(gyro_right)*mr, D, W)[-1])
+        headings.append(compute_kinematics(times, np.array(gyro_left)*ml, np.array(gyro_right)*mr, Geometry(D, W), trajectory=False).heading[-1])
 
         print(headings[-1])
 
@@ -214,7 +213,7 @@ def manual_calibration(params, calibration_list):
 
         # distance_left = get_distance_m(times, gyro_left, gyro_right, D, W)
         # distance_right = get_distance_m(times, gyro_right, gyro_right, D, W)
-        headings.append(get_heading_deg(times, np.array(gyro_left)*ml, np.array(gyro_right)*mr, D, W)[-1])
+        headings.append(compute_kinematics(times, np.array(gyro_left)*ml, np.array(gyro_right)*mr, Geometry(D, W), trajectory=False).heading[-1])
 
         print(headings[-1])
 
@@ -246,28 +245,16 @@ def show_calibration_traj(res, calibration_list):
         ax.clear()
         print('Calibration:', cal['name'])
 
-        distance = get_distance_m(cal['time_from_start'], cal['gyro_left'], cal['gyro_right'], diam, width)
-        print("Distance: ", distance[-1])
-
-        # Calculate displacement for the data['trajectory']:
-        displacement = get_displacement_m(cal['time_from_start'], cal['gyro_left'], cal['gyro_right'], diam, width)
-        print("Displacement: ", displacement[-1])
-
-        # Find heading angle over time:
-        heading = get_heading_deg(cal['time_from_start'], cal['gyro_left'], cal['gyro_right'], diam, width)
-        print("Heading: ", heading[-1])
-
-        velocity = get_velocity_m_s(cal['time_from_start'], cal['gyro_left'], cal['gyro_right'], diam, width)
-
-        trajectory = get_top_traj(displacement, velocity, heading, cal['time_from_start'], diam, width)
-
-        print(len(trajectory[0]), len(trajectory[1]))
+        kinematics = compute_kinematics(cal['time_from_start'], cal['gyro_left'], cal['gyro_right'], Geometry(diam, width))
+        print("Distance: ", kinematics.distance[-1])
+        print("Displacement: ", kinematics.displacement[-1])
+        print("Heading: ", kinematics.heading[-1])
 
         # plot the trajectory
         # plt.plot([i[0] for i in trajectory], [i[1] for i in trajectory], label="Trajectory")
         # fig, ax = plt.subplots()
 
-        ax.plot([i[0] for i in trajectory], [i[1] for i in trajectory], label="Trajectory")
+        ax.plot(kinematics.x, kinematics.y, label="Trajectory")
 
         # Set the x and y limits
         ax.set_xlim(-2, 8)
@@ -314,22 +301,12 @@ def show_entire_run(res, calibration_list):
     gyro_right = mr*np.array(gyro_right)+br
 
     fig, ax = plt.subplots()
-    distance = get_distance_m(times, gyro_left, gyro_right, diam, width)
-    print("Distance: ", distance[-1])
-
-    # Calculate displacement for the data['trajectory']:
-    displacement = get_displacement_m(times, gyro_left, gyro_right, diam, width)
-    print("Displacement: ", displacement[-1])
-
-    # Find heading angle over time:
-    heading = get_heading_deg(times, gyro_left, gyro_right, diam, width)
-    print("Heading: ", heading[-1])
-
-    velocity = get_velocity_m_s(times, gyro_left, gyro_right, diam, width)
-
-    trajectory = get_top_traj(displacement, velocity, heading, times, diam, width)
+    kinematics = compute_kinematics(times, gyro_left, gyro_right, Geometry(diam, width))
+    print("Distance: ", kinematics.distance[-1])
+    print("Displacement: ", kinematics.displacement[-1])
+    print("Heading: ", kinematics.heading[-1])
 
-    ax.plot([i[0] for i in trajectory], [i[1] for i in trajectory], label="Trajectory")
+    ax.plot(kinematics.x, kinematics.y, label="Trajectory")
 
     # Set the x and y limits
     # ax.set_xlim(-2, 8)
@@ -340,74 +317,75 @@ def show_entire_run(res, calibration_list):
     plt.show()
 
 def minimize_function(p, calibration_list):
-    D, W, ml, mr = p
-
-    br=0
-    bl=0
+    """
+    :param p: D, W, ml, mr
+             calibration_list: calibration steps recorded in the calibrate tab
+    :returns the four calibration errors, all 0 when p is right
+
+    fsolve target for the calibrate tab, the work happens in minimize_function_batch
+    """
+    return minimize_function_batch([p], calibration_list)[0].tolist()
+
+def minimize_function_batch(params, calibration_list):
+    """
+    :param params: one row of D, W, ml, mr per candidate
+             calibration_list: calibration steps recorded in the calibrate tab
+    :returns (candidates, 4) array, each row is what minimize_function gives for that candidate
+
+    every candidate is scored against a calibration step in the same compute_kinematics_batch call,
+    so a sweep or a jacobian costs one pass over the data per step instead of one per candidate
+    """
+    D, W, ml, mr = np.atleast_2d(np.asarray(params, dtype=float)).T
+    geometry = Geometry(D, W)
 
     forwards = [val for val in calibration_list if 'forward' in val['name']]
     turnrights = [val for val in calibration_list if 'turnright' in val['name']]
     turnlefts = [val for val in calibration_list if 'turnleft' in val['name']]
-    pauses = [val for val in calibration_list if 'pause' in val['name']]
 
-    left_distances = []
-    right_distances = []
+    left_distances = np.zeros(len(D))
+    right_distances = np.zeros(len(D))
     for forward in forwards:
         times = forward['time_from_start']
-        gyro_left = forward['gyro_left']
-        gyro_right = forward['gyro_right']
-
-        left_distances.append(get_distance_m(times, np.array(gyro_left)*ml+bl, np.array(gyro_left)*ml+bl, D, W)[-1])
-        right_distances.append(get_distance_m(times, np.array(gyro_right)*mr+br, np.array(gyro_right)*mr+br, D, W)[-1])
+        gyro_left = np.asarray(forward['gyro_left'])
+        gyro_right = np.asarray(forward['gyro_right'])
 
-        # print(left_distances[-1])
-        # print(right_distances[-1])
-        # print()
+        # each wheel on its own, as if both wheels turned like it
+        left_distances += compute_kinematics_batch(times, gyro_left, gyro_left, geometry, ml, ml, trajectory=False).distance[:, -1]
+        right_distances += compute_kinematics_batch(times, gyro_right, gyro_right, geometry, mr, mr, trajectory=False).distance[:, -1]
 
-    eq1 = 20 - np.sum(left_distances)
-    eq2 = 20 - np.sum(right_distances)
+    eq1 = 20 - left_distances
+    eq2 = 20 - right_distances
     # eq1 = 1 - 20/np.sum(left_distances)
     # eq2 = 1 - 20/np.sum(right_distances)
 
-    headings = []
+    right_headings = np.zeros(len(D))
     for right_calib in turnrights+forwards[0:2]:
-        times = right_calib['time_from_start']
-        gyro_left = right_calib['gyro_left']
-        gyro_right = right_calib['gyro_right']
-
-        # distance_left = get_distance_m(times, gyro_left, gyro_right, D, W)
-        # distance_right = get_distance_m(times, gyro_right, gyro_right, D, W)
-        headings.append(get_heading_deg(times, np.array(gyro_left)*ml+bl, np.array(gyro_right)*mr+br, D, W)[-1])
+        right_headings += compute_kinematics_batch(right_calib['time_from_start'], right_calib['gyro_left'], right_calib['gyro_right'],
+                                                   geometry, ml, mr, trajectory=False).heading[:, -1]
 
-        # print(headings[-1])
-
-        # # print(distance_left[-1])
-        # # print(distance_right[-1])
-        # print()
-
-    eq3 = 360 - (-np.sum(headings))
+    eq3 = 360 - (-right_headings)
     # eq3 = 1 - 360/-np.sum(headings)
 
-    headings = []
+    left_headings = np.zeros(len(D))
     for left_calib in turnlefts+forwards[2:4]:
-        times = left_calib['time_from_start']
-        gyro_left = left_calib['gyro_left']
-        gyro_right = left_calib['gyro_right']
-
-        headings.append(get_heading_deg(times, np.array(gyro_left)*ml+bl, np.array(gyro_right)*mr+br, D, W)[-1])
-
-        # print(headings[-1])
-        # print()
-
-    eq4 = 360 - np.sum(headings)    
+        left_headings += compute_kinematics_batch(left_calib['time_from_start'], left_calib['gyro_left'], left_calib['gyro_right'],
+                                                  geometry, ml, mr, trajectory=False).heading[:, -1]
 
+    eq4 = 360 - left_headings
     # eq4 = 1 - 360/np.sum(headings)
 
-
     eq1 = eq1*18
     eq2 = eq2*18
 
-    return [eq1, eq2, eq3, eq4]
+    return np.column_stack((eq1, eq2, eq3, eq4))
+
+def minimize_function_jacobian(p, calibration_list):
+    """
+    :param p: D, W, ml, mr
+             calibration_list: calibration steps recorded in the calibrate tab
+    :returns 4x4 jacobian of minimize_function, pass as fprime to fsolve
+    """
+    return forward_difference_jacobian(minimize_function_batch, p, calibration_list)
 
 def get_trajectories(res, calibration_list):
     D, W, ml, mr = res
@@ -420,7 +398,7 @@ def get_trajectories(res, calibration_list):
     times = []
     gyro_left = []
     gyro_right = []
-    full_trajectory = []
+    full_trajectory = np.zeros((0, 2))
     for run in calibration_list:
         if run['name'] == 'setposition':
             continue
@@ -432,11 +410,8 @@ def get_trajectories(res, calibration_list):
         # gyro_left = ml*np.array(gyro_left)+bl
         # gyro_right = mr*np.array(gyro_right)+br
 
-        displacement = get_displacement_m(times, gyro_left, gyro_right, D, W)
-        heading = get_heading_deg(times, gyro_left, gyro_right, D, W)
-        velocity = get_velocity_m_s(times, gyro_left, gyro_right, D, W)
-
-        trajectory = get_top_traj(displacement, velocity, heading, times, D, W)
+        kinematics = compute_kinematics(times, gyro_left, gyro_right, Geometry(D, W))
+        trajectory = np.column_stack((kinematics.x, kinematics.y))
         if len(trajectory) > 0:
             trajectories.append(trajectory[-1])
             full_trajectory = trajectory
@@ -444,7 +419,7 @@ def get_trajectories(res, calibration_list):
         print(run['name'])
         # ax.plot([i[0] for i in trajectories], [i[1] for i in trajectories], label="Trajectory")
         ax.clear()
-        ax.plot([i[0] for i in full_trajectory], [i[1] for i in full_trajectory], label="Trajectory")
+        ax.plot(full_trajectory[:, 0], full_trajectory[:, 1], label="Trajectory")
         plt.show(block=False)
         # ax.set_xlim(-2, 8)
         # ax.set_ylim(-2, 8)
@@ -454,7 +429,7 @@ def get_trajectories(res, calibration_list):
         input("Press Enter to continue...")
 
     print(trajectories)
-    ax.plot([i[0] for i in full_trajectory], [i[1] for i in full_trajectory], label="Trajectory")
+    ax.plot(full_trajectory[:, 0], full_trajectory[:, 1], label="Trajectory")
     plt.show(block = True)
     # ax.set_xlim(-2, 8)
     # ax.set_ylim(-2, 8)
@@ -488,7 +463,7 @@ if __name__ == '__main__':
     # show_calibration_traj([24,26,1,1,0,0], calibration_list)
     # print(manual_calibration([24,22.57,1,1,0,0], calibration_list))
 
-    f = fsolve(minimize_function, [24, 22.57, 1, 1], args=(calibration_list))
+    f = fsolve(minimize_function, [24, 22.57, 1, 1], args=(calibration_list), fprime=minimize_function_jacobian)
     print(f)
     get_trajectories(f, calibration_list)
 
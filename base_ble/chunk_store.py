@@ -0,0 +1,296 @@
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+# seconds of recording per chunk document, about 4000 samples, well under mongo's 16 MB even with every series in it
+CHUNK_S = 60
+# what every series in a chunk is cut by
+TIME_KEY = 'elapsed_time_s'
+# header fields that are only about how the test is stored, load_test leaves them out
+STORAGE_FIELDS = ('chunked', 'chunk_s', 'n_chunks', 'n_samples', 'duration_s', 'series')
+# tries for each insert before ChunkWriter gives up on it, and the wait before the first retry (sec, doubles each time)
+RETRIES = 4
+RETRY_S = 0.5
+
+
+def chunk_id(test_id, index) -> str:
+    return f'{test_id}#{index:05d}'
+
+
+def ensure_indexes(chunks) -> None:
+    """
+    :param chunks: mongo collection the chunks go in (database.Smarthub.test_chunks)
+    :returns None
+
+    reading a time range looks chunks up by test and start / end time, safe to call every time
+    """
+    chunks.create_index([('test_id', 1), ('index', 1)])
+    chunks.create_index([('test_id', 1), ('t0', 1), ('t1', 1)])
+
+
+class ChunkWriteError(Exception):
+    """
+    some of a test couldn't be saved even after retrying, the header isn't inserted so the test never shows up half saved
+    """
+
+
+class ChunkWriter:
+    """
+    saves one test as a header document plus one document per CHUNK_S of recording, so a test can be any length
+
+    functions:
+    write -> saves every chunk the recording has moved past, call it as often as you like while recording
+    finish -> saves the rest, adds the series only known at the end (smoothed gyro, kinematics) to the chunks already saved,
+              saves again any chunk that didn't go in, then inserts the header
+    discard -> stops the writing thread and deletes whatever chunks it saved (the test was thrown away)
+    close -> stops the writing thread without saving a header
+
+    the header goes in the usual test collection with the same _id and fields as before, minus the series, plus
+    chunked, chunk_s, n_chunks, n_samples, duration_s and series (the names of the series in the chunks).
+    chunks are {'_id': '<test id>#00003', 'test_id', 'index', 'start' (sample index), 'n', 't0', 't1', <series>: [...]}.
+    the header only goes in once everything is saved, so anything looking for tests never sees half of one.
+    inserts happen on a thread of their own so a slow connection never holds up the caller. each one is retried a few
+    times, and one that still fails is only noted, finish saves that chunk again from the whole recording
+    """
+
+    def __init__(self, collection, chunks, test_id, chunk_s=CHUNK_S, retries=RETRIES, retry_s=RETRY_S):
+        """
+        :param collection: mongo collection for the header (database.Smarthub.test_collection)
+                 chunks: mongo collection for the chunks (database.Smarthub.test_chunks)
+                 test_id: _id of the test
+                 chunk_s: seconds of recording per chunk
+                 retries: tries for each insert / update before giving up on it
+                 retry_s: wait before the first retry (sec), doubles every try after that
+        """
+        self.collection = collection
+        self.chunks = chunks
+        self.test_id = test_id
+        self.chunk_s = chunk_s
+        self.retries = retries
+        self.retry_s = retry_s
+
+        # (index, start, n) of every chunk cut so far
+        self.saved = []
+        # chunk index -> names of the series known to be in it, only touched by the writing thread until it's drained
+        self.stored = {}
+        # samples cut into chunks so far, and the chunk the next one goes in
+        self.written = 0
+        self.index = 0
+        # last thing that went wrong, for the message if finish can't save everything
+        self.error = None
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._queue.put((lambda: ensure_indexes(chunks), None))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                job, done = item
+                if self._retry(job) and done is not None:
+                    done()
+            finally:
+                self._queue.task_done()
+
+    def _retry(self, job) -> bool:
+        """
+        :returns True once job has gone through, False if every try failed
+        """
+        wait = self.retry_s
+        for attempt in range(self.retries):
+            try:
+                job()
+                return True
+            except Exception as e:
+                self.error = e
+                if attempt < self.retries - 1:
+                    time.sleep(wait)
+                    wait *= 2
+        return False
+
+    def _stored(self, index, names):
+        self.stored[index] = self.stored.get(index, set()) | set(names)
+
+    def _save_chunk(self, series, index, start, end):
+        time_s = series[TIME_KEY]
+        document = {'_id': chunk_id(self.test_id, index), 'test_id': self.test_id, 'index': index,
+                    'start': start, 'n': end - start, 't0': float(time_s[start]), 't1': float(time_s[end - 1])}
+        # copies, the caller's arrays can keep growing (or get thrown away) before the thread gets to them
+        for key, value in series.items():
+            document[key] = np.asarray(value[start:end]).tolist()
+        # replace rather than insert, a retry after an insert that went in but timed out anyway mustn't fail on the _id
+        self._queue.put((lambda: self.chunks.replace_one({'_id': document['_id']}, document, upsert=True),
+                         lambda: self._stored(index, series)))
+
+    def _write_until(self, series, end_index, final):
+        time_s = np.asarray(series[TIME_KEY])
+        while self.written < end_index:
+            # a chunk is done once a sample past its end has come in, at the end of the recording the last one is too
+            boundary = (self.index + 1) * self.chunk_s
+            if time_s[end_index - 1] < boundary:
+                if not final:
+                    return
+                end = end_index
+            else:
+                end = int(np.searchsorted(time_s[:end_index], boundary, side='left'))
+            if end > self.written:
+                self._save_chunk(series, self.index, self.written, end)
+                self.saved.append((self.index, self.written, end - self.written))
+                self.written = end
+            self.index += 1
+
+    def write(self, series: Dict[str, np.ndarray]) -> None:
+        """
+        :param series: everything recorded so far, elapsed_time_s plus the raw channels, all the same length
+        :returns None
+        """
+        if len(series[TIME_KEY]) == 0:
+            return
+        self._write_until(series, len(series[TIME_KEY]), final=False)
+
+    def _unsaved(self, series) -> List:
+        return [(index, start, count) for index, start, count in self.saved
+                if not set(series) <= self.stored.get(index, set())]
+
+    def finish(self, series: Dict[str, np.ndarray], **fields) -> str:
+        """
+        :param series: the whole recording, every series the test has (the ones already passed to write included), all the same length
+                 fields: everything else that goes in the header (user_id, test_name, merge_stats...)
+        :returns _id of the test, raises ChunkWriteError (after stopping the writing thread) if any of it couldn't be saved
+        """
+        n = min(len(value) for value in series.values())
+        series = {key: np.asarray(value)[:n] for key, value in series.items()}
+
+        # let everything write queued go through (or fail) first, so it's known which chunks made it
+        self._queue.join()
+        for index, start, count in self._unsaved(series):
+            missing = [key for key in series if key not in self.stored.get(index, set())]
+            if index in self.stored:
+                # only the series write never saw
+                update = {key: series[key][start:start + count].tolist() for key in missing}
+                self._queue.put((lambda index=index, update=update:
+                                 self.chunks.update_one({'_id': chunk_id(self.test_id, index)}, {'$set': update}),
+                                 lambda index=index, missing=missing: self._stored(index, missing)))
+            else:
+                # never went in, all of it again from the whole recording
+                self._save_chunk(series, index, start, start + count)
+
+        # whatever's left, with every series in it
+        self._write_until(series, n, final=True)
+        self._queue.join()
+
+        unsaved = [index for index, _, _ in self._unsaved(series)]
+        if unsaved:
+            self.close()
+            raise ChunkWriteError(f'chunks {unsaved} of test {self.test_id} could not be saved: {self.error}')
+
+        time_s = series[TIME_KEY]
+        header = {'_id': self.test_id}
+        header.update(fields)
+        header.update({'chunked': True, 'chunk_s': self.chunk_s, 'n_chunks': len(self.saved), 'n_samples': n,
+                       'duration_s': float(time_s[-1] - time_s[0]) if n else 0.0, 'series': list(series)})
+        self.close()
+        # the chunks are all in, the header is the one thing left to do
+        if not self._retry(lambda: self.collection.replace_one({'_id': self.test_id}, header, upsert=True)):
+            raise ChunkWriteError(f'header of test {self.test_id} could not be saved: {self.error}')
+        return self.test_id
+
+    def discard(self) -> None:
+        """
+        deletes every chunk saved for the test once the inserts still queued have gone in, without waiting for them
+        """
+        self._queue.put((lambda: self.chunks.delete_many({'test_id': self.test_id}), None))
+        self._queue.put(None)
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+
+def insert_test(collection, chunks, document, chunk_s=CHUNK_S) -> str:
+    """
+    :param collection, chunks: header and chunk collections
+             document: a whole test document (from test_document.to_document or the like)
+             chunk_s: seconds of recording per chunk
+    :returns _id of the test
+
+    saves a test that's already all in memory in chunks, for long SessionManager recordings
+    """
+    document = dict(document)
+    n = len(document[TIME_KEY])
+    series = {key: document.pop(key) for key in list(document)
+              if isinstance(document[key], (list, np.ndarray)) and len(document[key]) >= n}
+    test_id = document.pop('_id')
+    return ChunkWriter(collection, chunks, test_id, chunk_s).finish(series, **document)
+
+
+def load_test(collection, chunks, test_id, start_s=None, end_s=None, series: Optional[List[str]] = None) -> Optional[Dict]:
+    """
+    :param collection, chunks: header and chunk collections
+             test_id: _id of the test
+             start_s, end_s: only the samples between these times (sec), None for the start / end of the test
+             series: only these series (elapsed_time_s always comes too), None for all of them
+    :returns the test the same shape as an old single document (header fields and series as lists), None if there's no such test
+
+    only the chunks overlapping the time range are fetched. tests saved before chunking are single documents,
+    those come back as they are, cut to the time range and series the same way
+    """
+    header = collection.find_one({'_id': test_id})
+    if header is None:
+        return None
+    start = -np.inf if start_s is None else start_s
+    end = np.inf if end_s is None else end_s
+
+    if not header.get('chunked'):
+        if start_s is None and end_s is None and series is None:
+            return header
+        time_s = np.asarray(header[TIME_KEY])
+        lo, hi = int(np.searchsorted(time_s, start, side='left')), int(np.searchsorted(time_s, end, side='right'))
+        test = {}
+        for key, value in header.items():
+            # a series is any list at least as long as the time, the same as insert_test goes by
+            if not (isinstance(value, list) and len(value) >= len(time_s)):
+                test[key] = value
+            elif series is None or key == TIME_KEY or key in series:
+                test[key] = value[lo:hi]
+        return test
+
+    # a series the test doesn't have is left out, like a key missing from an old single document
+    names = header['series'] if series is None else [TIME_KEY] + [key for key in series
+                                                                  if key != TIME_KEY and key in header['series']]
+    query = {'test_id': test_id}
+    if start_s is not None:
+        query['t1'] = {'$gte': start_s}
+    if end_s is not None:
+        query['t0'] = {'$lte': end_s}
+    found = {key: [] for key in names}
+    for chunk in chunks.find(query, {key: 1 for key in names + ['n']}).sort('index', 1):
+        for key in names:
+            # a series missing from a chunk (saved before finish could add it) is nan for that stretch
+            value = chunk.get(key)
+            found[key].append(np.full(chunk['n'], np.nan) if value is None else np.asarray(value, dtype=float))
+
+    test = {key: value for key, value in header.items() if key not in STORAGE_FIELDS}
+    time_s = np.concatenate(found[TIME_KEY]) if found[TIME_KEY] else np.empty(0)
+    keep = (time_s >= start) & (time_s <= end)
+    for key in names:
+        test[key] = (np.concatenate(found[key])[keep] if found[key] else np.empty(0)).tolist()
+    return test
+
+
+def delete_test(collection, chunks, test_id) -> None:
+    """
+    :param collection, chunks: header and chunk collections
+             test_id: _id of the test
+    :returns None
+    """
+    collection.delete_one({'_id': test_id})
+    chunks.delete_many({'test_id': test_id})
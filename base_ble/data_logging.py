@@ -8,13 +8,8 @@ import asyncio
 from bleak import BleakScanner, BleakClient
 from params import DATE_DIR, DATE_NOW
 # Import the calculation functions:
-from calc import (
-    get_displacement_m,
-    get_distance_m,
-    get_velocity_m_s,
-    get_heading_deg,
-    get_top_traj
-)
+from calc import compute_kinematics
+from decode import decode_frames
 
 ch = "00002a56-0000-1000-8000-00805f9b34fb"
 
@@ -32,24 +27,9 @@ trajectory = []
 
 
 async def convert_from_raw(data):
-
-    accel_data = []
-    gyro_data = []
-
-    for i in range(4):
-        # accel_data.append(int.from_bytes(data[2*i+2:2*i+3], 'little')/1000)
-        # gyro_data.append(int.from_bytes(data[2*i+10:2*i+11], 'little')/100)
-
-        accel_data.append((data[2*i+2] + data[2*i+3]*256) / 1000)  # bytes 2, 4, 6, 8 convert to true accel data
-
-        gyro_data.append((data[2*i+10] + data[2*i+11]*256) / 100) # bytes 10, 12, 14, 16 convert to true gyro data
-
-        if (data[0] & (1 << i)) == (1 << i):
-            accel_data[i] *= -1
-
-        if (data[1] & (1 << i)) == (1 << i):
-            gyro_data[i] *= -1
-    return accel_data, gyro_data
+    # decode one 18 byte frame into 4 accel and 4 gyro readings:
+    accel_data, gyro_data = decode_frames(data)
+    return accel_data[0].tolist(), gyro_data[0].tolist()
 
 
 async def main():
@@ -113,16 +93,13 @@ async def main():
                     time_from_start.append(i*(time_curr-last_time)/4+last_time)
                 last_time = time_curr
 
-                # Derive distance based on data:
-                dist_m[:] = get_distance_m(time_from_start, gyro_left, gyro_right)
-                # Calculate displacement for the trajectory:
-                disp_m[:] = get_displacement_m(time_from_start, gyro_left, gyro_right)
-                # Find heading angle over time:
-                heading_deg[:] = get_heading_deg(time_from_start, gyro_left, gyro_right)
-                # Calculate Velocity over time:
-                velocity[:] = get_velocity_m_s(time_from_start, gyro_left, gyro_right)
-                # Process trajectory:
-                trajectory[:] = get_top_traj(disp_m, velocity, heading_deg, time_from_start)  # use displacement
+                # Derive distance, displacement, heading, velocity and trajectory based on data:
+                kinematics = compute_kinematics(time_from_start, gyro_left, gyro_right)
+                dist_m[:] = kinematics.distance
+                disp_m[:] = kinematics.displacement
+                heading_deg[:] = kinematics.heading
+                velocity[:] = kinematics.velocity
+                trajectory[:] = zip(kinematics.x, kinematics.y)
                 # Clear plots:
                 axs[0].clear()
                 axs[1].clear()
@@ -132,7 +109,7 @@ async def main():
                 # Create a plot of heading over time:
                 axs[1].plot(time_from_start, heading_deg)
                 # Create a plot of trajectory:
-                axs[2].plot([i[0] for i in trajectory], [i[1] for i in trajectory])
+                axs[2].plot(kinematics.x, kinematics.y)
                 plt.draw()
                 plt.pause(0.1)
 
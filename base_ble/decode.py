@@ -0,0 +1,49 @@
+from typing import Tuple
+
+import numpy as np
+
+
+# samples packed into one notification
+SAMPLES_PER_FRAME = 4
+# bytes in one notification
+FRAME_LEN = 18
+
+# layout of one notification, see RecordData.convert_from_raw for the byte by byte picture
+FRAME_DTYPE = np.dtype([
+    ('accel_sign', 'u1'),                   # bit i set -> accel sample i is negative
+    ('gyro_sign', 'u1'),                    # bit i set -> gyro sample i is negative
+    ('accel', '<u2', (SAMPLES_PER_FRAME,)), # unsigned, divide by 1000 to get true accel data
+    ('gyro', '<u2', (SAMPLES_PER_FRAME,)),  # unsigned, divide by 100 to get true gyro data
+])
+
+# bit that holds the sign of each sample, oldest first
+SIGN_BITS = 1 << np.arange(SAMPLES_PER_FRAME, dtype=np.uint8)
+
+
+def decode_frames(raw, accel_out=None, gyro_out=None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :param raw: one or more 18 byte frames, either back to back in one bytes object or as a list of frames
+             accel_out: optional (frames, 4) float array to decode the acceleration into
+             gyro_out: optional (frames, 4) float array to decode the gyro data into
+    :returns accel, gyro: (frames, 4) float arrays, one row per frame with the oldest sample first
+
+    decodes every frame at once, the same values RecordData.convert_from_raw gives one frame at a time
+    """
+    if not isinstance(raw, (bytes, bytearray, memoryview)):
+        raw = b''.join(raw)
+    if len(raw) % FRAME_LEN != 0:
+        raise ValueError(f"raw data is {len(raw)} bytes, expected a multiple of {FRAME_LEN}")
+
+    frames = np.frombuffer(raw, dtype=FRAME_DTYPE)
+    shape = (len(frames), SAMPLES_PER_FRAME)
+    accel = np.empty(shape) if accel_out is None else accel_out
+    gyro = np.empty(shape) if gyro_out is None else gyro_out
+    if accel.shape != shape or gyro.shape != shape:
+        raise ValueError(f"output arrays must be shaped {shape}")
+
+    np.divide(frames['accel'], 1000, out=accel)
+    np.negative(accel, out=accel, where=(frames['accel_sign'][:, np.newaxis] & SIGN_BITS) != 0)
+    np.divide(frames['gyro'], 100, out=gyro)
+    np.negative(gyro, out=gyro, where=(frames['gyro_sign'][:, np.newaxis] & SIGN_BITS) != 0)
+    return accel, gyro
+
@@ -0,0 +1,246 @@
+from functools import lru_cache
+from typing import Dict, Optional
+
+import numpy as np
+from scipy.ndimage import median_filter
+from scipy.signal import butter, savgol_coeffs, sosfilt, sosfilt_zi, sosfiltfilt
+
+try:
+    from base_ble.stream_merger import SAMPLE_RATE_HZ
+except ModuleNotFoundError:
+    from stream_merger import SAMPLE_RATE_HZ
+
+
+# cutoff of the low pass on the gyro data before integrating (Hz)
+LOWPASS_HZ = 6
+# butterworth order, 4 rolls off about as fast as we can without ringing on a push
+LOWPASS_ORDER = 4
+
+
+def sample_rate(time_from_start, default=SAMPLE_RATE_HZ) -> float:
+    """
+    :param time_from_start: sample times (sec)
+             default: what to use if the times don't say (fewer than two samples)
+    :returns samples per second
+
+    from the median time between samples rather than the first two, so one late frame or a reconnect gap doesn't throw it off
+    """
+    time_from_start = np.ravel(time_from_start)
+    if len(time_from_start) < 2:
+        return float(default)
+    step = np.median(np.diff(time_from_start))
+    return float(1 / step) if step > 0 else float(default)
+
+
+@lru_cache(maxsize=64)
+def butter_lowpass(cutoff_hz=LOWPASS_HZ, rate_hz=SAMPLE_RATE_HZ, order=LOWPASS_ORDER) -> np.ndarray:
+    """
+    :param cutoff_hz: cutoff (Hz)
+             rate_hz: samples per second
+             order: filter order
+    :returns (sections, 6) second order sections, which stay stable where a single high order polynomial wouldn't
+
+    designed once per cutoff, rate and order, the array is shared so don't change it
+    (scipy's sosfilt won't take a read only one)
+    """
+    return butter(order, cutoff_hz, btype='low', fs=rate_hz, output='sos')
+
+
+@lru_cache(maxsize=64)
+def _fft_keep(n, rate_hz, cutoff_hz) -> np.ndarray:
+    keep = np.fft.rfftfreq(n, d=1 / rate_hz) <= cutoff_hz
+    keep.flags.writeable = False
+    return keep
+
+
+@lru_cache(maxsize=64)
+def _savgol_coeffs(window, polyorder) -> np.ndarray:
+    coeffs = savgol_coeffs(window, polyorder)
+    coeffs.flags.writeable = False
+    return coeffs
+
+
+class FFTLowpass:
+    """
+    brick wall low pass, zeroes every frequency above cutoff_hz in the real fft of the recording and transforms back
+
+    it rings around sharp changes (a push) and treats the recording as if it wrapped around, so the end bleeds into
+    the start. ButterworthLowpass is the default, pick this one with make_filter({'name': 'fft'}) to compare against it
+    """
+
+    def __init__(self, cutoff_hz=LOWPASS_HZ):
+        self.cutoff_hz = cutoff_hz
+
+    def __call__(self, values, rate_hz=SAMPLE_RATE_HZ) -> np.ndarray:
+        n = values.shape[-1]
+        spectrum = np.fft.rfft(values, axis=-1)
+        spectrum *= _fft_keep(n, float(rate_hz), float(self.cutoff_hz))
+        return np.fft.irfft(spectrum, n=n, axis=-1)
+
+
+class ButterworthLowpass:
+    """
+    butterworth low pass in second order sections, run forwards then backwards so nothing gets shifted in time
+
+    StreamingLowpass is the same filter one way only, for live data
+    """
+
+    def __init__(self, cutoff_hz=LOWPASS_HZ, order=LOWPASS_ORDER):
+        self.cutoff_hz = cutoff_hz
+        self.order = order
+
+    def __call__(self, values, rate_hz=SAMPLE_RATE_HZ) -> np.ndarray:
+        sos = butter_lowpass(float(self.cutoff_hz), float(rate_hz), int(self.order))
+        # the default padding is longer than a very short recording
+        padlen = min(3 * (2 * len(sos) + 1), values.shape[-1] - 1)
+        return sosfiltfilt(sos, values, axis=-1, padlen=padlen)
+
+
+class SavitzkyGolay:
+    """
+    fits a polynomial over a sliding window, keeps the height of peaks (pushes) better than a low pass of the same smoothness
+    """
+
+    def __init__(self, window_s=0.25, polyorder=2):
+        """
+        :param window_s: window length (sec), rounded to an odd number of samples
+                 polyorder: order of the polynomial fit in each window
+        """
+        self.window_s = window_s
+        self.polyorder = polyorder
+
+    def __call__(self, values, rate_hz=SAMPLE_RATE_HZ) -> np.ndarray:
+        # odd and long enough for the polynomial
+        window = max(int(round(self.window_s * rate_hz)) | 1, (self.polyorder + 2) | 1)
+        if values.shape[-1] < window:
+            return values.copy()
+        # scipy's savgol_filter redesigns the coefficients every call, these are cached per window
+        coeffs = _savgol_coeffs(window, int(self.polyorder))
+        half = window // 2
+        padded = np.pad(values, [(0, 0)] * (values.ndim - 1) + [(half, half)], mode='edge')
+        windows = np.lib.stride_tricks.sliding_window_view(padded, window, axis=-1)
+        return windows @ coeffs[::-1]
+
+
+class MedianDespike:
+    """
+    replaces lone spikes (a corrupted frame, a knock on the wheel) with the median around them, everything else is untouched
+    """
+
+    def __init__(self, window=5, threshold=6.0):
+        """
+        :param window: samples in the running median, odd
+                 threshold: how many (robust) standard deviations away from the running median counts as a spike
+        """
+        self.window = window
+        self.threshold = threshold
+
+    def __call__(self, values, rate_hz=SAMPLE_RATE_HZ) -> np.ndarray:
+        size = (1,) * (values.ndim - 1) + (self.window,)
+        median = median_filter(values, size=size, mode='nearest')
+        residual = np.abs(values - median)
+        # median absolute deviation, scaled to match a standard deviation for gaussian noise
+        spread = 1.4826 * np.median(residual, axis=-1, keepdims=True)
+        spikes = residual > self.threshold * np.maximum(spread, np.finfo(float).eps)
+        return np.where(spikes, median, values)
+
+
+class FilterChain:
+    """
+    runs several filters one after the other, e.g. MedianDespike then ButterworthLowpass
+    """
+
+    def __init__(self, *filters):
+        self.filters = filters
+
+    def __call__(self, values, rate_hz=SAMPLE_RATE_HZ) -> np.ndarray:
+        for f in self.filters:
+            values = f(values, rate_hz)
+        return values
+
+
+# name -> filter class, for picking one in config.json
+FILTERS = {
+    'fft': FFTLowpass,
+    'butterworth': ButterworthLowpass,
+    'savgol': SavitzkyGolay,
+    'median': MedianDespike,
+}
+
+
+def make_filter(spec: Optional[Dict] = None):
+    """
+    :param spec: {'name': one of FILTERS, plus that filter's arguments}, a list of them to chain, None for the default
+    :returns filter to pass to smooth
+
+    e.g. "gyro_filter": [{"name": "median"}, {"name": "butterworth", "cutoff_hz": 5}] in config.json
+    """
+    if spec is None:
+        return ButterworthLowpass()
+    if isinstance(spec, (list, tuple)):
+        return FilterChain(*(make_filter(s) for s in spec))
+    params = dict(spec)
+    name = params.pop('name')
+    if name not in FILTERS:
+        raise ValueError(f"unknown filter {name}, expected one of {sorted(FILTERS)}")
+    return FILTERS[name](**params)
+
+
+def smooth(values, time_from_start=None, smoothing=None) -> np.ndarray:
+    """
+    :param values: (n,) samples, or (channels, n) to do several channels (left and right) in one call
+             time_from_start: sample times (sec) for the sample rate, nominal 68 Hz if not given
+             smoothing: filter from make_filter (or any function of (values, rate_hz)), defaults to ButterworthLowpass
+    :returns smoothed values, the same shape
+
+    the one place whole recordings get smoothed: saving a test, calibration, replaying a packet log
+    """
+    values = np.asarray(values, dtype=float)
+    if values.shape[-1] < 2:
+        return values.copy()
+    rate_hz = SAMPLE_RATE_HZ if time_from_start is None else sample_rate(time_from_start)
+    smoothing = ButterworthLowpass() if smoothing is None else smoothing
+    return smoothing(values, rate_hz)
+
+
+class StreamingLowpass:
+    """
+    causal low pass for live data, only ever filters the samples that are new since the last call
+
+    functions:
+    process -> filters the next block of samples, carrying the filter state over from the block before
+    reset -> forgets the state, the next block starts a new signal
+
+    samples that have been through process never change, so anything drawn or integrated from them stays put.
+    being causal it lags the signal a little (about 70 ms at 6 Hz). once the whole recording is in, smooth with
+    ButterworthLowpass is the same filter run forwards and backwards, without the lag
+    """
+
+    def __init__(self, cutoff_hz=LOWPASS_HZ, rate_hz=SAMPLE_RATE_HZ, order=LOWPASS_ORDER):
+        """
+        :param cutoff_hz: cutoff (Hz)
+                 rate_hz: samples per second
+                 order: filter order
+        """
+        self.sos = butter_lowpass(cutoff_hz, rate_hz, order)
+        self._zi = None
+
+    def reset(self) -> None:
+        self._zi = None
+
+    def process(self, samples) -> np.ndarray:
+        """
+        :param samples: (k,) new samples, or (channels, k) to filter several channels (left and right) at once
+        :returns filtered samples, the same shape
+        """
+        samples = np.asarray(samples, dtype=float)
+        if samples.shape[-1] == 0:
+            return samples.copy()
+        if self._zi is None:
+            # start as if the signal had been sitting at its first value forever, so there's no jump from 0
+            zi = sosfilt_zi(self.sos)
+            zi = zi.reshape((len(zi),) + (1,) * (samples.ndim - 1) + (2,))
+            self._zi = zi * samples[np.newaxis, ..., 0, np.newaxis]
+        filtered, self._zi = sosfilt(self.sos, samples, axis=-1, zi=self._zi)
+        return filtered
+
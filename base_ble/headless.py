@@ -0,0 +1,255 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import signal
+import time
+from datetime import datetime
+from typing import Dict
+
+try:
+    from base_ble.params import DATA_DIR, DATE_DIR, left_gain, right_gain
+    from base_ble.calc import Geometry
+    from base_ble.scanner import AddressCache
+    from base_ble.session_manager import SessionManager
+    from base_ble.simulator import SmarthubSimulator
+except ModuleNotFoundError:
+    from params import DATA_DIR, DATE_DIR, left_gain, right_gain
+    from calc import Geometry
+    from scanner import AddressCache
+    from session_manager import SessionManager
+    from simulator import SmarthubSimulator
+
+
+class JsonCollection:
+    """
+    stands in for a mongo collection when there's no database, one json file per test document
+
+    functions:
+    insert_one -> writes the document to <directory>/<_id>.json
+    """
+
+    class InsertOneResult:
+        def __init__(self, inserted_id):
+            self.inserted_id = inserted_id
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def insert_one(self, document) -> 'JsonCollection.InsertOneResult':
+        # ids look like 5/14/2024_13:2:7_1234, which isn't a file name on every os
+        name = re.sub(r'[^\w.-]', '-', str(document['_id']))
+        path = os.path.join(self.directory, f'{name}.json')
+        with open(path, 'w') as f:
+            json.dump(document, f)
+        return self.InsertOneResult(document['_id'])
+
+
+def session_status(manager) -> Dict:
+    """
+    :param manager: SessionManager
+    :returns status of every pair, what gets printed and written to the status file
+    """
+    status = {'time': datetime.now().isoformat(timespec='seconds'), 'pairs': {}}
+    for smarthub_id, session in manager.sessions.items():
+        pair = {'status': session.status, 'samples': len(session.data)}
+        if len(session.data) > 0:
+            pair['seconds'] = round(float(session.data['time_from_start'][-1]), 1)
+        link = session.link_stats
+        if link:
+            pair['rate_hz'] = [round(link[side]['rate_hz'], 1) for side in ('left', 'right')]
+            pair['missing'] = [link[side]['missing'] for side in ('left', 'right')]
+            pair['gaps'] = link['gaps']
+        status['pairs'][smarthub_id] = pair
+    return status
+
+
+def write_status(path, status) -> None:
+    # write then rename, so whatever is watching the file never reads half of it
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(status, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+async def record(manager, collection, duration_s=None, split_s=None, status_path=None, status_interval_s=5.0,
+                 scan_timeout=5.0, chunks=None, **fields) -> int:
+    """
+    :param manager: SessionManager with every pair added
+             collection: where the tests go, a mongo collection or JsonCollection
+             duration_s: total seconds to record for, None records until ctrl-c / SIGTERM (or every pair drops)
+             split_s: longest single test (sec), long sessions get saved as several tests so a crash only loses the last one
+             status_path: json file to keep the status in, as well as printing it
+             status_interval_s: seconds between status updates
+             scan_timeout: seconds to scan for pairs that aren't in the address cache
+             chunks: mongo collection to save tests in a minute at a time, None to save each as one document (see SessionManager.save)
+             fields: added to every test document (user_id, test_name, additional_notes...)
+    :returns number of tests saved
+
+    the same connect, merge, decode, filter and save steps as the record tab, without tkinter
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, AttributeError, ValueError):
+            # windows, ctrl-c comes through as KeyboardInterrupt instead
+            pass
+
+    def report():
+        status = session_status(manager)
+        print(json.dumps(status))
+        if status_path is not None:
+            write_status(status_path, status)
+        return status
+
+    task = asyncio.create_task(manager.run(scan_timeout))
+    await manager.wait_connected()
+    report()
+
+    saved = 0
+    session_start = time.monotonic()
+    try:
+        while not stop.is_set() and not task.done():
+            manager.start()
+            test_start = time.monotonic()
+            while not stop.is_set() and not task.done():
+                try:
+                    await asyncio.wait_for(stop.wait(), status_interval_s)
+                except asyncio.TimeoutError:
+                    pass
+                status = report()
+                now = time.monotonic()
+                if duration_s is not None and now - session_start >= duration_s:
+                    stop.set()
+                elif split_s is not None and now - test_start >= split_s:
+                    break
+                elif all(pair['status'] not in ('connected', 'recording') for pair in status['pairs'].values()):
+                    # nothing left to record from
+                    stop.set()
+
+            manager.stop()
+            await manager.wait_recorded(timeout=10.0)
+            ids = manager.save(collection, chunks=chunks, **fields)
+            saved += len(ids)
+            print(f'saved {", ".join(str(_id) for _id in ids) or "nothing"}')
+    finally:
+        manager.close()
+        await task
+        report()
+    return saved
+
+
+def parse_args() -> Dict:
+    parser = argparse.ArgumentParser(description='record smarthub tests without the gui')
+    parser.add_argument("smarthub_ids",
+                        help='ids of the smarthub pairs to record, each pair is saved as its own test',
+                        nargs='+',
+                        type=str)
+    parser.add_argument("--duration", '-d',
+                        help='seconds to record for, records until ctrl-c if not given',
+                        required=False,
+                        type=float)
+    parser.add_argument("--split",
+                        help='longest single test (sec), longer sessions are saved as several tests',
+                        required=False,
+                        type=float)
+    parser.add_argument("--output", '-o',
+                        help='folder to save tests to as json, used when there is no --mongo_uri or --cert',
+                        default=os.path.join(DATA_DIR, 'tests'),
+                        type=str)
+    parser.add_argument("--mongo_uri",
+                        help='save tests to this mongo database instead of to --output',
+                        required=False,
+                        type=str)
+    parser.add_argument("--cert",
+                        help='.pem certificate to log into the smarthub database with, the same as the gui',
+                        required=False,
+                        type=str)
+    parser.add_argument("--status_file",
+                        help='json file to keep the current status in',
+                        required=False,
+                        type=str)
+    parser.add_argument("--status_interval",
+                        help='seconds between status updates',
+                        default=5.0,
+                        type=float)
+    parser.add_argument("--log_dir",
+                        help='folder for the raw packet logs',
+                        default=DATE_DIR,
+                        type=str)
+    parser.add_argument("--user_id",
+                        required=False,
+                        type=str)
+    parser.add_argument("--test_name",
+                        required=False,
+                        type=str)
+    parser.add_argument("--notes",
+                        help='saved as additional_notes',
+                        default='',
+                        type=str)
+    parser.add_argument("--diameter",
+                        help='wheel diameter (in)',
+                        default=Geometry().diameter,
+                        type=float)
+    parser.add_argument("--dist_wheels",
+                        help='distance between the wheels (in)',
+                        default=Geometry().dist_wheels,
+                        type=float)
+    # the same defaults the gui records with when no calibration is picked
+    parser.add_argument("--left_gain",
+                        default=left_gain,
+                        type=float)
+    parser.add_argument("--right_gain",
+                        default=right_gain,
+                        type=float)
+    parser.add_argument("--simulate",
+                        help='record from simulated smarthubs instead of bluetooth (see base_ble/simulator.py)',
+                        action='store_true')
+    return vars(parser.parse_args())
+
+
+def open_collection(args):
+    if args['mongo_uri'] is None and args['cert'] is None:
+        return JsonCollection(args['output']), None, None
+    # only needed when saving to the database
+    from pymongo import MongoClient
+    if args['cert'] is not None:
+        uri = args['mongo_uri'] or "mongodb+srv://smarthub.gbdlpxs.mongodb.net/?authSource=$external&authMechanism=MONGODB-X509"
+        client = MongoClient(uri, tls=True, tlsCertificateKeyFile=args['cert'])
+    else:
+        client = MongoClient(args['mongo_uri'])
+    # tests go in as a header plus a chunk per minute, the same as the record tab saves them
+    return client.Smarthub.test_collection, client.Smarthub.test_chunks, client
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    collection, chunks, client = open_collection(args)
+    if args['simulate']:
+        # a bit longer than we're recording for, the simulated smarthubs "drop" when they run out of frames
+        simulator = SmarthubSimulator(duration=(args['duration'] or 3600) + 10)
+        manager = SessionManager(simulator.client)
+    else:
+        manager = SessionManager(cache=AddressCache())
+
+    geometry = Geometry(args['diameter'], args['dist_wheels'])
+    for smarthub_id in args['smarthub_ids']:
+        manager.add(smarthub_id, addresses=('left', 'right') if args['simulate'] else None, geometry=geometry,
+                    left_gain=args['left_gain'], right_gain=args['right_gain'], log_dir=args['log_dir'])
+
+    fields = {'user_id': args['user_id'], 'additional_notes': args['notes']}
+    if args['test_name']:
+        fields['test_name'] = args['test_name']
+
+    try:
+        saved = asyncio.run(record(manager, collection, args['duration'], args['split'], args['status_file'],
+                                   args['status_interval'], chunks=chunks, **fields))
+        print(f'{saved} tests saved')
+    finally:
+        if client is not None:
+            client.close()
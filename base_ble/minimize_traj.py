@@ -10,10 +10,12 @@ import math
 
 
 try:
-    from base_ble.calc import get_displacement_m, get_distance_m, get_velocity_m_s, get_top_traj, get_heading_deg
+    from base_ble.calc import compute_kinematics, compute_kinematics_batch, forward_difference_jacobian, get_velocity_m_s, Geometry
+    from base_ble.chunk_store import load_test
     from gui.view_data_tab import ViewData
 except ModuleNotFoundError:
-    from calc import get_displacement_m, get_distance_m, get_velocity_m_s, get_top_traj, get_heading_deg
+    from calc import compute_kinematics, compute_kinematics_batch, forward_difference_jacobian, get_velocity_m_s, Geometry
+    from chunk_store import load_test
     from ..gui.view_data_tab import ViewData
 
 from scipy.spatial import cKDTree
@@ -44,8 +46,25 @@ def compute_net_loss(points1, points2):
     return rms_distance
 
 def minimize_turnaround(params, test):
-    ml, mr, W = params
+    """
+    :param params: ml, mr, W
+             test: turnaround test with time and smoothed gyro data
+    :returns net_loss, net_distance_error, turn_loss
+
+    fsolve target for the new calibrate tab, the work happens in minimize_turnaround_batch
+    """
+    return minimize_turnaround_batch([params], test)[0].tolist()
+
+def minimize_turnaround_batch(params, test):
+    """
+    :param params: one row of ml, mr, W per candidate
+             test: turnaround test with time and smoothed gyro data
+    :returns (candidates, 3) array, each row is what minimize_turnaround gives for that candidate
 
+    the kinematics for every candidate come out of one compute_kinematics_batch call,
+    only the nearest point losses are still worked out one candidate at a time
+    """
+    ml, mr, W = np.atleast_2d(np.asarray(params, dtype=float)).T
 
     if 'elapsed_time_s' in test:
         time_from_start = np.array(test['elapsed_time_s'])
@@ -60,18 +79,14 @@ def minimize_turnaround(params, test):
     rot_l = np.array(test['gyro_left_smoothed'])[:min_len]
     rot_r = np.array(test['gyro_right_smoothed'])[:min_len]
 
-    disp_m = np.array(get_displacement_m(time_from_start, rot_l*ml, rot_r*mr, dist_wheels=W, diameter=1))
-    heading = np.array(get_heading_deg(time_from_start, rot_l*ml, rot_r*mr, dist_wheels=W, diameter=1))
-    velocity = np.array(get_velocity_m_s(time_from_start, rot_l*ml, rot_r*mr, dist_wheels=W, diameter=1))
-    traj = np.array(get_top_traj(disp_m, velocity, heading, time_from_start, dist_wheels=W, diameter=1))
+    kinematics = compute_kinematics_batch(time_from_start, rot_l, rot_r, Geometry(diameter=1, dist_wheels=W), ml, mr)
 
     # finds the start and end of the turnaround, make it constant between runs
     if not hasattr(minimize_turnaround, "start_turn"):
-        heading_diff = [0]
-        for i in range(1, len(heading)):
-            heading_diff.append(heading[i] - heading[i-1])
+        heading = kinematics.heading[0]
+        heading_diff = np.diff(heading, prepend=heading[0])
 
-        turning_points = np.where(np.abs(np.array(heading_diff)) > 0.1)
+        turning_points = np.where(np.abs(heading_diff) > 0.1)
         if turning_points:
             minimize_turnaround.start_turn, minimize_turnaround.end_turn = (largest_consecutive_group(turning_points[0])[0], largest_consecutive_group(turning_points[0])[-1])
             print(time_from_start[minimize_turnaround.start_turn], time_from_start[minimize_turnaround.end_turn])
@@ -79,35 +94,35 @@ def minimize_turnaround(params, test):
     start_turn = minimize_turnaround.start_turn
     end_turn = minimize_turnaround.end_turn
 
-    print(10 - (disp_m[start_turn] + (disp_m[-1] - disp_m[end_turn])))
+    losses = np.empty((len(ml), 3))
+    for i, disp_m in enumerate(kinematics.displacement):
+        traj = np.column_stack((kinematics.x[i], kinematics.y[i]))
 
-    # net_distance_error = (10 - (disp_m[start_turn] + (disp_m[-1] - disp_m[end_turn])))
-    net_distance_error = (10 - disp_m[-1])
+        # net_distance_error = (10 - (disp_m[start_turn] + (disp_m[-1] - disp_m[end_turn])))
+        net_distance_error = (10 - disp_m[-1])
 
-    halfway_point = disp_m[-1] / 2
+        first_half = traj[:start_turn]
+        second_half = traj[end_turn:]
 
-    # quarter_point = disp_m[-1] / 4
-    # three_quarter_point = disp_m[-1] * 3 / 4
+        straight_line_start = np.linspace(np.array([0,0]), np.array(first_half[-1]), 3000)
+        straight_line_end = np.linspace(np.array(second_half[0]), np.array([0,0]), 3000)
 
-    distance_error = 5 - halfway_point
+        turn_loss = (compute_net_loss(first_half, straight_line_start) + compute_net_loss(second_half, straight_line_end)) / 2
 
-    first_half = traj[:start_turn]
-    second_half = traj[end_turn:]
+        # Compute the net loss between the two halves
+        net_loss = compute_net_loss(first_half, second_half)
 
-    straight_line_start = np.linspace(np.array([0,0]), np.array(first_half[-1]), 3000)
-    straight_line_end = np.linspace(np.array(second_half[0]), np.array([0,0]), 3000)
+        losses[i] = net_loss, net_distance_error, turn_loss
 
-    turn_loss = (compute_net_loss(first_half, straight_line_start) + compute_net_loss(second_half, straight_line_end)) / 2
-
-    # Compute the net loss between the two halves
-    net_loss = compute_net_loss(first_half, second_half)
+    return losses
 
-    # print()
-    # print(net_loss, distance_error, turn_loss)
-    # print(net_loss, net_distance_error, turn_loss)
-
-    # return net_loss, distance_error, heading_diff
-    return net_loss, net_distance_error, turn_loss
+def minimize_turnaround_jacobian(params, test):
+    """
+    :param params: ml, mr, W
+             test: turnaround test with time and smoothed gyro data
+    :returns 3x3 jacobian of minimize_turnaround, pass as fprime to fsolve
+    """
+    return forward_difference_jacobian(minimize_turnaround_batch, params, test)
 
 def minimize_turnaround_bias(params, tests):
     ml, mr, al, ar, W = params
@@ -130,24 +145,22 @@ def minimize_turnaround_bias(params, tests):
     rot_l = np.array(turnaround['gyro_left_smoothed'])[:min_len]
     rot_r = np.array(turnaround['gyro_right_smoothed'])[:min_len]
 
-    left_velocity = np.array(get_velocity_m_s(time_from_start, rot_l, rot_l, dist_wheels=W, diameter=1))
-    right_velocity = np.array(get_velocity_m_s(time_from_start, rot_r, rot_r, dist_wheels=W, diameter=1))
+    left_velocity = get_velocity_m_s(time_from_start, rot_l, rot_l, dist_wheels=W, diameter=1)
+    right_velocity = get_velocity_m_s(time_from_start, rot_r, rot_r, dist_wheels=W, diameter=1)
 
     rot_l = rot_l * ml - al * (left_velocity - right_velocity)
     rot_r = rot_r * mr - ar * (right_velocity - left_velocity)
 
-    disp_m = np.array(get_displacement_m(time_from_start, rot_l, rot_r, dist_wheels=W, diameter=1))
-    heading = np.array(get_heading_deg(time_from_start, rot_l, rot_r, dist_wheels=W, diameter=1))
-    velocity = np.array(get_velocity_m_s(time_from_start, rot_l, rot_r, dist_wheels=W, diameter=1))
-    traj = np.array(get_top_traj(disp_m, velocity, heading, time_from_start, dist_wheels=W, diameter=1))
+    kinematics = compute_kinematics(time_from_start, rot_l, rot_r, Geometry(diameter=1, dist_wheels=W))
+    disp_m = kinematics.displacement
+    heading = kinematics.heading
+    traj = np.column_stack((kinematics.x, kinematics.y))
 
     # finds the start and end of the turnaround, make it constant between runs
     if not hasattr(minimize_turnaround, "start_turn"):
-        heading_diff = [0]
-        for i in range(1, len(heading)):
-            heading_diff.append(heading[i] - heading[i-1])
+        heading_diff = np.diff(heading, prepend=heading[0])
 
-        turning_points = np.where(np.abs(np.array(heading_diff)) > 0.1)
+        turning_points = np.where(np.abs(heading_diff) > 0.1)
         minimize_turnaround.start_turn, minimize_turnaround.end_turn = (largest_consecutive_group(turning_points[0])[0], largest_consecutive_group(turning_points[0])[-1])
         print(minimize_turnaround.start_turn, minimize_turnaround.end_turn)
 
@@ -181,16 +194,16 @@ def minimize_turnaround_bias(params, tests):
     rot_l = np.array(loop['gyro_left_smoothed'])[:min_len]
     rot_r = np.array(loop['gyro_right_smoothed'])[:min_len]
 
-    left_velocity = np.array(get_velocity_m_s(time_from_start, rot_l, rot_l, dist_wheels=W, diameter=1))
-    right_velocity = np.array(get_velocity_m_s(time_from_start, rot_r, rot_r, dist_wheels=W, diameter=1))
+    left_velocity = get_velocity_m_s(time_from_start, rot_l, rot_l, dist_wheels=W, diameter=1)
+    right_velocity = get_velocity_m_s(time_from_start, rot_r, rot_r, dist_wheels=W, diameter=1)
 
     rot_l = rot_l * ml + al * (left_velocity - right_velocity)
     rot_r = rot_r * mr + ar * (right_velocity - left_velocity)
 
-    disp_m = np.array(get_displacement_m(time_from_start, rot_l, rot_r, dist_wheels=W, diameter=1))
-    heading = np.array(get_heading_deg(time_from_start, rot_l, rot_r, dist_wheels=W, diameter=1))
-    velocity = np.array(get_velocity_m_s(time_from_start, rot_l, rot_r, dist_wheels=W, diameter=1))
-    traj = np.array(get_top_traj(disp_m, velocity, heading, time_from_start, dist_wheels=W, diameter=1))
+    kinematics = compute_kinematics(time_from_start, rot_l, rot_r, Geometry(diameter=1, dist_wheels=W))
+    disp_m = kinematics.displacement
+    heading = kinematics.heading
+    traj = np.column_stack((kinematics.x, kinematics.y))
 
 
     traj_loss = (traj[-1][0]**2 + traj[-1][1]**2)**0.5
@@ -254,7 +267,8 @@ def get_runs(database):
 
         index = 0
 
-        test_data = dict(test[index])
+        # newer tests are just a header in test_collection, the data is in test_chunks
+        test_data = load_test(test_collection, database.Smarthub.test_chunks, test[index]['_id'])
 
         test_data['velocity'] = get_velocity_m_s(test_data['elapsed_time_s'], np.array(test_data['gyro_left_smoothed'])*original_params[0], np.array(test_data['gyro_right_smoothed'])*original_params[1], dist_wheels=original_params[2], diameter=1)
 
@@ -347,13 +361,9 @@ def display_multiple_trajectories(tests, params=None):
 
         
 
-        dist_m = get_distance_m(time_from_start, rot_l, rot_r, dist_wheels=W, diameter=1)
-        heading = get_heading_deg(time_from_start, rot_l, rot_r, dist_wheels=W, diameter=1)
-        velocity = get_velocity_m_s(time_from_start, rot_l, rot_r, dist_wheels=W, diameter=1)
-        traj = get_top_traj(dist_m, velocity, heading, time_from_start, dist_wheels=W, diameter=1)
-
-        traj_x = [x[0] for x in traj]
-        traj_y = [x[1] for x in traj]
+        kinematics = compute_kinematics(time_from_start, rot_l, rot_r, Geometry(diameter=1, dist_wheels=W))
+        traj_x = kinematics.x
+        traj_y = kinematics.y
 
         axs[i // fig_width, i % fig_width].plot(traj_x, traj_y, color="blue")
 
@@ -436,16 +446,15 @@ def display_trajectory(test, params=None, show=True):
 
     
 
-    dist_m = get_distance_m(time_from_start, rot_l, rot_r, dist_wheels=W, diameter=D)
-    test['dist_m'] = dist_m
-    disp_m = get_displacement_m(time_from_start, rot_l, rot_r, dist_wheels=W, diameter=D)
-    test['disp_m'] = disp_m
-    heading = get_heading_deg(time_from_start, rot_l, rot_r, dist_wheels=W, diameter=D)
-    test['heading'] = heading
-    velocity = get_velocity_m_s(time_from_start, rot_l, rot_r, dist_wheels=W, diameter=D)
-    test['velocity'] = velocity
-    traj = get_top_traj(dist_m, velocity, heading, time_from_start, dist_wheels=W, diameter=D)
-    test['traj'] = traj
+    kinematics = compute_kinematics(time_from_start, rot_l, rot_r, Geometry(diameter=D, dist_wheels=W))
+    heading = kinematics.heading
+    velocity = kinematics.velocity
+    traj = np.column_stack((kinematics.x, kinematics.y))
+    test['dist_m'] = kinematics.distance.tolist()
+    test['disp_m'] = kinematics.displacement.tolist()
+    test['heading'] = heading.tolist()
+    test['velocity'] = velocity.tolist()
+    test['traj'] = traj.tolist()
 
     axs[0,0].plot(time_from_start, velocity, color="blue")
 
@@ -468,8 +477,8 @@ def display_trajectory(test, params=None, show=True):
     with open("data.json", "w") as json_file:
         json.dump(test, json_file, indent=2)
 
-    traj_x = [x[0] for x in traj]
-    traj_y = [x[1] for x in traj]
+    traj_x = traj[:, 0]
+    traj_y = traj[:, 1]
 
     # print(disp_m[-1], traj[-1])
 
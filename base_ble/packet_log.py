@@ -0,0 +1,290 @@
+import argparse
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Tuple
+
+import numpy as np
+
+try:
+    from base_ble.params import DATE_DIR, DATETIME_HMS_FMT, left_gain as LEFT_GAIN, right_gain as RIGHT_GAIN
+    from base_ble.decode import FRAME_LEN
+    from base_ble.stream_merger import StreamMerger, merge_summary, sample_offsets, SIDES
+    from base_ble.calc import Geometry
+    from base_ble.filters import make_filter
+    from base_ble.test_document import build_test, to_document
+except ModuleNotFoundError:
+    from params import DATE_DIR, DATETIME_HMS_FMT, left_gain as LEFT_GAIN, right_gain as RIGHT_GAIN
+    from decode import FRAME_LEN
+    from stream_merger import StreamMerger, merge_summary, sample_offsets, SIDES
+    from calc import Geometry
+    from filters import make_filter
+    from test_document import build_test, to_document
+
+
+# first bytes of every log file, bump the number if the layout changes
+MAGIC = b'SHLOG\x00\x02\x00'
+# logs from before the settings header, the records start straight after it
+MAGIC_V1 = b'SHLOG\x00\x01\x00'
+# after MAGIC: the length of the settings (json, see log_settings), then the settings, then the records
+SETTINGS_LEN_DTYPE = np.dtype('<u4')
+
+# one record per notification, packed with no padding (27 bytes)
+RECORD_DTYPE = np.dtype([
+    ('side', 'u1'),                 # index into SIDES, 0 left 1 right, or one of the gap markers below
+    ('time', '<f8'),                # host time (sec since the recording started) the notification arrived
+    ('frame', 'u1', (FRAME_LEN,)),  # the notification exactly as the smarthub sent it
+])
+
+# side values of the records marking a smarthub dropping out and notifications running again, frame is all zeros
+GAP_START = 254
+GAP_END = 255
+
+
+def log_settings(geometry=Geometry(), left_gain=LEFT_GAIN, right_gain=RIGHT_GAIN, gyro_filter=None) -> Dict:
+    """
+    :param geometry: wheel diameter and distance between the wheels (in) the test is recorded with
+             left_gain, right_gain: calibration gains the test is recorded with
+             gyro_filter: make_filter spec the saved gyro data gets smoothed with ("gyro_filter" in config.json), None for the default
+    :returns what goes in a log's header, so replay_log rebuilds the test the recording would have saved
+    """
+    return {'diameter': float(geometry.diameter), 'dist_wheels': float(geometry.dist_wheels),
+            'left_gain': float(left_gain), 'right_gain': float(right_gain), 'gyro_filter': gyro_filter}
+
+
+def raw_log_path(directory=DATE_DIR, suffix='') -> str:
+    """
+    :param directory: where to put the log, defaults to today's data folder
+             suffix: added after the time, to tell apart logs started in the same second
+    :returns path for a new log named after the current time
+    """
+    return os.path.join(directory, f"raw_{datetime.now().strftime(DATETIME_HMS_FMT)}{suffix}.shlog")
+
+
+class PacketLog:
+    """
+    append only file of every raw notification, written while we record so a crash doesn't lose the test
+
+    the file starts with MAGIC and the settings the test is being recorded with (log_settings), then one record per notification
+
+    functions:
+    append -> writes one notification (called from the ble thread)
+    begin_gap, end_gap -> marks where a smarthub dropped out and where we got it back
+    sync -> pushes everything written so far to the disk
+    close -> syncs and closes, appends after this are ignored
+
+    fsync is slow, so it only happens every sync_every records or sync_interval_s seconds, whichever comes first, and on
+    a thread of its own, append only ever writes into the file's buffer and never waits on the disk.
+    a crash loses at most that much, and a half written record at the end of the file is skipped by read_log
+    """
+
+    def __init__(self, path, settings=None, sync_every=64, sync_interval_s=1.0):
+        """
+        :param path: file to append to, the folder gets made if it doesn't exist
+                 settings: from log_settings, None for the defaults (only written when the file is new)
+                 sync_every: records between fsyncs
+                 sync_interval_s: longest time (sec) between fsyncs while records are coming in
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval_s = sync_interval_s
+        self.count = 0
+
+        # _lock guards the file and the counts, _sync_lock keeps the file open while an fsync is running on it
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._record = np.zeros(1, dtype=RECORD_DTYPE)
+        self._unsynced = 0
+
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'ab')
+        if new_file:
+            header = json.dumps(log_settings() if settings is None else settings).encode()
+            self._file.write(MAGIC + np.array(len(header), dtype=SETTINGS_LEN_DTYPE).tobytes() + header)
+            self.sync()
+
+        # wakes the flusher early once sync_every records are waiting
+        self._wake = threading.Event()
+        self._closing = False
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    def append(self, side, time_received, message) -> None:
+        """
+        :param side: 'left' or 'right'
+                 time_received: time (sec) the notification arrived
+                 message: 18 byte frame
+        :returns None
+        """
+        self._write(SIDES.index(side), time_received, np.frombuffer(message, dtype=np.uint8))
+
+    def begin_gap(self, time_lost) -> None:
+        self._write(GAP_START, time_lost, 0)
+        self.sync()
+
+    def end_gap(self, time_back) -> None:
+        self._write(GAP_END, time_back, 0)
+
+    def _write(self, side, time_received, frame):
+        with self._lock:
+            if self._file.closed:
+                return
+            record = self._record[0]
+            record['side'] = side
+            record['time'] = time_received
+            record['frame'] = frame
+            self._file.write(self._record.tobytes())
+            self.count += 1
+            self._unsynced += 1
+            if self._unsynced >= self.sync_every:
+                self._wake.set()
+
+    def _flush_loop(self):
+        while not self._closing:
+            self._wake.wait(self.sync_interval_s)
+            self._wake.clear()
+            if self._unsynced:
+                self.sync()
+
+    def sync(self) -> None:
+        with self._sync_lock:
+            with self._lock:
+                if self._file.closed:
+                    return
+                self._file.flush()
+                self._unsynced = 0
+            # appends carry on into the buffer while this waits on the disk
+            os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._closing = True
+        self._wake.set()
+        self._flusher.join()
+        with self._sync_lock, self._lock:
+            if not self._file.closed:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+
+
+def _read(path) -> Tuple[Dict, np.ndarray]:
+    with open(path, 'rb') as f:
+        raw = f.read()
+    body = memoryview(raw)[len(MAGIC):]
+    if raw.startswith(MAGIC):
+        size = SETTINGS_LEN_DTYPE.itemsize
+        length = int(np.frombuffer(body[:size], dtype=SETTINGS_LEN_DTYPE)[0])
+        settings = json.loads(bytes(body[size:size + length]))
+        body = body[size + length:]
+    elif raw.startswith(MAGIC_V1):
+        settings = {}
+    else:
+        raise ValueError(f"{path} is not a smarthub packet log")
+    whole = len(body) // RECORD_DTYPE.itemsize * RECORD_DTYPE.itemsize
+    return settings, np.frombuffer(body[:whole], dtype=RECORD_DTYPE)
+
+
+def read_log(path) -> np.ndarray:
+    """
+    :param path: log written by PacketLog
+    :returns structured array of RECORD_DTYPE, in the order they were written
+
+    a record cut off by a crash at the end of the file is dropped
+    """
+    return _read(path)[1]
+
+
+def read_settings(path) -> Dict:
+    """
+    :param path: log written by PacketLog
+    :returns log_settings the test was recorded with, the defaults filled in for anything missing (logs from before there was a header)
+    """
+    settings = log_settings()
+    settings.update(_read(path)[0])
+    return settings
+
+
+def replay_log(path, geometry=None, left_gain=None, right_gain=None, smoothing=None, merger=None) -> Dict:
+    """
+    :param path: log written by PacketLog
+             geometry: wheel diameter and distance between the wheels (in)
+             left_gain, right_gain: calibration gains applied to the smoothed gyro data
+             smoothing: filter for the gyro data from filters.make_filter
+             merger: StreamMerger to line the two sides up with (defaults to a new one)
+    :returns test dictionary with the same fields RecordData.save_data posts (minus user info), as numpy arrays
+
+    runs the raw notifications back through the same merge, decode, filter and kinematics steps as a live recording.
+    anything left as None is what the log says the test was recorded with
+    """
+    settings, records = _read(path)
+    recorded = log_settings()
+    recorded.update(settings)
+    if geometry is None:
+        geometry = Geometry(recorded['diameter'], recorded['dist_wheels'])
+    left_gain = recorded['left_gain'] if left_gain is None else left_gain
+    right_gain = recorded['right_gain'] if right_gain is None else right_gain
+    smoothing = make_filter(recorded['gyro_filter']) if smoothing is None else smoothing
+
+    merger = StreamMerger() if merger is None else merger
+    for record in records:
+        if record['side'] == GAP_START:
+            merger.begin_gap(float(record['time']))
+        elif record['side'] == GAP_END:
+            merger.end_gap(float(record['time']))
+        else:
+            merger.push(SIDES[record['side']], float(record['time']), record['frame'].tobytes())
+    merged = merger.drain(np.inf, flush=True)
+    if len(merged.time) < 1:
+        raise ValueError(f"{path} has no complete frames")
+
+    time_from_start = merged.time[:, np.newaxis] - sample_offsets()
+    test = build_test(time_from_start, merged.accel_left, merged.accel_right, merged.gyro_left, merged.gyro_right,
+                      geometry, left_gain, right_gain, smoothing)
+    test['merge_stats'] = dict(merger.stats)
+    return test
+
+
+def parse_args() -> Dict:
+    parser = argparse.ArgumentParser(description='rebuild a test from a raw smarthub packet log')
+    parser.add_argument("log",
+                        help='.shlog file written while recording',
+                        type=str)
+    parser.add_argument("--output", '-o',
+                        help='json file to write the rebuilt test to',
+                        required=False,
+                        type=str)
+    # everything below defaults to what the log was recorded with
+    parser.add_argument("--diameter",
+                        help='wheel diameter (in), defaults to the one in the log',
+                        type=float)
+    parser.add_argument("--dist_wheels",
+                        help='distance between the wheels (in), defaults to the one in the log',
+                        type=float)
+    parser.add_argument("--left_gain",
+                        help='defaults to the one in the log',
+                        type=float)
+    parser.add_argument("--right_gain",
+                        help='defaults to the one in the log',
+                        type=float)
+    return vars(parser.parse_args())
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    settings = read_settings(args['log'])
+    for key in ('diameter', 'dist_wheels', 'left_gain', 'right_gain'):
+        if args[key] is None:
+            args[key] = settings[key]
+    print(f"diameter {args['diameter']}, dist_wheels {args['dist_wheels']}, "
+          f"gains {args['left_gain']} / {args['right_gain']}, gyro_filter {settings['gyro_filter']}")
+
+    test = replay_log(args['log'], Geometry(args['diameter'], args['dist_wheels']), args['left_gain'], args['right_gain'])
+    print(f"{len(test['elapsed_time_s'])} samples over {test['elapsed_time_s'][-1]:.1f} s, {test['distance_m'][-1]:.2f} m")
+    print(f"merged {merge_summary(test['merge_stats'])}")
+
+    if args['output']:
+        with open(args['output'], 'w') as f:
+            json.dump(to_document(test), f)
@@ -0,0 +1,125 @@
+import asyncio
+
+
+class RecordingControl:
+    """
+    start / stop / disconnect state shared between the tk buttons and the ble event loop
+
+    functions:
+    attach -> binds to the running ble event loop, call it once the smarthubs are connected
+    start, stop, close -> change state, safe to call from the tk thread (or the bleak disconnect callback)
+    dropped -> bleak disconnect callback that asks for a reconnect instead of closing if we're in the middle of a recording
+    resume -> back to RECORDING once the reconnect worked
+    wait_until -> sleeps in the ble loop until we reach one of the given states
+
+    states:
+    IDLE -> connected but not recording
+    RECORDING -> notifications should be running
+    RECONNECTING -> a smarthub dropped out while recording, see reconnect_dropped in base_ble/scanner.py
+    CLOSED -> smarthub disconnected or connection being torn down, nothing changes the state after this
+
+    waiting doesn't poll, the ble loop gets woken up by the state change itself,
+    so an idle connection costs nothing while the operator is filling in the test details
+    """
+
+    IDLE = 'idle'
+    RECORDING = 'recording'
+    RECONNECTING = 'reconnecting'
+    CLOSED = 'closed'
+
+    def __init__(self, reconnect=True):
+        """
+        :param reconnect: whether dropped tries to get a smarthub back mid recording, otherwise it's the same as close
+        """
+        self.reconnect = reconnect
+        self.state = self.IDLE
+        self._loop = None
+        self._changed = None
+
+    @property
+    def recording(self) -> bool:
+        # still the same recording while we wait for a smarthub to come back
+        return self.state in (self.RECORDING, self.RECONNECTING)
+
+    def attach(self) -> None:
+        """
+        :param None
+        :returns None
+
+        must be called from inside the ble event loop, resets the state to IDLE for the new connection
+        """
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+        self.state = self.IDLE
+
+    def start(self) -> None:
+        self._set(self.RECORDING)
+
+    def stop(self) -> None:
+        self._set(self.IDLE)
+
+    def close(self, *_) -> None:
+        """
+        extra arguments are ignored so this can be handed to BleakClient as the disconnected_callback
+        """
+        self._set(self.CLOSED)
+
+    def dropped(self, *_) -> None:
+        """
+        the disconnected_callback to use when the recording should survive a smarthub dropping out,
+        anything but a recording in progress still closes
+        """
+        if self.reconnect and self.recording:
+            self._set(self.RECONNECTING)
+        else:
+            self._set(self.CLOSED)
+
+    def resume(self) -> None:
+        """
+        only goes back to RECORDING if nobody pressed stop (or closed) while we were reconnecting
+        """
+        if self.state == self.RECONNECTING:
+            self._set(self.RECORDING)
+
+    def _set(self, state) -> None:
+        """
+        :param state: state to move to
+        :returns None
+
+        the new state is visible straight away on every thread, the ble loop gets a wake up call scheduled on it
+        """
+        if self.state == self.CLOSED:
+            return
+        self.state = state
+
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._changed.set()
+        else:
+            loop.call_soon_threadsafe(self._changed.set)
+
+    async def wait_until(self, *states, timeout=None) -> str:
+        """
+        :param states: states to wait for
+                 timeout: give up after this many seconds (None waits forever)
+        :returns state we ended up in, which is only outside of states if we timed out
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while self.state not in states:
+            # nothing can set the event between the check above and here, we haven't given up control of the loop
+            self._changed.clear()
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        return self.state
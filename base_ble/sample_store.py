@@ -0,0 +1,89 @@
+from typing import Dict
+
+import numpy as np
+
+
+class SampleStore:
+    """
+    growable column store for recorded samples, one typed numpy array per channel
+
+    functions:
+    extend -> appends a block of samples to every channel at once
+    __getitem__ -> read only view of one channel
+
+    every channel always has the same number of samples since they're only ever appended together
+    the arrays double in size when they fill up, so appending costs O(1) per sample on average
+    views handed out stay valid after later appends (they just won't see the new samples)
+    """
+
+    def __init__(self, channels: Dict[str, type], capacity: int = 1024):
+        """
+        :param channels: channel name -> numpy dtype
+                 capacity: samples to make room for up front
+        """
+        self._dtypes = {name: np.dtype(dtype) for name, dtype in channels.items()}
+        self._columns = {name: np.empty(capacity, dtype=dtype) for name, dtype in self._dtypes.items()}
+        self._capacity = capacity
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def __getitem__(self, name) -> np.ndarray:
+        """
+        :param name: channel name
+        :returns read only view of the samples recorded so far
+        """
+        view = self._columns[name][:self._len]
+        view.flags.writeable = False
+        return view
+
+    def keys(self):
+        return self._columns.keys()
+
+    @property
+    def nbytes(self) -> int:
+        """
+        :returns memory held by the store, including room that hasn't been filled yet
+        """
+        return sum(column.nbytes for column in self._columns.values())
+
+    def _reserve(self, n):
+        """
+        :param n: number of samples we need room for
+        :returns None
+
+        doubles the capacity until n samples fit
+        """
+        if n <= self._capacity:
+            return
+        capacity = max(self._capacity, 1)
+        while capacity < n:
+            capacity *= 2
+        for name, column in self._columns.items():
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self._len] = column[:self._len]
+            self._columns[name] = grown
+        self._capacity = capacity
+
+    def extend(self, **samples) -> int:
+        """
+        :param samples: channel name -> new samples for that channel, every channel has to be given with the same length
+        :returns number of samples added
+        """
+        if samples.keys() != self._columns.keys():
+            raise ValueError(f"expected samples for {sorted(self._columns)}, got {sorted(samples)}")
+        arrays = {name: np.ravel(values) for name, values in samples.items()}
+        lengths = {len(values) for values in arrays.values()}
+        if len(lengths) != 1:
+            raise ValueError(f"every channel needs the same number of samples, got {lengths}")
+
+        k = lengths.pop()
+        self._reserve(self._len + k)
+        for name, values in arrays.items():
+            self._columns[name][self._len:self._len + k] = values
+        self._len += k
+        return k
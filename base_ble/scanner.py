@@ -0,0 +1,229 @@
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Tuple
+
+try:
+    from base_ble.params import DATA_DIR
+    from base_ble.recording_control import RecordingControl
+except ModuleNotFoundError:
+    from params import DATA_DIR
+    from recording_control import RecordingControl
+
+
+DEFAULT_CACHE_PATH = os.path.join(DATA_DIR, 'smarthub_addresses.json')
+
+
+class SmarthubsNotFound(LookupError):
+    """
+    the scan ran out of time before seeing both smarthubs of a pair
+    left_found, right_found: which ones it did see
+    """
+
+    def __init__(self, smarthub_id, left_found, right_found):
+        missing = ' and '.join(side for side, found in (('left', left_found), ('right', right_found)) if not found)
+        super().__init__(f'{missing} smarthub {smarthub_id} not found')
+        self.smarthub_id = smarthub_id
+        self.left_found = left_found
+        self.right_found = right_found
+
+
+class AddressCache:
+    """
+    last addresses each smarthub pair connected on, kept in a json file between sessions
+
+    functions:
+    get -> (left, right) for a smarthub id, None if we've never seen it
+    put -> remembers the addresses for a smarthub id
+    forget -> drops a smarthub id, for when its addresses stop working
+
+    the file is read every time so more than one process (or the ble process) can share it
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.path = path
+
+    def _load(self) -> Dict:
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, addresses):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # write then rename, so a crash halfway through never leaves a broken file
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(addresses, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def get(self, smarthub_id) -> Optional[Tuple[str, str]]:
+        addresses = self._load().get(str(smarthub_id))
+        return tuple(addresses) if addresses is not None else None
+
+    def put(self, smarthub_id, addresses) -> None:
+        cached = self._load()
+        cached[str(smarthub_id)] = list(addresses)
+        self._save(cached)
+
+    def forget(self, smarthub_id) -> None:
+        cached = self._load()
+        if cached.pop(str(smarthub_id), None) is not None:
+            self._save(cached)
+
+
+async def scan_for(smarthub_ids, timeout=5.0) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+    """
+    :param smarthub_ids: ids of the smarthubs we're looking for
+             timeout: longest time (sec) to scan for
+    :returns smarthub id -> (left address, right address), None for the ones we didn't find
+
+    stops as soon as every smarthub we're looking for has advertised instead of always waiting out the timeout,
+    one scanner for every pair since bluez doesn't like more than one running at a time
+    """
+    from bleak import BleakScanner
+
+    wanted = {}
+    for smarthub_id in smarthub_ids:
+        wanted[f'Left Smarthub: {smarthub_id}'] = (smarthub_id, 0)
+        wanted[f'Right Smarthub: {smarthub_id}'] = (smarthub_id, 1)
+    found = {smarthub_id: [None, None] for smarthub_id in smarthub_ids}
+    seen = set()
+    everything_found = asyncio.Event()
+
+    def detected(device, adv):
+        name = adv.local_name
+        if name in wanted and name not in seen:
+            print(f'{name} identified')
+            smarthub_id, side = wanted[name]
+            found[smarthub_id][side] = device.address
+            seen.add(name)
+            if len(seen) == len(wanted):
+                everything_found.set()
+
+    async with BleakScanner(detection_callback=detected):
+        try:
+            await asyncio.wait_for(everything_found.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    return {smarthub_id: tuple(addresses) for smarthub_id, addresses in found.items()}
+
+
+@asynccontextmanager
+async def connect_pair(ble_client, left_address, right_address, disconnected_callback=None):
+    """
+    :param ble_client: BleakClient or something that acts like it
+             left_address, right_address: addresses to connect to
+             disconnected_callback: given to both clients
+    :returns (as a context manager) left client, right client
+
+    connects both at the same time rather than one after the other, if either one fails the other gets disconnected
+    both are disconnected when the block exits
+    """
+    left_client = ble_client(left_address, disconnected_callback=disconnected_callback)
+    right_client = ble_client(right_address, disconnected_callback=disconnected_callback)
+    clients = (left_client, right_client)
+
+    results = await asyncio.gather(*(client.connect() for client in clients), return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    try:
+        if errors:
+            raise errors[0]
+        yield clients
+    finally:
+        await asyncio.gather(*(client.disconnect() for client in clients if client.is_connected), return_exceptions=True)
+
+
+@asynccontextmanager
+async def connect_smarthubs(smarthub_id, ble_client=None, cache=None, timeout=5.0, disconnected_callback=None):
+    """
+    :param smarthub_id: id of the pair
+             ble_client: BleakClient or something that acts like it, defaults to BleakClient
+             cache: AddressCache to try first and to remember the addresses in, None to always scan
+             timeout: longest time (sec) to scan for
+             disconnected_callback: given to both clients
+    :returns (as a context manager) left client, right client
+
+    goes straight to the cached addresses if there are any, scanning only if there aren't or they don't connect
+    raises SmarthubsNotFound if the scan doesn't see both
+    """
+    if ble_client is None:
+        from bleak import BleakClient as ble_client
+
+    cached = cache.get(smarthub_id) if cache is not None else None
+    if cached is not None:
+        connected = False
+        try:
+            async with connect_pair(ble_client, *cached, disconnected_callback) as clients:
+                connected = True
+                yield clients
+                return
+        except Exception as e:
+            # only retry if the cached addresses never connected, anything after that is the caller's problem
+            if connected:
+                raise
+            print(f'cached addresses for smarthub {smarthub_id} did not connect ({e}), scanning')
+            cache.forget(smarthub_id)
+
+    left_address, right_address = (await scan_for([smarthub_id], timeout))[smarthub_id]
+    if left_address is None or right_address is None:
+        raise SmarthubsNotFound(smarthub_id, left_address is not None, right_address is not None)
+    if cache is not None:
+        cache.put(smarthub_id, (left_address, right_address))
+
+    async with connect_pair(ble_client, left_address, right_address, disconnected_callback) as clients:
+        yield clients
+
+
+async def reconnect_dropped(control, clients, resubscribe, clock, gap_markers=(),
+                            attempts=8, first_delay_s=0.25, max_delay_s=4.0) -> bool:
+    """
+    :param control: RecordingControl that went to RECONNECTING because a client called dropped
+             clients: side -> client, the ones that aren't connected get reconnected
+             resubscribe: async function of (side, client) that starts that side's notifications again
+             clock: returns the current time (sec) on the recording's clock
+             gap_markers: things with begin_gap(time) and end_gap(time) (StreamMerger, PacketLog) to mark the outage in
+             attempts: tries per client before giving up
+             first_delay_s, max_delay_s: wait after the first failed try, doubling every try up to max_delay_s
+    :returns whether every client is back and the recording carried on
+
+    stop or close while we're waiting cuts it short, if a client still isn't back after that the connection is closed
+    the same as a disconnect without reconnecting would have
+    """
+    time_lost = clock()
+    for marker in gap_markers:
+        marker.begin_gap(time_lost)
+    print(f'smarthub dropped out {time_lost:.1f} s into the recording, reconnecting')
+
+    delay = first_delay_s
+    for attempt in range(attempts):
+        for side, client in clients.items():
+            if client.is_connected:
+                continue
+            try:
+                await client.connect()
+                await resubscribe(side, client)
+                print(f'{side} smarthub back after {clock() - time_lost:.1f} s')
+            # bleak errors don't share a base class with anything we can import without bleak, so take everything
+            except Exception as e:
+                print(f'reconnecting {side} smarthub failed ({type(e).__name__}: {e})')
+
+        if all(client.is_connected for client in clients.values()):
+            break
+        if await control.wait_until(RecordingControl.IDLE, RecordingControl.CLOSED, timeout=delay) != RecordingControl.RECONNECTING:
+            break
+        delay = min(2 * delay, max_delay_s)
+
+    time_back = clock()
+    for marker in gap_markers:
+        marker.end_gap(time_back)
+
+    if not all(client.is_connected for client in clients.values()):
+        print('smarthub did not come back')
+        control.close()
+        return False
+    control.resume()
+    return control.state == RecordingControl.RECORDING
@@ -0,0 +1,308 @@
+import asyncio
+from datetime import datetime
+from typing import Dict, List
+
+import numpy as np
+
+try:
+    from base_ble.params import DATE_DIR, left_gain as LEFT_GAIN, right_gain as RIGHT_GAIN
+    from base_ble.calc import Geometry
+    from base_ble.recording_control import RecordingControl
+    from base_ble.sample_store import SampleStore
+    from base_ble.filters import make_filter
+    from base_ble.packet_log import PacketLog, log_settings, raw_log_path
+    from base_ble.ble_process import CHANNELS, CHANNEL_DTYPES, record_pair
+    from base_ble.scanner import AddressCache, connect_pair, scan_for
+    from base_ble.test_document import build_test, test_id, to_document
+    from base_ble.chunk_store import insert_test
+except ModuleNotFoundError:
+    from params import DATE_DIR, left_gain as LEFT_GAIN, right_gain as RIGHT_GAIN
+    from calc import Geometry
+    from recording_control import RecordingControl
+    from sample_store import SampleStore
+    from filters import make_filter
+    from packet_log import PacketLog, log_settings, raw_log_path
+    from ble_process import CHANNELS, CHANNEL_DTYPES, record_pair
+    from scanner import AddressCache, connect_pair, scan_for
+    from test_document import build_test, test_id, to_document
+    from chunk_store import insert_test
+
+
+class PairSession:
+    """
+    one chair: the left and right smarthub with the same id, with its own buffers, clock and packet log
+
+    functions:
+    run -> connects and streams until closed, await it on the shared event loop
+    start, stop, close -> the same as the record button, safe to call from any thread
+    test_document -> the last recording as a document ready for insert_one
+
+    status is one of 'waiting', 'not found', 'connected', 'recording', 'disconnected' or 'error: ...'
+    """
+
+    def __init__(self, smarthub_id, addresses=None, geometry=Geometry(), left_gain=LEFT_GAIN, right_gain=RIGHT_GAIN, log_dir=DATE_DIR,
+                 smoothing=None):
+        """
+        :param smarthub_id: id the pair advertises with
+                 addresses: (left, right) to connect to, None to find them in SessionManager.run's scan
+                 geometry: wheel diameter and distance between the wheels (in) for this chair
+                 left_gain, right_gain: calibration gains for this chair, the gui's defaults from params if not given
+                 log_dir: folder for the raw packet logs
+                 smoothing: make_filter spec for the saved gyro data (like "gyro_filter" in config.json), None for the default
+        """
+        self.smarthub_id = smarthub_id
+        self.addresses = addresses
+        self.geometry = geometry
+        self.left_gain = left_gain
+        self.right_gain = right_gain
+        self.log_dir = log_dir
+        self.smoothing = smoothing
+
+        self.control = RecordingControl()
+        # the last of start, stop or close, run puts the control back in this state every time it attaches
+        self._requested = RecordingControl.IDLE
+        # set once connected, or once SessionManager.run gives up on it
+        self.connected = asyncio.Event()
+        # set once a recording has been stopped and its data is all in, or the pair has gone
+        self.recorded = asyncio.Event()
+        self.status = 'waiting'
+        self.merge_stats = {}
+        # LinkTelemetry snapshot, updated every second while recording
+        self.link_stats = {}
+        self.recorded_at = None
+        self.data = SampleStore(CHANNEL_DTYPES)
+
+    def start(self) -> None:
+        self._requested = RecordingControl.RECORDING
+        self.control.start()
+
+    def stop(self) -> None:
+        self._requested = RecordingControl.IDLE
+        self.control.stop()
+
+    def close(self) -> None:
+        self._requested = RecordingControl.CLOSED
+        self.control.close()
+
+    def _set_link_stats(self, snapshot):
+        self.link_stats = snapshot
+
+    def _append(self, samples):
+        self.data.extend(**dict(zip(CHANNELS, samples)))
+
+    async def run(self, ble_client) -> None:
+        """
+        :param ble_client: BleakClient or something that acts like it
+        :returns None once the pair is closed or disconnects
+        """
+        # closed before (or between) connection attempts, don't connect at all
+        if self._requested == RecordingControl.CLOSED:
+            return
+        # attach starts the new connection IDLE, a start that came in before it still counts
+        self.control.attach()
+        if self._requested == RecordingControl.RECORDING:
+            self.control.start()
+        try:
+            async with connect_pair(ble_client, *self.addresses, disconnected_callback=self.control.dropped) as (left_client, right_client):
+                self.status = 'connected'
+                self.connected.set()
+
+                while await self.control.wait_until(RecordingControl.RECORDING, RecordingControl.CLOSED) == RecordingControl.RECORDING:
+                    # a fresh store every recording, the last one stays around until the next start so it can be saved
+                    self.recorded.clear()
+                    self.data = SampleStore(CHANNEL_DTYPES)
+                    self.status = 'recording'
+                    self.recorded_at = datetime.now()
+                    packet_log = PacketLog(raw_log_path(self.log_dir, suffix=f'_{self.smarthub_id}'),
+                                           log_settings(self.geometry, self.left_gain, self.right_gain, self.smoothing))
+                    self.merge_stats, self.link_stats = await record_pair(self.control, left_client, right_client, packet_log, self._append,
+                                                                          on_link_stats=self._set_link_stats)
+                    self.status = 'connected'
+                    self.recorded.set()
+
+                if not (left_client.is_connected and right_client.is_connected):
+                    self.status = 'disconnected'
+
+        # bleak errors don't share a base class with anything we can import without bleak, so take everything
+        except Exception as e:
+            self.status = f'error: {type(e).__name__}: {e}'
+        finally:
+            self.recorded.set()
+
+    def test_document(self, **fields) -> Dict:
+        """
+        :param fields: anything else to put in the document (user_id, test_name, additional_notes...)
+        :returns document for the last recording, same fields as RecordData.save_data plus smarthub_id
+        """
+        if len(self.data) < 2:
+            raise ValueError(f'no data recorded for smarthub {self.smarthub_id}')
+        test = build_test(self.data['time_from_start'], self.data['accel_left'], self.data['accel_right'],
+                          self.data['gyro_left'], self.data['gyro_right'],
+                          self.geometry, self.left_gain, self.right_gain, make_filter(self.smoothing))
+        # tests saved in the same second would get the same id, so the smarthub id goes in it too
+        return to_document(test, _id=f'{test_id(self.recorded_at)}_{self.smarthub_id}',
+                           smarthub_id=self.smarthub_id, merge_stats=dict(self.merge_stats),
+                           link_stats=dict(self.link_stats), **fields)
+
+
+class SessionManager:
+    """
+    records several chairs at once on one event loop
+
+    functions:
+    add -> adds a smarthub pair
+    run -> looks up any pairs without addresses in the address cache or one shared scan, then connects and streams all of them concurrently
+    wait_connected -> waits until every pair has connected (or given up)
+    wait_recorded -> waits until every pair has finished the recording that was just stopped
+    start, stop, close -> recording control for some or all of the pairs, safe from any thread
+    save -> writes each pair's last recording as its own test document
+
+    usage:
+    manager = SessionManager()
+    manager.add('1234')
+    manager.add('5678')
+    task = asyncio.create_task(manager.run())
+    await manager.wait_connected()
+    manager.start()
+    ...
+    manager.stop()
+    manager.close()
+    await task
+    manager.save(database.Smarthub.test_collection, user_id='000001')
+    """
+
+    def __init__(self, ble_client=None, cache=None):
+        """
+        :param ble_client: BleakClient or something that acts like it (SmarthubSimulator.client), defaults to BleakClient
+                 cache: AddressCache for pairs added without addresses, None to always scan
+        """
+        self.ble_client = ble_client
+        self.cache = cache
+        self.sessions = {}
+
+    def add(self, smarthub_id, addresses=None, **kwargs) -> PairSession:
+        """
+        :param smarthub_id: id the pair advertises with
+                 addresses: (left, right) to skip scanning for this pair
+                 kwargs: passed to PairSession (geometry, left_gain, right_gain, log_dir, smoothing)
+        :returns the new PairSession
+        """
+        if smarthub_id in self.sessions:
+            raise ValueError(f'smarthub {smarthub_id} has already been added')
+        self.sessions[smarthub_id] = PairSession(smarthub_id, addresses, **kwargs)
+        return self.sessions[smarthub_id]
+
+    def _select(self, smarthub_ids) -> List[PairSession]:
+        return [self.sessions[smarthub_id] for smarthub_id in smarthub_ids] if smarthub_ids else list(self.sessions.values())
+
+    async def run(self, scan_timeout=5.0) -> None:
+        """
+        :param scan_timeout: seconds to scan for pairs that don't have addresses yet
+        :returns None once every pair has been closed or dropped
+        """
+        ble_client = self.ble_client
+        if ble_client is None:
+            from bleak import BleakClient as ble_client
+
+        cached = []
+        if self.cache is not None:
+            for smarthub_id, session in self.sessions.items():
+                if session.addresses is None:
+                    session.addresses = self.cache.get(smarthub_id)
+                    if session.addresses is not None:
+                        cached.append(smarthub_id)
+        await self._scan([smarthub_id for smarthub_id, session in self.sessions.items() if session.addresses is None], scan_timeout)
+        await asyncio.gather(*(self._run(session, ble_client, session.smarthub_id in cached, scan_timeout)
+                               for session in self.sessions.values()))
+
+    async def _scan(self, smarthub_ids, scan_timeout):
+        # one scan for every pair that needs one
+        if not smarthub_ids:
+            return
+        found = await scan_for(smarthub_ids, scan_timeout)
+        for smarthub_id in smarthub_ids:
+            if None not in found[smarthub_id]:
+                self.sessions[smarthub_id].addresses = found[smarthub_id]
+                if self.cache is not None:
+                    self.cache.put(smarthub_id, found[smarthub_id])
+
+    async def _run(self, session, ble_client, from_cache, scan_timeout):
+        if session.addresses is not None:
+            await session.run(ble_client)
+
+            # cached addresses that never connected have probably changed, look for the pair again
+            if from_cache and not session.connected.is_set():
+                print(f'cached addresses for smarthub {session.smarthub_id} did not connect ({session.status}), scanning')
+                self.cache.forget(session.smarthub_id)
+                session.addresses = None
+                await self._scan([session.smarthub_id], scan_timeout)
+                if session.addresses is not None:
+                    await session.run(ble_client)
+
+        if session.addresses is None:
+            session.status = 'not found'
+        # nobody waiting on the connection should hang if it never happened
+        session.connected.set()
+
+    async def wait_connected(self, timeout=None) -> Dict[str, str]:
+        """
+        :param timeout: seconds to give up after
+        :returns smarthub id -> status
+        """
+        waits = [session.connected.wait() for session in self.sessions.values()]
+        try:
+            await asyncio.wait_for(asyncio.gather(*waits), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.status()
+
+    async def wait_recorded(self, *smarthub_ids, timeout=None) -> Dict[str, str]:
+        """
+        :param smarthub_ids: pairs to wait for, all of them if none are given
+                 timeout: seconds to give up after
+        :returns smarthub id -> status
+
+        call after stop, once this returns the pairs' data is complete and can be saved
+        """
+        waits = [session.recorded.wait() for session in self._select(smarthub_ids)]
+        try:
+            await asyncio.wait_for(asyncio.gather(*waits), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.status()
+
+    def status(self) -> Dict[str, str]:
+        return {smarthub_id: session.status for smarthub_id, session in self.sessions.items()}
+
+    def start(self, *smarthub_ids) -> None:
+        for session in self._select(smarthub_ids):
+            session.start()
+
+    def stop(self, *smarthub_ids) -> None:
+        for session in self._select(smarthub_ids):
+            session.stop()
+
+    def close(self, *smarthub_ids) -> None:
+        for session in self._select(smarthub_ids):
+            session.close()
+
+    def save(self, collection, *smarthub_ids, chunks=None, **fields) -> List[str]:
+        """
+        :param collection: mongo collection to insert into (database.Smarthub.test_collection)
+                 smarthub_ids: pairs to save, all of them if none are given
+                 chunks: mongo collection to save the data in a minute at a time (database.Smarthub.test_chunks),
+                         collection then just gets a header, None saves each test as one document
+                 fields: added to every document (user_id, test_name, additional_notes...)
+        :returns _id of every document saved, pairs that didn't record anything are skipped
+        """
+        saved = []
+        for session in self._select(smarthub_ids):
+            if len(session.data) < 2:
+                print(f'no data recorded for smarthub {session.smarthub_id}')
+                continue
+            document = session.test_document(**fields)
+            if chunks is None:
+                saved.append(collection.insert_one(document).inserted_id)
+            else:
+                saved.append(insert_test(collection, chunks, document))
+        return saved
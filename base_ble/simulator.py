@@ -0,0 +1,357 @@
+import argparse
+import asyncio
+from typing import Dict, List, NamedTuple, Tuple
+
+import numpy as np
+
+try:
+    from base_ble.params import WHEEL_DIAM_IN, IN_TO_M
+    from base_ble.decode import FRAME_LEN, SAMPLES_PER_FRAME
+except ModuleNotFoundError:
+    from params import WHEEL_DIAM_IN, IN_TO_M
+    from decode import FRAME_LEN, SAMPLES_PER_FRAME
+
+
+# samples per second on the real smarthubs
+SAMPLE_RATE_HZ = 68
+# largest magnitude that fits in the unsigned 16 bit words
+ACCEL_MAX = 65535 / 1000
+GYRO_MAX = 65535 / 100
+
+PATTERNS = ('stroke', 'coast', 'pause', 'turn_left', 'turn_right')
+
+# a bit of everything, repeated for as long as the simulation runs
+DEFAULT_SCHEDULE = (('pause', 2), ('stroke', 20), ('coast', 3), ('turn_left', 2), ('stroke', 10), ('turn_right', 2), ('coast', 4), ('pause', 5))
+
+
+class Frame(NamedTuple):
+    """
+    one notification the way bleak hands it to us
+    time: when it gets delivered (sec since the start of the simulation)
+    side: 'left' or 'right'
+    data: 18 byte frame
+    """
+    time: float
+    side: str
+    data: bytes
+
+
+def wheel_motion(schedule=DEFAULT_SCHEDULE, duration=None, rate=SAMPLE_RATE_HZ,
+                 cruise_rps=2.5, stroke_rps=1.5, stroke_hz=1.0, coast_tau_s=3.0, turn_rps=1.0,
+                 noise_rps=0.02, seed=0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    :param schedule: sequence of (pattern, seconds), pattern is one of PATTERNS
+             duration: total seconds to simulate, the schedule repeats to fill it (defaults to one pass of the schedule)
+             rate: samples per second
+             cruise_rps: wheel speed between pushes while stroking (rps)
+             stroke_rps: extra wheel speed at the peak of a push (rps)
+             stroke_hz: pushes per second
+             coast_tau_s: time constant of the slow down while coasting
+             turn_rps: wheel speed while spinning in place, the wheels turn opposite ways
+             noise_rps: standard deviation of the gyro noise
+             seed: random seed, the same seed gives the same motion
+    :returns time_from_start, gyro_left, gyro_right (rps)
+    """
+    rng = np.random.default_rng(seed)
+    if duration is None:
+        duration = sum(seconds for _, seconds in schedule)
+
+    times, lefts, rights = [], [], []
+    # wheel speed carried from one segment to the next so coasting starts where the pushing stopped
+    speed = 0.0
+    start = 0.0
+    while start < duration:
+        for pattern, seconds in schedule:
+            if pattern not in PATTERNS:
+                raise ValueError(f"unknown pattern {pattern}, expected one of {PATTERNS}")
+            if start >= duration:
+                break
+            seconds = min(seconds, duration - start)
+            n = int(round(seconds * rate))
+            t = np.arange(n) / rate
+
+            if pattern == 'stroke':
+                left = cruise_rps + stroke_rps * np.sin(np.pi * stroke_hz * t)**2
+                right = left.copy()
+            elif pattern == 'coast':
+                left = speed * np.exp(-t / coast_tau_s)
+                right = left.copy()
+            elif pattern == 'pause':
+                left = np.zeros(n)
+                right = np.zeros(n)
+            else:
+                direction = 1 if pattern == 'turn_left' else -1
+                # rotating left is positive, so the right wheel goes forward
+                left = np.full(n, -direction * turn_rps)
+                right = np.full(n, direction * turn_rps)
+
+            times.append(start + t)
+            lefts.append(left)
+            rights.append(right)
+            if n > 0:
+                speed = (left[-1] + right[-1]) / 2
+            start += seconds
+
+    time_from_start = np.concatenate(times) if times else np.zeros(0)
+    gyro_left = np.concatenate(lefts) + rng.normal(0, noise_rps, len(time_from_start)) if lefts else np.zeros(0)
+    gyro_right = np.concatenate(rights) + rng.normal(0, noise_rps, len(time_from_start)) if rights else np.zeros(0)
+    return time_from_start, gyro_left, gyro_right
+
+
+def accel_from_gyro(time_from_start, gyro, diameter=WHEEL_DIAM_IN) -> np.ndarray:
+    """
+    :param time_from_start: sample times (sec)
+             gyro: wheel rotation (rps)
+             diameter: wheel diameter (in)
+    :returns forward acceleration (g) that goes with the wheel speed
+    """
+    if len(gyro) < 2:
+        return np.zeros(len(gyro))
+    velocity = gyro * diameter / 2 * IN_TO_M
+    return np.gradient(velocity, time_from_start) / 9.81
+
+
+def encode_frames(accel, gyro) -> np.ndarray:
+    """
+    :param accel: acceleration samples, length a multiple of 4
+             gyro: gyro samples, same length as accel
+    :returns (frames, 18) uint8 array, one row per notification
+
+    opposite of RecordData.convert_from_raw: sign bytes, then four accel and four gyro words (LSB first)
+    values are rounded to the frame resolution (0.001 accel, 0.01 gyro) and clipped to what fits in 16 bits
+    """
+    accel = np.asarray(accel, dtype=float).reshape(-1, SAMPLES_PER_FRAME)
+    gyro = np.asarray(gyro, dtype=float).reshape(-1, SAMPLES_PER_FRAME)
+    bits = 1 << np.arange(SAMPLES_PER_FRAME)
+
+    frames = np.empty((len(accel), FRAME_LEN), dtype=np.uint8)
+    frames[:, 0] = (accel < 0) @ bits
+    frames[:, 1] = (gyro < 0) @ bits
+    accel_words = np.rint(np.minimum(np.abs(accel), ACCEL_MAX) * 1000).astype('<u2')
+    gyro_words = np.rint(np.minimum(np.abs(gyro), GYRO_MAX) * 100).astype('<u2')
+    frames[:, 2:10] = accel_words.view(np.uint8)
+    frames[:, 10:18] = gyro_words.view(np.uint8)
+    return frames
+
+
+class SmarthubSimulator:
+    """
+    stands in for a left and right smarthub pair so ingestion can be load tested without hardware
+
+    functions:
+    frames -> every notification from both wheels in delivery order
+    client -> BleakClient look alike for one side, replays that side's notifications in real time (or faster)
+
+    timing problems from the real link can be switched on:
+    loss drops frames, duplicates sends a frame twice, jitter delays delivery (which can reorder the two sides),
+    dropouts (passed to client) disconnect a side for a while, the frames it sends in the meantime are lost
+    """
+
+    def __init__(self, schedule=DEFAULT_SCHEDULE, duration=None, rate=SAMPLE_RATE_HZ,
+                 loss=0.0, duplicates=0.0, jitter_s=0.0, seed=0, **motion):
+        """
+        :param schedule: sequence of (pattern, seconds), see wheel_motion
+                 duration: total seconds to simulate (defaults to one pass of the schedule)
+                 rate: samples per second, 68 on the real smarthubs
+                 loss: chance of dropping each frame
+                 duplicates: chance of each frame being delivered twice
+                 jitter_s: largest extra delivery delay (sec), picked uniformly per frame
+                 seed: random seed, the same seed gives the same frames
+                 motion: passed through to wheel_motion (cruise_rps, turn_rps, noise_rps...)
+        """
+        self.rate = rate
+        self.time_from_start, self.gyro_left, self.gyro_right = wheel_motion(schedule, duration, rate, seed=seed, **motion)
+
+        # whole frames only
+        n = len(self.time_from_start) // SAMPLES_PER_FRAME * SAMPLES_PER_FRAME
+        self.time_from_start = self.time_from_start[:n]
+        self.gyro_left = self.gyro_left[:n]
+        self.gyro_right = self.gyro_right[:n]
+        self.accel_left = accel_from_gyro(self.time_from_start, self.gyro_left)
+        self.accel_right = accel_from_gyro(self.time_from_start, self.gyro_right)
+
+        rng = np.random.default_rng(seed + 1)
+        # a frame goes out once its newest sample has been taken
+        sent = self.time_from_start[SAMPLES_PER_FRAME - 1::SAMPLES_PER_FRAME]
+
+        frames = []
+        self.stats = {'sent': 0, 'lost': 0, 'duplicated': 0}
+        for side, accel, gyro in (('left', self.accel_left, self.gyro_left), ('right', self.accel_right, self.gyro_right)):
+            encoded = encode_frames(accel, gyro)
+            delivered = sent + rng.uniform(0, jitter_s, len(sent)) if jitter_s > 0 else sent.copy()
+            lost = rng.random(len(sent)) < loss
+            doubled = (rng.random(len(sent)) < duplicates) & ~lost
+            for i in range(len(sent)):
+                self.stats['sent'] += 1
+                if lost[i]:
+                    self.stats['lost'] += 1
+                    continue
+                data = encoded[i].tobytes()
+                frames.append(Frame(delivered[i], side, data))
+                if doubled[i]:
+                    self.stats['duplicated'] += 1
+                    # the repeat shows up shortly after the original
+                    frames.append(Frame(delivered[i] + 0.5 / self.rate, side, data))
+
+        frames.sort(key=lambda frame: frame.time)
+        self._frames = frames
+
+    def frames(self, side=None) -> List[Frame]:
+        """
+        :param side: 'left', 'right' or None for both
+        :returns frames in the order they get delivered
+        """
+        if side is None:
+            return list(self._frames)
+        return [frame for frame in self._frames if frame.side == side]
+
+    def client(self, side, speed=1.0, disconnected_callback=None, dropouts=()) -> 'SimulatedClient':
+        """
+        :param side: 'left' or 'right'
+                 speed: playback speed, 2 replays twice as fast as real time
+                 disconnected_callback: called with the client once it disconnects, the same as bleak
+                 dropouts: (start, seconds) on the simulated clock where this side goes out of range
+        :returns SimulatedClient for that side
+        """
+        return SimulatedClient(self.frames(side), speed=speed, disconnected_callback=disconnected_callback, dropouts=dropouts)
+
+
+class SimulatedClient:
+    """
+    the parts of BleakClient the record tab uses, fed from a SmarthubSimulator
+
+    use it like a BleakClient:
+    async with SimulatedClient(...) as client:
+        await client.start_notify(ch, callback)
+
+    drop (or a dropout passed in) makes it disconnect and refuse to connect for a while, like going out of range.
+    the smarthub keeps going in the meantime, so starting notifications again picks up wherever it's got to
+    """
+
+    def __init__(self, frames, speed=1.0, disconnected_callback=None, dropouts=()):
+        self._frames = frames
+        self._speed = speed
+        self._disconnected_callback = disconnected_callback
+        self._dropouts = sorted(dropouts)
+        self._tasks = {}
+        self._callbacks = {}
+        # loop time we can be connected to again
+        self._unreachable_until = 0.0
+        self.is_connected = False
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.disconnect()
+
+    async def connect(self) -> bool:
+        if asyncio.get_running_loop().time() < self._unreachable_until:
+            raise TimeoutError('simulated smarthub out of range')
+        self.is_connected = True
+        return True
+
+    async def disconnect(self) -> bool:
+        for ch in list(self._tasks):
+            await self.stop_notify(ch)
+        self._disconnected()
+        return True
+
+    async def start_notify(self, ch, callback) -> None:
+        """
+        :param ch: characteristic uuid, only used as a key
+                 callback: called as callback(ch, bytearray) for every frame, the same as bleak
+        :returns None
+        """
+        self._callbacks[ch] = callback
+        task = self._tasks.get(ch)
+        # back after a dropout, carry on from where the smarthub is now
+        if task is None or task.done():
+            self._tasks[ch] = asyncio.ensure_future(self._play(ch))
+
+    async def stop_notify(self, ch) -> None:
+        self._callbacks.pop(ch, None)
+        task = self._tasks.pop(ch, None)
+        if task is not None:
+            task.cancel()
+
+    def drop(self, seconds) -> None:
+        """
+        :param seconds: how long (real time) connecting again fails for
+        :returns None
+        """
+        self._unreachable_until = asyncio.get_running_loop().time() + seconds
+        # a real disconnect loses the subscriptions too
+        self._callbacks.clear()
+        self._disconnected()
+
+    async def _play(self, ch) -> None:
+        # replays the frames on the simulated clock, starting from when notifications were turned on
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        dropouts = list(self._dropouts)
+        for frame in self._frames:
+            delay = start + frame.time / self._speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if dropouts and frame.time >= dropouts[0][0]:
+                self.drop(dropouts.pop(0)[1] / self._speed)
+            callback = self._callbacks.get(ch)
+            if self.is_connected and callback is not None:
+                callback(ch, bytearray(frame.data))
+        # running out of frames looks like the smarthub dropping, for good
+        self._unreachable_until = float('inf')
+        self._disconnected()
+
+    def _disconnected(self) -> None:
+        if not self.is_connected:
+            return
+        self.is_connected = False
+        if self._disconnected_callback is not None:
+            self._disconnected_callback(self)
+
+
+def parse_args() -> Dict:
+    parser = argparse.ArgumentParser(description='generate simulated smarthub frames')
+    parser.add_argument("--duration", '-d',
+                        help='seconds to simulate',
+                        default=60,
+                        type=float)
+    parser.add_argument("--rate",
+                        help='samples per second',
+                        default=SAMPLE_RATE_HZ,
+                        type=float)
+    parser.add_argument("--loss",
+                        help='chance of dropping each frame',
+                        default=0.0,
+                        type=float)
+    parser.add_argument("--duplicates",
+                        help='chance of each frame being sent twice',
+                        default=0.0,
+                        type=float)
+    parser.add_argument("--jitter",
+                        help='largest extra delivery delay (sec)',
+                        default=0.0,
+                        type=float)
+    parser.add_argument("--output", '-o',
+                        help='write the frames to this file, one "time side hex" line per frame',
+                        required=False,
+                        type=str)
+    return vars(parser.parse_args())
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    simulator = SmarthubSimulator(duration=args['duration'], rate=args['rate'], loss=args['loss'],
+                                  duplicates=args['duplicates'], jitter_s=args['jitter'])
+    frames = simulator.frames()
+
+    if args['output']:
+        with open(args['output'], 'w') as f:
+            for frame in frames:
+                f.write(f"{frame.time:.6f} {frame.side} {frame.data.hex()}\n")
+
+    print(f"{len(simulator.time_from_start)} samples per wheel at {args['rate']:g} Hz, {len(frames)} frames delivered")
+    print(f"sent: {simulator.stats['sent']}, lost: {simulator.stats['lost']}, duplicated: {simulator.stats['duplicated']}")
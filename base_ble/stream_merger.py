@@ -0,0 +1,271 @@
+import threading
+from typing import Dict, NamedTuple
+
+import numpy as np
+
+try:
+    from base_ble.decode import decode_frames, SAMPLES_PER_FRAME
+except ModuleNotFoundError:
+    from decode import decode_frames, SAMPLES_PER_FRAME
+
+
+# samples per second coming off each smarthub
+SAMPLE_RATE_HZ = 68
+# time between two notifications from the same smarthub
+FRAME_PERIOD_S = SAMPLES_PER_FRAME / SAMPLE_RATE_HZ
+
+SIDES = ('left', 'right')
+
+
+class MergedFrames(NamedTuple):
+    """
+    left and right frames lined up with each other, one row per frame
+    time: (frames,) when the frame arrived (sec since start), the newest of its 4 samples was taken then
+    accel_left, gyro_left, accel_right, gyro_right: (frames, 4) decoded samples, oldest first
+    """
+    time: np.ndarray
+    accel_left: np.ndarray
+    gyro_left: np.ndarray
+    accel_right: np.ndarray
+    gyro_right: np.ndarray
+
+
+class StreamMerger:
+    """
+    lines up the left and right notification streams by arrival time
+
+    functions:
+    push -> adds one notification from one side (called from the ble thread, only copies bytes)
+    drain -> decodes and pairs everything that has been sitting in the jitter buffer long enough (called from the tk thread)
+    begin_gap, end_gap -> a smarthub dropped out and came back, nothing from either side between the two makes it into the rows
+
+    every frame is kept, a frame that doesn't have a partner from the other side within tolerance_s gets one
+    interpolated from the other side's samples around it. frames only leave the buffer once they're latency_s old,
+    so a partner that shows up a little late still gets paired.
+    the same bytes arriving again within duplicate_s is the link repeating itself and gets dropped,
+    the same bytes arriving a frame later is the wheel just not moving and is kept
+    while one side is reconnecting the other side's frames are dropped rather than paired with made up data,
+    so the outage shows up as a jump in the row times (listed in stats['gaps'])
+
+    stats keeps count of what happened to the frames, see reset_stats
+    """
+
+    def __init__(self, latency_s=0.15, tolerance_s=0.75 * FRAME_PERIOD_S, duplicate_s=0.5 * FRAME_PERIOD_S):
+        """
+        :param latency_s: how long a frame waits in the buffer for its partner, should be more than tolerance_s
+                 tolerance_s: largest difference in arrival time (sec) for a left and right frame to be paired
+                 duplicate_s: identical frames from the same side closer together than this are counted once
+        """
+        self.latency_s = latency_s
+        self.tolerance_s = tolerance_s
+        self.duplicate_s = duplicate_s
+
+        self._lock = threading.Lock()
+        self._times = {side: [] for side in SIDES}
+        self._frames = {side: [] for side in SIDES}
+        # last frame pushed on each side, for spotting duplicates
+        self._last = {side: (None, None) for side in SIDES}
+        # newest samples handed out on each side, so interpolation across two drains has something to start from
+        self._context = {side: None for side in SIDES}
+        # time of the last row handed out
+        self._last_time = -np.inf
+        # start of the outage we're in the middle of
+        self._gap_start = None
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        """
+        received_{side}: frames pushed that weren't duplicates
+        duplicates_{side}: frames dropped as repeats
+        paired: rows with a real frame from both sides
+        interpolated_{side}: rows where that side's samples were interpolated
+        gap_{side}: frames dropped because they came in during an outage
+        gaps: [start, end] (sec) of every outage
+        """
+        self.stats = {'paired': 0, 'gaps': []}
+        for side in SIDES:
+            self.stats[f'received_{side}'] = 0
+            self.stats[f'duplicates_{side}'] = 0
+            self.stats[f'interpolated_{side}'] = 0
+            self.stats[f'gap_{side}'] = 0
+
+    def __len__(self):
+        return sum(len(times) for times in self._times.values())
+
+    def push(self, side, time_received, message) -> bool:
+        """
+        :param side: 'left' or 'right'
+                 time_received: time (sec) the notification arrived
+                 message: 18 byte frame
+        :returns False if it was dropped as a duplicate
+        """
+        message = bytes(message)
+        with self._lock:
+            if self._gap_start is not None:
+                self.stats[f'gap_{side}'] += 1
+                return False
+            last_time, last_message = self._last[side]
+            if message == last_message and time_received - last_time < self.duplicate_s:
+                self.stats[f'duplicates_{side}'] += 1
+                return False
+            self._last[side] = (time_received, message)
+            self._times[side].append(time_received)
+            self._frames[side].append(message)
+            self.stats[f'received_{side}'] += 1
+        return True
+
+    def begin_gap(self, time_lost) -> None:
+        """
+        :param time_lost: time (sec) the smarthub dropped out
+        :returns None
+        """
+        with self._lock:
+            if self._gap_start is None:
+                self._gap_start = time_lost
+
+    def end_gap(self, time_back) -> None:
+        """
+        :param time_back: time (sec) notifications are running again
+        :returns None
+        """
+        with self._lock:
+            if self._gap_start is not None:
+                self.stats['gaps'].append([self._gap_start, time_back])
+                self._gap_start = None
+
+    def drain(self, now, flush=False) -> MergedFrames:
+        """
+        :param now: current time (sec), on the same clock as the pushed times
+                 flush: hand out everything, even frames that haven't waited latency_s (use once the notifications have stopped)
+        :returns MergedFrames for every frame old enough, the rest stay in the buffer
+        """
+        with self._lock:
+            pending = {side: (self._times[side], self._frames[side]) for side in SIDES}
+            self._times = {side: [] for side in SIDES}
+            self._frames = {side: [] for side in SIDES}
+
+        times, accel, gyro = {}, {}, {}
+        for side in SIDES:
+            side_times, side_frames = pending[side]
+            order = np.argsort(side_times, kind='stable')
+            times[side] = np.asarray(side_times, dtype=float)[order]
+            accel[side], gyro[side] = decode_frames([side_frames[i] for i in order])
+            pending[side] = [side_frames[i] for i in order]
+
+        horizon = np.inf if flush else now - self.latency_s
+        rows, used = self._pair(times['left'], times['right'], horizon)
+
+        # whatever isn't old enough goes back in front of anything pushed while we were working
+        with self._lock:
+            for side in SIDES:
+                self._times[side][:0] = times[side][used[side]:].tolist()
+                self._frames[side][:0] = pending[side][used[side]:]
+
+        n = len(rows)
+        # jitter can make a pair complete after the lone frame behind it, keep time from going backwards for the integrals
+        row_time = np.maximum.accumulate(np.array([self._last_time] + [row[0] for row in rows], dtype=float))[1:]
+        if n > 0:
+            self._last_time = row_time[-1]
+        merged = {'time': row_time}
+        for k, side in enumerate(SIDES):
+            index = np.array([row[k + 1] for row in rows], dtype=int)
+            real = index >= 0
+            side_accel = np.empty((n, SAMPLES_PER_FRAME))
+            side_gyro = np.empty((n, SAMPLES_PER_FRAME))
+            side_accel[real] = accel[side][index[real]]
+            side_gyro[real] = gyro[side][index[real]]
+
+            if not real.all():
+                sample_times = row_time[~real, np.newaxis] - sample_offsets()
+                side_accel[~real], side_gyro[~real] = self._interpolate(side, times[side], accel[side], gyro[side], sample_times)
+                self.stats[f'interpolated_{side}'] += int((~real).sum())
+
+            if real.any():
+                last = index[real][-1]
+                self._context[side] = (times[side][last] - sample_offsets(), accel[side][last], gyro[side][last])
+
+            merged[f'accel_{side}'] = side_accel
+            merged[f'gyro_{side}'] = side_gyro
+
+        self.stats['paired'] += sum(1 for row in rows if row[1] >= 0 and row[2] >= 0)
+        return MergedFrames(**merged)
+
+    def _pair(self, left_times, right_times, horizon):
+        """
+        :param left_times: sorted arrival times of the left frames
+                 right_times: sorted arrival times of the right frames
+                 horizon: only frames that arrived before this get handed out
+        :returns rows: list of (time, left index, right index), index is -1 when that side has to be interpolated
+                   used: side -> number of frames handed out
+
+        walks both streams in arrival order, the partner of a frame can be past the horizon since it's already here
+        """
+        rows = []
+        i = j = 0
+        while True:
+            left = left_times[i] if i < len(left_times) else np.inf
+            right = right_times[j] if j < len(right_times) else np.inf
+            if min(left, right) >= horizon:
+                break
+            if abs(left - right) <= self.tolerance_s:
+                # the pair is complete once the later one shows up, the same as the old one left one right pairing
+                rows.append((max(left, right), i, j))
+                i += 1
+                j += 1
+            elif left < right:
+                rows.append((left, i, -1))
+                i += 1
+            else:
+                rows.append((right, -1, j))
+                j += 1
+        return rows, {'left': i, 'right': j}
+
+    def _interpolate(self, side, times, accel, gyro, sample_times):
+        """
+        :param side: side to interpolate
+                 times: arrival times of that side's frames from this drain
+                 accel, gyro: their decoded samples
+                 sample_times: (rows, 4) times to interpolate at
+        :returns accel, gyro: (rows, 4) interpolated samples
+
+        linear between the real samples either side, holds the nearest value past either end
+        """
+        known_times = [times[:, np.newaxis] - sample_offsets()]
+        known_accel = [accel]
+        known_gyro = [gyro]
+        if self._context[side] is not None:
+            context_times, context_accel, context_gyro = self._context[side]
+            known_times.insert(0, context_times[np.newaxis])
+            known_accel.insert(0, context_accel[np.newaxis])
+            known_gyro.insert(0, context_gyro[np.newaxis])
+
+        known_times = np.concatenate(known_times).ravel()
+        if len(known_times) == 0:
+            # nothing from this side yet, call it stationary
+            return np.zeros(sample_times.shape), np.zeros(sample_times.shape)
+
+        order = np.argsort(known_times, kind='stable')
+        known_times = known_times[order]
+        known_accel = np.concatenate(known_accel).ravel()[order]
+        known_gyro = np.concatenate(known_gyro).ravel()[order]
+        return np.interp(sample_times, known_times, known_accel), np.interp(sample_times, known_times, known_gyro)
+
+
+def sample_offsets(rate=SAMPLE_RATE_HZ) -> np.ndarray:
+    """
+    :param rate: samples per second
+    :returns (4,) how long before the frame arrived each of its samples was taken, oldest first
+    """
+    return np.arange(SAMPLES_PER_FRAME - 1, -1, -1) / rate
+
+
+def merge_summary(stats: Dict) -> str:
+    """
+    :param stats: StreamMerger.stats
+    :returns one line summary for printing
+    """
+    rows = stats['paired'] + stats['interpolated_left'] + stats['interpolated_right']
+    return (f"{rows} frames, {stats['paired']} paired, "
+            f"interpolated {stats['interpolated_left']} left / {stats['interpolated_right']} right, "
+            f"dropped {stats['duplicates_left']} left / {stats['duplicates_right']} right duplicates"
+            + (f", {len(stats['gaps'])} gaps ({sum(end - start for start, end in stats['gaps']):.1f} s)" if stats.get('gaps') else ''))
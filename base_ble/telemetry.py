@@ -0,0 +1,162 @@
+import collections
+import json
+import os
+import threading
+from typing import Dict
+
+import numpy as np
+
+try:
+    from base_ble.stream_merger import FRAME_PERIOD_S, SIDES
+except ModuleNotFoundError:
+    from stream_merger import FRAME_PERIOD_S, SIDES
+
+
+# how many of the latest notifications / rows the rate, jitter and latency numbers are worked out over (about 15 s)
+WINDOW = 256
+
+
+def stats_log_path(packet_log_path) -> str:
+    """
+    :param packet_log_path: path of the recording's PacketLog
+    :returns path for the recording's link stats, next to the packet log with the same name
+    """
+    return f'{os.path.splitext(packet_log_path)[0]}.stats.jsonl'
+
+
+class LinkTelemetry:
+    """
+    health of the ble link while recording, so a slow gui can be told apart from a bad radio
+
+    functions:
+    notified -> counts one notification (called from the ble thread, with what StreamMerger.push returned)
+    drained -> counts rows leaving the jitter buffer and how many frames are still waiting in it (called wherever drain is)
+    snapshot -> everything below as a plain dictionary, ready for json or mongo
+    close -> writes the last snapshot to the stats log
+
+    per side: notifications, rate_hz, jitter_ms (p50, p95, p99 of how far the time between notifications is from one frame period),
+    missing (frames that should have come in between two notifications but didn't), and from the merger's stats
+    duplicates, dropped_in_gaps and interpolated
+    for the pair: latency_ms (p50, p95, max of arrival to leaving the jitter buffer, includes the buffer's own latency_s),
+    queue_depth (frames waiting in the jitter buffer now) and queue_depth_max
+
+    with a log_path a snapshot is appended to it every log_interval_s, one json object per line
+    """
+
+    def __init__(self, merger, log_path=None, log_interval_s=1.0, period_s=FRAME_PERIOD_S):
+        """
+        :param merger: StreamMerger the notifications are going into
+                 log_path: jsonl file to write snapshots to while recording, None to not write any
+                 log_interval_s: time (sec on the recording's clock) between snapshots in the log
+                 period_s: time between notifications from one smarthub when nothing is lost
+        """
+        self.merger = merger
+        self.log_path = log_path
+        if log_path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+        self.log_interval_s = log_interval_s
+        self.period_s = period_s
+
+        self._lock = threading.Lock()
+        self._arrivals = {side: collections.deque(maxlen=WINDOW) for side in SIDES}
+        # last notification on each side, kept or not
+        self._last = {side: None for side in SIDES}
+        self._counts = {side: {'notifications': 0, 'missing': 0} for side in SIDES}
+        self._latency = collections.deque(maxlen=WINDOW)
+        self._queue_depth = 0
+        self._queue_depth_max = 0
+        self._now = 0.0
+        self._last_logged = -np.inf
+
+    def notified(self, side, time_received, kept=True) -> None:
+        """
+        :param side: 'left' or 'right'
+                 time_received: time (sec) the notification arrived
+                 kept: what StreamMerger.push returned, repeats and frames during an outage don't count towards jitter
+        :returns None
+        """
+        with self._lock:
+            counts = self._counts[side]
+            counts['notifications'] += 1
+            last = self._last[side]
+            if last is not None:
+                # jitter can bring a frame up to half a period early or late without anything going missing
+                skipped = int(round((time_received - last) / self.period_s)) - 1
+                if skipped > 0:
+                    counts['missing'] += skipped
+            self._last[side] = time_received
+            if kept:
+                self._arrivals[side].append(time_received)
+
+    def drained(self, now, row_times) -> None:
+        """
+        :param now: time (sec) of the drain
+                 row_times: MergedFrames.time of what came out
+        :returns None
+        """
+        pending = len(self.merger)
+        with self._lock:
+            self._latency.extend(now - np.asarray(row_times, dtype=float))
+            self._queue_depth = pending
+            self._queue_depth_max = max(self._queue_depth_max, pending)
+            self._now = now
+        if self.log_path is not None and now - self._last_logged >= self.log_interval_s:
+            self._last_logged = now
+            self._write()
+
+    def snapshot(self) -> Dict:
+        """
+        :returns current numbers, see the class docstring
+        """
+        with self._lock:
+            arrivals = {side: np.array(self._arrivals[side]) for side in SIDES}
+            counts = {side: dict(self._counts[side]) for side in SIDES}
+            latency = np.array(self._latency)
+            snapshot = {'time': self._now, 'queue_depth': self._queue_depth, 'queue_depth_max': self._queue_depth_max}
+        merge_stats = self.merger.stats
+
+        for side in SIDES:
+            side_stats = counts[side]
+            side_stats['duplicates'] = merge_stats[f'duplicates_{side}']
+            side_stats['dropped_in_gaps'] = merge_stats[f'gap_{side}']
+            side_stats['interpolated'] = merge_stats[f'interpolated_{side}']
+            intervals = np.diff(arrivals[side])
+            # intervals with a lost frame in them would count as jitter otherwise
+            intervals = intervals[intervals < 1.5 * self.period_s]
+            if len(arrivals[side]) > 1 and arrivals[side][-1] > arrivals[side][0]:
+                side_stats['rate_hz'] = (len(arrivals[side]) - 1) / (arrivals[side][-1] - arrivals[side][0])
+            else:
+                side_stats['rate_hz'] = 0.0
+            jitter = np.abs(intervals - self.period_s) * 1000
+            side_stats['jitter_ms'] = _percentiles(jitter, (50, 95, 99))
+            snapshot[side] = side_stats
+
+        snapshot['latency_ms'] = _percentiles(latency * 1000, (50, 95))
+        snapshot['latency_ms']['max'] = float(latency.max() * 1000) if len(latency) else 0.0
+        snapshot['gaps'] = len(merge_stats['gaps'])
+        return snapshot
+
+    def _write(self):
+        with open(self.log_path, 'a') as f:
+            f.write(json.dumps(self.snapshot()) + '\n')
+
+    def close(self) -> None:
+        if self.log_path is not None:
+            self._write()
+
+
+def _percentiles(values, qs) -> Dict[str, float]:
+    if len(values) == 0:
+        return {f'p{q}': 0.0 for q in qs}
+    return {f'p{q}': float(v) for q, v in zip(qs, np.percentile(values, qs))}
+
+
+def link_summary(snapshot: Dict) -> str:
+    """
+    :param snapshot: LinkTelemetry.snapshot
+    :returns a line for each side and one for the pair, for a label or printing
+    """
+    sides = '\n'.join(f"{side[0].upper()} {snapshot[side]['rate_hz']:.1f} Hz, jitter p95 {snapshot[side]['jitter_ms']['p95']:.0f} ms, "
+                       f"{snapshot[side]['missing']} missing, {snapshot[side]['duplicates']} dup"
+                       for side in SIDES)
+    return f"{sides}\nlatency p95 {snapshot['latency_ms']['p95']:.0f} ms, queue {snapshot['queue_depth']}"
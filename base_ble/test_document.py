@@ -0,0 +1,77 @@
+from datetime import datetime
+from typing import Dict
+
+import numpy as np
+
+try:
+    from base_ble.calc import compute_kinematics, Geometry
+    from base_ble.filters import smooth
+except ModuleNotFoundError:
+    from calc import compute_kinematics, Geometry
+    from filters import smooth
+
+
+def build_test(time_from_start, accel_left, accel_right, gyro_left, gyro_right,
+               geometry=Geometry(), left_gain=1.0, right_gain=1.0, smoothing=None) -> Dict:
+    """
+    :param time_from_start: sample times (sec)
+             accel_left, accel_right, gyro_left, gyro_right: raw samples
+             geometry: wheel diameter and distance between the wheels (in)
+             left_gain, right_gain: calibration gains applied to the smoothed gyro data
+             smoothing: filter for the gyro data from filters.make_filter, defaults to the zero phase butterworth
+    :returns test dictionary with the same fields RecordData.save_data posts (minus user info), as numpy arrays
+
+    smooths (the same way RecordData.save_data does) and integrates a whole recording at once
+    """
+    time_from_start = np.ravel(time_from_start)
+    gyro_left = np.ravel(gyro_left)
+    gyro_right = np.ravel(gyro_right)
+    gyro_left_smoothed, gyro_right_smoothed = smooth(np.stack([gyro_left, gyro_right]), time_from_start, smoothing)
+    kinematics = compute_kinematics(time_from_start, gyro_left_smoothed*left_gain, gyro_right_smoothed*right_gain, geometry)
+
+    return {
+        'elapsed_time_s': time_from_start,
+        'gyro_right': gyro_right,
+        'gyro_left': gyro_left,
+        'gyro_right_smoothed': gyro_right_smoothed,
+        'gyro_left_smoothed': gyro_left_smoothed,
+        'accel_right': np.ravel(accel_right),
+        'accel_left': np.ravel(accel_left),
+        'distance_m': kinematics.distance,
+        'heading_deg': kinematics.heading,
+        'displacement_m': kinematics.displacement,
+        'velocity': kinematics.velocity,
+        'traj_x': kinematics.x,
+        'traj_y': kinematics.y,
+    }
+
+
+def test_id(when=None) -> str:
+    """
+    :param when: datetime of the test, defaults to now
+    :returns default _id for the database, the same format RecordData.save_data uses
+    """
+    when = datetime.now() if when is None else when
+    return f"{when.month}/{when.day}/{when.year}_{when.hour}:{when.minute}:{when.second}"
+
+
+def to_document(test, _id=None, **fields) -> Dict:
+    """
+    :param test: dictionary from build_test
+             _id: database id, defaults to test_id()
+             fields: anything else to put in the document (user_id, test_name, additional_notes...)
+    :returns document ready for insert_one
+
+    every series except accel gets cut to the shortest one so view_data can deal with it, the same as save_data,
+    numpy arrays become plain lists since mongo can't store them
+    """
+    series = [key for key, value in test.items() if isinstance(value, np.ndarray) and not key.startswith('accel')]
+    min_len = min(len(test[key]) for key in series)
+
+    document = {'_id': test_id() if _id is None else _id}
+    for key, value in test.items():
+        if key in series:
+            value = value[:min_len]
+        document[key] = value.tolist() if isinstance(value, np.ndarray) else value
+    document.update(fields)
+    return document
@@ -23,8 +23,10 @@ from PIL import Image, ImageTk
 
 from base_ble.params import DATE_DIR, DATE_NOW, left_gain, left_offset, right_gain, right_offset
 
-from base_ble.calibrate import minimize_function
+from base_ble.calibrate import minimize_function, minimize_function_jacobian
 
+from base_ble.decode import decode_frames
+from base_ble.recording_control import RecordingControl
 from base_ble.calc import (
     get_displacement_m,
     get_distance_m,
@@ -65,8 +67,8 @@ class Calibrate:
             'trajectory': []
         }
 
-        self.recording_started = False
-        self.recording_stopped = True
+        # start / stop / disconnect, shared between the buttons and connect_to_device
+        self.control = RecordingControl()
 
         self.calibration_sequence = []
         self.current_calibration_step = 0
@@ -224,11 +226,12 @@ class Calibrate:
 
 
     async def connect_to_device(self, left_address, right_address):
+        self.control.attach()
         try:
-            async with BleakClient(left_address) as left_client:
+            async with BleakClient(left_address, disconnected_callback=self.control.close) as left_client:
                 self.left_smarthub_connection['text'] = 'Connected'
                 self.left_smarthub_connection['foreground'] = '#217346'
-                async with BleakClient(right_address) as right_client:
+                async with BleakClient(right_address, disconnected_callback=self.control.close) as right_client:
                     self.right_smarthub_connection['text'] = 'Connected'
                     self.right_smarthub_connection['foreground'] = '#217346'
 
@@ -297,57 +300,34 @@ class Calibrate:
                         await left_client.start_notify(ch, lambda ch, data: update_data(ch, data, 'left'))
                         await right_client.start_notify(ch, lambda ch, data: update_data(ch, data, 'right'))
 
-                    # just so we know to only intialize the loop once
-                    initial_loop = True
-
-                    # this continually cycles, even if we're not recording
+                    # sleeps on self.control instead of spinning, the start / end buttons and bleak's disconnect callback wake it up
                     while True:
 
                         # if we haven't started recording, just sit here and wait
-                        if self.recording_started == False:
-                            self.recording_stopped = False
-                            # await asyncio.sleep(0)
-                            initial_loop = True
-                            continue
-
-                        # if we've stopped recording, stop notifications
-                        # this should only run once, since next loop iteration will get stuck in the first if statement
-                        if self.recording_stopped == True:
-                            self.recording_started = False
-                            await left_client.stop_notify(ch)
-                            await right_client.stop_notify(ch)
-
-                            self.notifications_started = False
-
-                            # update_graphs_thread.join()
-                            continue
-                            
-                        # if we've started recording, start updating our graphs and make sure our data dictionary is empty
-                        if initial_loop:
-                            self.start_time = time.time()
-                            initial_loop = False
-
-                        # if we've started recording, start notifications
-                        if not self.notifications_started:
-                            await start_notifications(self, left_client, right_client, ch)
-
-                        # all the other stuff is happening asynchronously, so we can just wait here and let the other threads do their thing
-                        await asyncio.sleep(1)
-
-                        # this doesn't always work since the is_connected flag doesn't always update properly
-                        if time.time() - self.start_time > 2:
-                            if not left_client.is_connected:
-                                self.left_smarthub_connection['text'] = 'Disconnected'
-                                self.left_smarthub_connection['foreground'] = '#a92222'
-                                print('left not connected')
-                                await right_client.disconnect()
-                                break
-                            if not right_client.is_connected:
-                                self.right_smarthub_connection['text'] = 'Disconnected'
-                                self.right_smarthub_connection['foreground'] = '#a92222'
-                                print('right not connected')
-                                await left_client.disconnect()
-                                break
+                        if await self.control.wait_until(RecordingControl.RECORDING, RecordingControl.CLOSED) == RecordingControl.CLOSED:
+                            break
+
+                        self.start_time = time.time()
+                        await start_notifications(self, left_client, right_client, ch)
+
+                        # all the other stuff is happening asynchronously, so we just wait for the end button or a disconnect
+                        if await self.control.wait_until(RecordingControl.IDLE, RecordingControl.CLOSED) == RecordingControl.CLOSED:
+                            break
+
+                        # we've stopped recording, stop notifications
+                        await left_client.stop_notify(ch)
+                        await right_client.stop_notify(ch)
+                        self.notifications_started = False
+
+                    # leaving the async with blocks disconnects whichever smarthub is still there
+                    if not left_client.is_connected:
+                        self.left_smarthub_connection['text'] = 'Disconnected'
+                        self.left_smarthub_connection['foreground'] = '#a92222'
+                        print('left not connected')
+                    if not right_client.is_connected:
+                        self.right_smarthub_connection['text'] = 'Disconnected'
+                        self.right_smarthub_connection['foreground'] = '#a92222'
+                        print('right not connected')
 
         except BleakError as e:
             print(f"Failed to connect: {e}")
@@ -385,8 +365,9 @@ class Calibrate:
 
         self.last_time = time_curr
 
-        left_accel_data, left_gyro_data = RecordData.convert_from_raw(left_message)
-        right_accel_data, right_gyro_data = RecordData.convert_from_raw(right_message)
+        # both frames decoded together, row 0 is left and row 1 is right
+        _, gyro_data = decode_frames((left_message, right_message))
+        left_gyro_data, right_gyro_data = gyro_data.tolist()
 
 
         self.calibration_sequence[self.current_calibration_step]['gyro_left'].extend(left_gyro_data)
@@ -469,7 +450,7 @@ class Calibrate:
     def start_calibration(self):
         if self.start_recording_button['text'] == 'Start Calibration':
             print('calibration started')
-            self.recording_started = True
+            self.control.start()
 
             # self.show_images()
 
@@ -478,7 +459,7 @@ class Calibrate:
 
         elif self.start_recording_button['text'] == 'Next Step':
             print('next step')
-            # self.recording_stopped = True
+            # self.control.stop()
 
             if self.current_calibration_step == len(self.calibration_sequence) - 1:
                 self.start_recording_button['text'] = 'End Calibration'
@@ -487,12 +468,10 @@ class Calibrate:
                 self.next_calibration_step()
 
         if self.start_recording_button['text'] == 'End Calibration':
-            self.recording_stopped = True
+            self.control.stop()
             # self.start_recording_button['state'] = 'disabled'
             self.perform_calibration()
 
-            self.recording_started = False
-
             # self.calibration_sequence = []
             # self.current_calibration_step = 0
 
@@ -500,7 +479,7 @@ class Calibrate:
             # self.set_calibration_sequence()
 
     def perform_calibration(self):
-        res = fsolve(minimize_function, [20,20,1,1], args=self.calibration_sequence)
+        res = fsolve(minimize_function, [20,20,1,1], args=self.calibration_sequence, fprime=minimize_function_jacobian)
 
         print(res)
 
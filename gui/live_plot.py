@@ -0,0 +1,252 @@
+import collections
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+import numpy as np
+
+
+# frames of timing kept for RefreshScheduler.stats
+HISTORY = 120
+
+
+class BlitRenderer:
+    """
+    draws the live lines on the record tab without redrawing the rest of the figure every tick
+
+    functions:
+    draw -> puts new data in the live lines and gets it on screen, blitting unless the axes have to grow
+    redraw -> full redraw of the figure on the next draw
+    reset -> forgets the live lines, the next draw fits the axes to the data again (a new recording)
+
+    with decimate the lines only get about as many points as the axes are pixels wide, so the drawing itself doesn't slow
+    down as the recording gets longer either.
+    the live lines are animated, so a full canvas.draw leaves them out and what it draws (axes, ticks, labels, any background
+    tests) is saved as the background. every tick after that just pastes the background back, draws the live lines over it
+    and blits. the limits only ever grow, and by a bit more than needed (headroom) so a recording that keeps going
+    only needs a full redraw every so often instead of every tick
+    """
+
+    def __init__(self, canvas, headroom=0.25, decimate=None):
+        """
+        :param canvas: FigureCanvasTkAgg (or any canvas that supports blitting) the axes are on
+                 headroom: when the data goes past a limit, the limit moves this fraction of the axis span further than it has to
+                 decimate: lod.decimate or the like, cuts each line down to what shows at the axes' size before it's drawn,
+                           None draws every sample
+        """
+        self.canvas = canvas
+        self.headroom = headroom
+        self.decimate = decimate
+        self.background = None
+        # line -> [samples already counted in its extent, (xmin, xmax, ymin, ymax) or None]
+        self._lines = {}
+        self._full = True
+        # anything else that draws the whole figure (set_background, a resize) saves a new background through this
+        self._cid = canvas.mpl_connect('draw_event', self._on_draw)
+
+    def redraw(self) -> None:
+        self._full = True
+
+    def reset(self) -> None:
+        for line in self._lines:
+            line.set_animated(False)
+        self._lines = {}
+        self._full = True
+
+    def _on_draw(self, event):
+        if event is not None and event.canvas is not self.canvas:
+            return
+        self.background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        self._draw_lines()
+
+    def _draw_lines(self):
+        for line in self._lines:
+            # lines can be taken off their axes between ticks (clearing the graphs)
+            if line.axes is not None:
+                line.axes.draw_artist(line)
+
+    def _extent(self, line, x, y):
+        """
+        :returns (xmin, xmax, ymin, ymax) of everything in the line, only looking at the samples new since the last tick
+        """
+        entry = self._lines[line]
+        seen, extent = entry
+        x_new = np.asarray(x[seen:], dtype=float)
+        y_new = np.asarray(y[seen:], dtype=float)
+        finite = np.isfinite(x_new) & np.isfinite(y_new)
+        if finite.any():
+            x_new, y_new = x_new[finite], y_new[finite]
+            new = (x_new.min(), x_new.max(), y_new.min(), y_new.max())
+            extent = new if extent is None else (min(extent[0], new[0]), max(extent[1], new[1]),
+                                                 min(extent[2], new[2]), max(extent[3], new[3]))
+        entry[0] = len(x)
+        entry[1] = extent
+        return extent
+
+    def _grow(self, lim, low, high) -> tuple:
+        """
+        :returns (low, high) with headroom added on whichever side runs past lim, None if it all fits
+        """
+        if low >= lim[0] and high <= lim[1]:
+            return None
+        pad = self.headroom * (high - low)
+        return low - pad if low < lim[0] else low, high + pad if high > lim[1] else high
+
+    def draw(self, lines) -> None:
+        """
+        :param lines: (line, x, y) for every live line, lines missing from this call stop being live
+        :returns None
+        """
+        live = [line for line, _, _ in lines]
+        for line in list(self._lines):
+            if line not in live:
+                line.set_animated(False)
+                del self._lines[line]
+
+        refit = set()
+        for line, x, y in lines:
+            # a new line (or every line after a reset) gets its axes fitted to the data again
+            if line not in self._lines:
+                line.set_animated(True)
+                self._lines[line] = [0, None]
+                refit.add(line.axes)
+                # all of it, not just what's inside the old limits
+                line.set_data(*(self.decimate(line.axes, x, y, view=False) if self.decimate else (x, y)))
+
+        for ax in refit:
+            ax.relim()
+            ax.set_autoscale_on(True)
+            ax.autoscale_view()
+            self._full = True
+
+        for line, x, y in lines:
+            extent = self._extent(line, x, y)
+            if extent is None or line.axes in refit:
+                continue
+            ax = line.axes
+            xlim = self._grow(ax.get_xlim(), extent[0], extent[1])
+            ylim = self._grow(ax.get_ylim(), extent[2], extent[3])
+            if xlim is not None or ylim is not None:
+                xlim = xlim or extent[:2]
+                ylim = ylim or extent[2:]
+                # grow the data limits (they only ever get bigger) and let autoscale set the view rather than setting
+                # it directly, the trajectory's equal aspect ignores fixed limits and would cut the data off
+                ax.update_datalim([(xlim[0], ylim[0]), (xlim[1], ylim[1])])
+                ax.autoscale_view()
+                self._full = True
+
+        # now the limits are settled, cut each line down to what shows inside them
+        for line, x, y in lines:
+            line.set_data(*(self.decimate(line.axes, x, y) if self.decimate else (x, y)))
+
+        if self._full or self.background is None:
+            self._full = False
+            # saves the background and draws the live lines through _on_draw
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self.background)
+            self._draw_lines()
+        self.canvas.blit(self.canvas.figure.bbox)
+
+
+class RefreshScheduler:
+    """
+    picks how often the live graphs refresh from how long refreshing has actually been taking
+
+    functions:
+    start_frame -> call at the top of a refresh, notes how late the tkinter loop got to it
+    phase -> context manager timing one part of the refresh ('compute', 'render')
+    skip_render -> whether to skip drawing this time because the gui is falling behind
+    end_frame -> call at the end of a refresh, returns ms to wait before the next one
+    stats -> the interval it settled on, the rate, skipped frames and the recent timings, for diagnostics
+
+    the graphs get about budget of the main thread: a refresh that takes 40 ms with a budget of 0.25 gets one every 160 ms,
+    clamped to min_interval_ms / max_interval_ms. costs are smoothed so one slow frame (a full redraw) doesn't swing it.
+    when a refresh starts a whole interval late the loop is busy with something else (a slow laptop, a resize), so drawing
+    is skipped and only the cheap compute runs, never more than max_skips in a row so the graphs still move
+    """
+
+    def __init__(self, budget=0.25, min_interval_ms=100, max_interval_ms=2000, max_skips=3, smoothing=0.2):
+        """
+        :param budget: fraction of the main thread's time the graphs are allowed
+                 min_interval_ms, max_interval_ms: fastest and slowest refresh
+                 max_skips: most refreshes in a row that can skip drawing
+                 smoothing: weight of the newest frame in the running cost of each phase
+        """
+        self.budget = budget
+        self.min_interval_ms = min_interval_ms
+        self.max_interval_ms = max_interval_ms
+        self.max_skips = max_skips
+        self.smoothing = smoothing
+
+        self.interval_ms = float(min_interval_ms)
+        # running cost (ms) of each phase
+        self.cost_ms = {}
+        self.frames = 0
+        self.skipped = 0
+        self.history = collections.deque(maxlen=HISTORY)
+        self._due = None
+        self._skips = 0
+        self._frame = None
+
+    def start_frame(self) -> None:
+        now = time.perf_counter()
+        late_ms = 0.0 if self._due is None else max((now - self._due) * 1000, 0.0)
+        self._due = None
+        self._frame = {'start': now, 'late_ms': late_ms, 'rendered': False}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            ms = (time.perf_counter() - start) * 1000
+            self._frame[f'{name}_ms'] = self._frame.get(f'{name}_ms', 0.0) + ms
+            if name == 'render':
+                self._frame['rendered'] = True
+            # phases that didn't run this frame keep their old cost
+            last = self.cost_ms.get(name)
+            self.cost_ms[name] = ms if last is None else last + self.smoothing * (ms - last)
+
+    def skip_render(self) -> bool:
+        """
+        :returns True if this refresh should leave the graphs as they are
+        """
+        skip = self._frame['late_ms'] > self.interval_ms and self._skips < self.max_skips
+        self._skips = self._skips + 1 if skip else 0
+        return skip
+
+    def end_frame(self) -> int:
+        """
+        :returns ms until the next refresh should start (pass to tab.after)
+        """
+        frame = self._frame
+        now = time.perf_counter()
+        elapsed_ms = (now - frame['start']) * 1000
+        self.frames += 1
+        if not frame['rendered']:
+            self.skipped += 1
+
+        cost = sum(self.cost_ms.values())
+        self.interval_ms = float(np.clip(cost / self.budget, self.min_interval_ms, self.max_interval_ms))
+        frame.update(elapsed_ms=elapsed_ms, interval_ms=self.interval_ms)
+        del frame['start']
+        self.history.append(frame)
+
+        # the interval runs start to start, but always leave tkinter a moment to itself
+        delay_ms = max(self.interval_ms - elapsed_ms, 10.0)
+        self._due = now + delay_ms / 1000
+        return int(delay_ms)
+
+    @property
+    def rate_hz(self) -> float:
+        return 1000 / self.interval_ms
+
+    def stats(self) -> Dict:
+        """
+        :returns interval_ms, rate_hz, frames, skipped, running cost_ms of each phase and the last HISTORY frames
+                 (late_ms, compute_ms, render_ms, elapsed_ms, interval_ms, rendered)
+        """
+        return {'interval_ms': self.interval_ms, 'rate_hz': self.rate_hz, 'frames': self.frames, 'skipped': self.skipped,
+                'cost_ms': dict(self.cost_ms), 'history': list(self.history)}
@@ -0,0 +1,119 @@
+import numpy as np
+
+
+# points per pixel of axes width we aim for, min/max gives up to 4 per bucket so one bucket per pixel is plenty
+BUCKETS_PER_PIXEL = 1
+# how far the trajectory gets extra detail when it's zoomed in (its points aren't in order along either axis,
+# so it can't be cut down to just what's on screen like the time plots)
+MAX_ZOOM_DETAIL = 64
+
+
+def minmax_indices(n, columns, buckets) -> np.ndarray:
+    """
+    :param n: number of samples
+             columns: arrays (each n long) whose extremes have to survive, [y] for a time plot, [x, y] for the trajectory
+             buckets: how many buckets to split the samples into, about one per pixel
+    :returns sorted indices of the samples to keep
+
+    keeps the first sample, the smallest and the largest of every column in each bucket, plus the very last sample.
+    drawn one bucket per pixel that's the same picture as every sample, every spike still reaches its height
+    """
+    if buckets < 1 or n <= 4 * buckets:
+        return np.arange(n)
+    size = -(-n // buckets)
+    buckets = -(-n // size)
+    starts = np.arange(buckets) * size
+    keep = [starts, [n - 1]]
+    for column in columns:
+        column = np.asarray(column, dtype=float)
+        # pad the last bucket with its last value so every bucket is the same size and it all reshapes in one go
+        padded = np.pad(column, (0, buckets * size - n), mode='edge').reshape(buckets, size)
+        # nan would win every argmin / argmax, keep them from hiding the real extremes
+        keep.append(starts + np.nanargmin(np.where(np.isnan(padded), np.inf, padded), axis=1))
+        keep.append(starts + np.nanargmax(np.where(np.isnan(padded), -np.inf, padded), axis=1))
+    return np.unique(np.minimum(np.concatenate(keep), n - 1))
+
+
+def is_sorted(x) -> bool:
+    return len(x) < 2 or bool(np.all(x[1:] >= x[:-1]))
+
+
+def pixel_width(ax) -> int:
+    return max(int(ax.bbox.width), 1)
+
+
+def decimate(ax, x, y, sorted_x=None, view=True, detail=1.0):
+    """
+    :param ax: axes the line is drawn on, for its width in pixels and (with view) its current limits
+             x, y: every sample
+             sorted_x: whether x only goes up (time), worked out from x if not given
+             view: only keep what's inside the current x limits (for sorted x) or add detail for the current zoom (trajectory),
+                   False to cover everything (before autoscaling, so the limits come out right)
+             detail: fraction of the usual points to keep, less for a quick preview while a slider is dragged
+    :returns x, y with only the samples that make a difference on screen, at most a few per pixel whatever the recording length
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if sorted_x is None:
+        sorted_x = is_sorted(x)
+    lo, hi = 0, len(x)
+    buckets = max(int(pixel_width(ax) * BUCKETS_PER_PIXEL * detail), 1)
+
+    if view and len(x) > 1:
+        xlim = ax.get_xlim()
+        if sorted_x:
+            # one sample past each edge so the line still runs off the side
+            lo = max(int(np.searchsorted(x, xlim[0], side='left')) - 1, 0)
+            hi = min(int(np.searchsorted(x, xlim[1], side='right')) + 1, len(x))
+        else:
+            span = np.nanmax(x) - np.nanmin(x)
+            view_span = abs(xlim[1] - xlim[0])
+            if view_span > 0 and span > view_span:
+                buckets = int(buckets * min(span / view_span, MAX_ZOOM_DETAIL))
+
+    x, y = x[lo:hi], y[lo:hi]
+    keep = minmax_indices(len(x), [y] if sorted_x else [x, y], buckets)
+    return x[keep], y[keep]
+
+
+class LODLine:
+    """
+    a line that only ever hands matplotlib about as many points as the axes is pixels wide
+
+    functions:
+    set_range -> shows just the samples between two indexes (the time range slider), with less detail for a preview
+    update -> picks the points again for the current limits and size, called by itself whenever the x limits change
+
+    keeps every sample itself, so zooming in or widening the range brings the detail back
+    """
+
+    def __init__(self, ax, x, y, **kwargs):
+        """
+        :param ax: axes to plot on
+                 x, y: every sample
+                 kwargs: passed to ax.plot (label, color...)
+        """
+        self.ax = ax
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.sorted_x = is_sorted(self.x)
+        self.lo, self.hi = 0, len(self.x)
+        self.detail = 1.0
+        self.line, = ax.plot(*decimate(ax, self.x, self.y, self.sorted_x, view=False), **kwargs)
+        # clearing the axes drops this along with the line
+        ax.callbacks.connect('xlim_changed', lambda ax: self.update())
+
+    def set_range(self, lo, hi, detail=1.0) -> None:
+        """
+        :param lo, hi: indexes of the first sample to show and one past the last
+                 detail: fraction of the usual points, see decimate
+        :returns None
+
+        covers the whole range (not just what's in view) so relim / autoscale afterwards fit it
+        """
+        self.lo, self.hi = lo, hi
+        self.detail = detail
+        self.line.set_data(*decimate(self.ax, self.x[lo:hi], self.y[lo:hi], self.sorted_x, view=False, detail=detail))
+
+    def update(self) -> None:
+        self.line.set_data(*decimate(self.ax, self.x[self.lo:self.hi], self.y[self.lo:self.hi], self.sorted_x, detail=self.detail))
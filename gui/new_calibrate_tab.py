@@ -4,7 +4,6 @@ from gui.record_data_tab import RecordData
 import copy
 
 from scipy.optimize import minimize, fsolve
-from scipy.fftpack import fftfreq, irfft, rfft
 
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.figure import Figure
@@ -27,8 +26,11 @@ from PIL import Image, ImageTk
 from base_ble.params import DATE_DIR, DATE_NOW, left_gain, left_offset, right_gain, right_offset
 
 from base_ble.calibrate import minimize_function
-from base_ble.minimize_traj import minimize_turnaround
+from base_ble.minimize_traj import minimize_turnaround, minimize_turnaround_jacobian
 
+from base_ble.decode import decode_frames
+from base_ble.filters import make_filter, smooth
+from base_ble.recording_control import RecordingControl
 from base_ble.calc import (
     get_displacement_m,
     get_distance_m,
@@ -64,8 +66,8 @@ class NewCalibrate:
             'gyro_left_smoothed': [],
         }
 
-        self.recording_started = False
-        self.recording_stopped = True
+        # start / stop / disconnect, shared between the buttons and connect_to_device
+        self.control = RecordingControl()
 
         self.calibration_sequence = []
         self.current_calibration_step = 0
@@ -73,11 +75,12 @@ class NewCalibrate:
         self.create_widgets()
 
     async def connect_to_device(self, left_address, right_address):
+        self.control.attach()
         try:
-            async with BleakClient(left_address) as left_client:
+            async with BleakClient(left_address, disconnected_callback=self.control.close) as left_client:
                 self.left_smarthub_connection['text'] = 'Connected'
                 self.left_smarthub_connection['foreground'] = '#217346'
-                async with BleakClient(right_address) as right_client:
+                async with BleakClient(right_address, disconnected_callback=self.control.close) as right_client:
                     self.right_smarthub_connection['text'] = 'Connected'
                     self.right_smarthub_connection['foreground'] = '#217346'
 
@@ -146,57 +149,35 @@ class NewCalibrate:
                         await left_client.start_notify(ch, lambda ch, data: update_data(ch, data, 'left'))
                         await right_client.start_notify(ch, lambda ch, data: update_data(ch, data, 'right'))
 
-                    # just so we know to only intialize the loop once
-                    initial_loop = True
-
-                    # this continually cycles, even if we're not recording
+                    # sleeps on self.control instead of spinning, the start / end buttons and bleak's disconnect callback wake it up
                     while True:
 
                         # if we haven't started recording, just sit here and wait
-                        if self.recording_started == False:
-                            self.recording_stopped = False
-                            # await asyncio.sleep(0)
-                            initial_loop = True
-                            continue
-
-                        # if we've stopped recording, stop notifications
-                        # this should only run once, since next loop iteration will get stuck in the first if statement
-                        if self.recording_stopped == True:
-                            self.recording_started = False
-                            await left_client.stop_notify(ch)
-                            await right_client.stop_notify(ch)
-
-                            self.notifications_started = False
-
-                            # for this we only want to record once, then we'll disconnect
+                        if await self.control.wait_until(RecordingControl.RECORDING, RecordingControl.CLOSED) == RecordingControl.CLOSED:
+                            break
+
+                        self.start_time = time.time()
+                        await start_notifications(self, left_client, right_client, ch)
+
+                        # all the other stuff is happening asynchronously, so we just wait for the end button or a disconnect
+                        if await self.control.wait_until(RecordingControl.IDLE, RecordingControl.CLOSED) == RecordingControl.CLOSED:
                             break
-                            
-                        # if we've started recording, start updating our graphs and make sure our data dictionary is empty
-                        if initial_loop:
-                            self.start_time = time.time()
-                            initial_loop = False
-
-                        # if we've started recording, start notifications
-                        if not self.notifications_started:
-                            await start_notifications(self, left_client, right_client, ch)
-
-                        # all the other stuff is happening asynchronously, so we can just wait here and let the other threads do their thing
-                        await asyncio.sleep(1)
-
-                        # this doesn't always work since the is_connected flag doesn't always update properly
-                        if time.time() - self.start_time > 2:
-                            if not left_client.is_connected:
-                                self.left_smarthub_connection['text'] = 'Disconnected'
-                                self.left_smarthub_connection['foreground'] = '#a92222'
-                                print('left not connected')
-                                await right_client.disconnect()
-                                break
-                            if not right_client.is_connected:
-                                self.right_smarthub_connection['text'] = 'Disconnected'
-                                self.right_smarthub_connection['foreground'] = '#a92222'
-                                print('right not connected')
-                                await left_client.disconnect()
-                                break
+
+                        # we've stopped recording, stop notifications
+                        await left_client.stop_notify(ch)
+                        await right_client.stop_notify(ch)
+                        # for this we only want to record once, then we'll disconnect
+                        break
+
+                    # leaving the async with blocks disconnects whichever smarthub is still there
+                    if not left_client.is_connected:
+                        self.left_smarthub_connection['text'] = 'Disconnected'
+                        self.left_smarthub_connection['foreground'] = '#a92222'
+                        print('left not connected')
+                    if not right_client.is_connected:
+                        self.right_smarthub_connection['text'] = 'Disconnected'
+                        self.right_smarthub_connection['foreground'] = '#a92222'
+                        print('right not connected')
 
         except BleakError as e:
             print(f"Failed to connect: {e}")
@@ -235,8 +216,9 @@ class NewCalibrate:
 
         self.last_time = time_curr
 
-        left_accel_data, left_gyro_data = RecordData.convert_from_raw(left_message)
-        right_accel_data, right_gyro_data = RecordData.convert_from_raw(right_message)
+        # both frames decoded together, row 0 is left and row 1 is right
+        _, gyro_data = decode_frames((left_message, right_message))
+        left_gyro_data, right_gyro_data = gyro_data.tolist()
 
 
         self.data['gyro_left'].extend(left_gyro_data)
@@ -315,18 +297,16 @@ class NewCalibrate:
     def start_calibration(self):
         if self.start_recording_button['text'] == 'Start Calibration':
             print('calibration started')
-            self.recording_started = True
+            self.control.start()
 
             self.start_recording_button['text'] = 'End Calibration'
 
         elif self.start_recording_button['text'] == 'End Calibration':
-            self.recording_stopped = True
+            self.control.stop()
             self.perform_calibration()
 
             self.start_recording_button['text'] = 'Calibrating...'
 
-            self.recording_started = False
-
 
     def smooth_data(self):
         data = {'time_from_start': copy.deepcopy(self.data['time_from_start']),
@@ -339,28 +319,11 @@ class NewCalibrate:
         data['gyro_right'] = data['gyro_right'][:min_len]
         data['time_from_start'] = data['time_from_start'][:min_len]
 
-        # Filtering with low pass filter
-        filter_freq =  6
-        # Calculate fourier transform of right gyroscope data to convert to frequency domain
-        W_right = fftfreq(len(data['gyro_right']), d=data['time_from_start'][1]-data['time_from_start'][0])
-        f_gyro_right = rfft(data['gyro_right'])
-        # Filter out right gyroscope signal above 6 Hz
-        f_right_filtered = f_gyro_right.copy()
-        f_right_filtered[(np.abs(W_right)>filter_freq)] = 0
-        # convert filtered signal back to time domain
-        gyro_right_smoothed = irfft(f_right_filtered)
+        # smoothed the same way as a saved test, both wheels at once
+        gyro_left_smoothed, gyro_right_smoothed = smooth(np.stack([data['gyro_left'], data['gyro_right']]), data['time_from_start'],
+                                                         make_filter(self.config.get('gyro_filter')))
 
         self.data['gyro_right_smoothed'] = list(gyro_right_smoothed)
-
-        # Calculate fourier transform of right gyroscope data to convert to frequency domain
-        W_left = fftfreq(len(data['gyro_left']), d=data['time_from_start'][1]-data['time_from_start'][0])
-        f_gyro_left = rfft(data['gyro_left'])
-        # Filter out right gyroscope signal above 6 Hz
-        f_left_filtered = f_gyro_left.copy()
-        f_left_filtered[(np.abs(W_left)>filter_freq)] = 0
-        # convert filtered signal back to time domain
-        gyro_left_smoothed = irfft(f_left_filtered)
-
         self.data['gyro_left_smoothed'] = list(gyro_left_smoothed)
 
     def perform_calibration(self):
@@ -370,7 +333,7 @@ class NewCalibrate:
         with open("data.json", "w") as json_file:
             json.dump(self.data, json_file, indent=4)
 
-        self.left_gain, self.right_gain, self.wheel_dist = fsolve(minimize_turnaround, [20,20,20], args=self.data)
+        self.left_gain, self.right_gain, self.wheel_dist = fsolve(minimize_turnaround, [20,20,20], args=self.data, fprime=minimize_turnaround_jacobian)
 
         self.show_calibration_results()
 
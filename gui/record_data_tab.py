@@ -1,5 +1,4 @@
 import asyncio
-import copy
 import threading
 import time
 import tkinter as tk
@@ -8,22 +7,31 @@ from tkinter import font, Label, ttk
 from typing import Tuple
 
 import numpy as np
-from scipy.fftpack import fftfreq, irfft, rfft
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.figure import Figure
 from pymongo import MongoClient
-from bleak import BleakScanner, BleakClient, BleakError
+from bleak import BleakClient, BleakError
 
 from gui.view_data_tab import ViewData
+from gui.live_plot import BlitRenderer, RefreshScheduler
+from gui.lod import decimate, LODLine
 
 from base_ble.params import (
     DATE_DIR, DATE_NOW, left_gain, left_offset, 
     right_gain, right_offset, WHEEL_DIAM_IN, DIST_WHEELS_IN
 )
-from base_ble.calc import (
-    get_displacement_m, get_distance_m, get_velocity_m_s, 
-    get_heading_deg, get_top_traj
-)
+from base_ble.calc import compute_kinematics, Geometry, KinematicsIntegrator
+from base_ble.decode import decode_frames
+from base_ble.stream_merger import StreamMerger, merge_summary, sample_offsets
+from base_ble.packet_log import PacketLog, log_settings, raw_log_path
+from base_ble.ble_process import IngestProcess, CHANNELS as INGEST_CHANNELS, CHANNEL_DTYPES as INGEST_DTYPES
+from base_ble.sample_store import SampleStore
+from base_ble.recording_control import RecordingControl
+from base_ble.telemetry import LinkTelemetry, link_summary, stats_log_path
+from base_ble.filters import make_filter, smooth, StreamingLowpass
+from base_ble.scanner import AddressCache, connect_pair, reconnect_dropped, scan_for
+from base_ble.chunk_store import ChunkWriteError, ChunkWriter
+from base_ble.test_document import test_id
 
 class RecordData:
     """
@@ -33,15 +41,23 @@ class RecordData:
     __init__ -> initializes the class
     set_operator_id -> sets the operator id for the test
     convert_from_raw -> converts raw data from smarthub to true acceleration and gyro data
-    parse_data -> parses raw data from smarthubs and appends to data dictionary
-    update_graphs -> updates the graphs with new data
+    parse_data -> queues raw data from smarthubs to be decoded
+    decode_packets -> lines up and decodes everything queued by parse_data in one batch and appends it to the sample store
+    update_graphs -> updates the graphs with new data, as often as the refresh scheduler says
+    integrate_new -> low passes and integrates the new samples
+    draw_graphs -> puts the integrated data on the graphs
+    update_link_stats -> shows notification rate, jitter, loss and latency under the record button
     set_background -> sets the background of the graphs to the data passed in
     select_calibration -> selects the calibration from the calibration combobox
     update_calibration -> updates the calibration values based on the calibration selected in the combobox
-    _connect_to_device -> connects to the left and right smarthubs
+    log_settings -> the calibration and gyro filter in use, for the packet log
+    _connect_to_device -> connects to the left and right smarthubs (at the same time)
+    stop_after_disconnect -> stops and saves the recording if the connection went while recording
     missing_smarthubs -> shows a popup if we're missing smarthubs
-    _find_smarthubs -> finds the smarthubs with ble scanner
+    _find_smarthubs -> finds the smarthubs in the address cache or with ble scanner
     connect_smarthubs -> makes our ble thread and calls _find_smarthubs
+    connect_ingest_process -> runs ble in its own process instead of a thread
+    poll_ingest -> handles status messages from the ble process
     start_recording -> handles start vs stop recording and variables associated with that
     reset_data -> resets the data dictionary
     save_data -> saves the data to the database and formats it correctly
@@ -53,6 +69,8 @@ class RecordData:
     def __init__(self, tab: tk.Frame, database: MongoClient, filepath: str, screen_size: Tuple[int, int], config: dict) -> None: 
         self.tab = tab
         self.test_collection = database.Smarthub.test_collection
+        # tests are saved a minute at a time in here, with a header in test_collection
+        self.test_chunks = database.Smarthub.test_chunks
         self.test_config = database.Smarthub.test_config
         self.filepath = filepath
         self.screen_width, self.screen_height = screen_size
@@ -80,12 +98,31 @@ class RecordData:
 
         # self.ble_thread = None
 
-        # have we started recording? this will be set to true once we have
-        self.recording_started = False
-        # have we stopped recording? this will be set to false once we start recording
-        self.recording_stopped = True
-        # reason for two of these is so we can cycle through one if statement while we haven't started recording, then 
-        # go through the other if statement once when we've stopped.  logic is handled in connect_to_device
+        # what we connect to the smarthubs with, swap in SmarthubSimulator.client (and connect to 'left', 'right') to run without hardware
+        self.ble_client = BleakClient
+        # last addresses each smarthub pair connected on, so we don't have to scan every time
+        self.address_cache = AddressCache()
+
+        # raw notifications go straight to disk while we record, see base_ble/packet_log.py to rebuild a test from one
+        self.packet_log = None
+
+        # ble process, only used when "ble_process": true is in config.json (otherwise ble runs in a thread of this process)
+        self.ingest = None
+        # merge stats of the last recording from the ble process
+        self.ingest_stats = None
+        # link stats from the ble process, sent every second while recording
+        self.ingest_link_stats = {}
+        # packet log the ble process is writing the recording to
+        self.ingest_log_path = None
+
+        # are we recording? the buttons change this and connect_to_device sleeps on it, see RecordingControl
+        self.control = RecordingControl()
+
+        # saves the recording to the database as it goes, made on the first update_graphs with data
+        self.chunk_writer = None
+
+        # what the saved test's gyro data gets smoothed with, "gyro_filter" in config.json picks another one (see base_ble/filters.py)
+        self.smoothing = make_filter(self.config.get('gyro_filter'))
 
 
         # initialize empty dictionary to store data
@@ -151,207 +188,197 @@ class RecordData:
 
         1 refers to oldest data, 4 refers to newest data
 
+        single frame version of base_ble.decode.decode_frames, use that directly for more than one frame
         """
 
-        accel_data = []
-        gyro_data = []
-
-        for i in range(4):
+        accel_data, gyro_data = decode_frames(raw_data)
+        return accel_data[0].tolist(), gyro_data[0].tolist()
 
-            # LSB first
-            accel_data.append((raw_data[2*i+2] + raw_data[2*i+3]*256) / 1000)  # bytes 2, 4, 6, 8 convert to true accel data
-
-            gyro_data.append((raw_data[2*i+10] + raw_data[2*i+11]*256) / 100) # bytes 10, 12, 14, 16 convert to true gyro data
+    def parse_data(self, side: str, message: bytearray) -> None:
+        """
+        :param side: 'left' or 'right'
+                 message: 18 len bytearray of raw data from that smarthub
+        :returns None
 
-            # pull signs from sign bytes to modify data
-            if (raw_data[0] & (1 << i)) == (1 << i):
-                accel_data[i] *= -1
+        queues raw data from a smarthub along with when it arrived, decode_packets turns it into numbers later
+        this runs in the ble callback, so it only does the bare minimum and keeps notifications flowing
+        """
 
-            if (raw_data[1] & (1 << i)) == (1 << i):
-                gyro_data[i] *= -1
-        return accel_data, gyro_data
+        time_received = time.time() - self.start_time
+        self.packet_log.append(side, time_received, message)
+        self.telemetry.notified(side, time_received, self.merger.push(side, time_received, message))
 
-    def parse_data(self, left_message: bytearray, right_message: bytearray) -> None:
+    def decode_packets(self, flush: bool = False) -> None:
         """
-        :param left_message: 18 len bytearray of raw data from left smarthub
-                 right_message: 18 len bytearray from right smarthub
+        :param flush: take everything left in the jitter buffer, for once the notifications have stopped
         :returns None
 
-        parses raw data from smarthubs and appends to data dictionary
+        decodes and lines up every frame queued by parse_data in one batch and appends it to the sample store
         handles time calculation, knowing that the sensor data is acquired every 1/68 seconds
-        adds to accel_left, accel_right, gyro_left, gyro_right, time_from_start in data dict
+        adds to accel_left, accel_right, gyro_left, gyro_right, time_from_start in self.data
         """
 
-        time_curr = time.time() - self.start_time
-        
-        # if not hasattr(self, 'last_time'):
-        #     self.last_time = time_curr
-        #     return
-        time_vals = []
-        for i in range(3, -1, -1):
-
-            time_vals.append(time_curr - i * 1/68)
-            # time_vals.append(i * (time_curr - self.last_time) / 4 + self.last_time)
+        # the ble process has already lined up and decoded everything, just copy it out of shared memory
+        if self.ingest is not None:
+            # the process sends its stats once it has written the last samples
+            if flush and self.ingest_stats is None:
+                recorded = self.ingest.wait_for('recorded')
+                if recorded is not None:
+                    self.ingest_stats, self.ingest_link_stats = recorded[1:]
+            for samples in self.ingest.ring.read():
+                self.data.extend(**dict(zip(INGEST_CHANNELS, samples)))
+            return
 
-        # self.last_time = time_curr
+        now = time.time() - self.start_time
+        merged = self.merger.drain(now, flush=flush)
+        self.telemetry.drained(now, merged.time)
+        if len(merged.time) == 0:
+            return
 
-        left_accel_data, left_gyro_data = self.convert_from_raw(left_message)
-        right_accel_data, right_gyro_data = self.convert_from_raw(right_message)
+        # each frame holds the 4 samples leading up to when it arrived, oldest first
+        time_vals = merged.time[:, np.newaxis] - sample_offsets()
 
-        self.data['accel_left'].extend(left_accel_data)
-        self.data['accel_right'].extend(right_accel_data)
-        self.data['gyro_left'].extend(left_gyro_data)
-        self.data['gyro_right'].extend(right_gyro_data)
-        self.data['time_from_start'].extend(time_vals)
+        self.data.extend(accel_left=merged.accel_left,
+                         accel_right=merged.accel_right,
+                         gyro_left=merged.gyro_left,
+                         gyro_right=merged.gyro_right,
+                         time_from_start=time_vals)
 
     def update_graphs(self) -> None:
         """
         :param None
         :returns None
 
-        this function is called every 400 ms to update the graphs with new data
+        this function is called every so often to update the graphs with new data, how often depends on how long it's been taking
+        (self.refresh, see RefreshScheduler in gui/live_plot.py)
         it filters the gyro data with a low pass filter
-        it then calculates distance, displacement, heading, velocity, and trajectory
-        it then updates the subplots with the new data
+        it then integrates distance, displacement, heading, velocity, and trajectory for the samples that are new since the last call
+        it then updates the subplots with the new data, blitting just the lines unless the axes need to grow (see gui/live_plot.py)
 
         by calling itself with .after(), it runs in the main thread and doesn't block the GUI or block BLE notifications
         because data acquisition and visualization are done in separate threads, we have to make sure we don't get a race condition
 
         if we don't have any data yet, we wait 200 ms before trying again
+        if the gui is falling behind, some updates only do the filtering and integrating and leave the graphs alone
 
         if there is a background set, we use self.line_pos to update the correct line in the graph
 
         """
 
-        # set update frequency
-        # this doesn't mean the graphs are updated every 400 ms, it schedules the function to run 400 ms after this iteration ends
-        update_frequency = 400
+        self.refresh.start_frame()
+
+        # pull in everything the smarthubs sent since last time
+        with self.refresh.phase('compute'):
+            self.decode_packets()
+        self.update_link_stats()
 
         # if no data then update in 200 ms
-        if len(self.data['time_from_start']) < 1:
-            if not self.recording_stopped:
+        if len(self.data) < 1:
+            self.refresh.end_frame()
+            if self.control.recording:
                 self.tab.after(200, self.update_graphs)
             return
-        
-        # set value of time and gyros so we don't get a race condition, other data is being updated in real time
-        data = {'time_from_start': copy.deepcopy(self.data['time_from_start']),
-                'gyro_left': copy.deepcopy(self.data['gyro_left']),
-                'gyro_right': copy.deepcopy(self.data['gyro_right'])}
-        
-        # make sure all our data is the same length and wasn't updated at different times
-        if len(data['time_from_start']) != len(data['gyro_left']):
-            print('Data length mismatch at time', data['time_from_start'][-1])
-            self.tab.after(int(update_frequency/4), self.update_graphs)
-            return
-        if len(data['time_from_start']) != len(data['gyro_right']):
-            print('Data length mismatch at time', data['time_from_start'][-1])
-            self.tab.after(int(update_frequency/4), self.update_graphs)
-            return
-        if len(data['gyro_left']) != len(data['gyro_right']):
-            print('Data length mismatch at time', data['time_from_start'][-1])
-            self.tab.after(int(update_frequency/4), self.update_graphs)
-            return
 
-        try:
-            # Filtering with low pass filter
-            filter_freq =  6
-            # Calculate fourier transform of right gyroscope data to convert to frequency domain
-            W_right = fftfreq(len(data['gyro_right']), d=data['time_from_start'][1]-data['time_from_start'][0])
-            f_gyro_right = rfft(data['gyro_right'])
-            # Filter out right gyroscope signal above 6 Hz
-            f_right_filtered = f_gyro_right.copy()
-            f_right_filtered[(np.abs(W_right)>filter_freq)] = 0
-            # convert filtered signal back to time domain
-            gyro_right_smoothed = irfft(f_right_filtered)
-
-            self.data['gyro_right_smoothed'] = gyro_right_smoothed
-
-            # Calculate fourier transform of right gyroscope data to convert to frequency domain
-            W_left = fftfreq(len(data['gyro_left']), d=data['time_from_start'][1]-data['time_from_start'][0])
-            f_gyro_left = rfft(data['gyro_left'])
-            # Filter out right gyroscope signal above 6 Hz
-            f_left_filtered = f_gyro_left.copy()
-            f_left_filtered[(np.abs(W_left)>filter_freq)] = 0
-            # convert filtered signal back to time domain
-            gyro_left_smoothed = irfft(f_left_filtered)
-
-            self.data['gyro_left_smoothed'] = gyro_left_smoothed
-
-        # only get this if we somehow missed the race condition
-        except ValueError:
-            print('Value error in filtering, retrying')
-            self.tab.after(int(update_frequency/4), self.update_graphs)
-            return
-        
-        gyro_left_smoothed = gyro_left_smoothed*self.left_gain
-        gyro_right_smoothed = gyro_right_smoothed*self.right_gain
-
-        # Derive distance based on data:
-        self.data['dist_m'][:] = get_distance_m(data['time_from_start'], gyro_left_smoothed,
-                                            gyro_right_smoothed, diameter=self.diameter, dist_wheels=self.dist_wheels)
-        # Calculate displacement for the data['trajectory']:
-        self.data['disp_m'][:] = get_displacement_m(data['time_from_start'], gyro_left_smoothed,
-                                                gyro_right_smoothed, diameter=self.diameter, dist_wheels=self.dist_wheels)
-        # Find heading angle over time:
-        self.data['heading_deg'][:] = get_heading_deg(data['time_from_start'], gyro_left_smoothed,
-                                                    gyro_right_smoothed, diameter=self.diameter, dist_wheels=self.dist_wheels)
-        # Calculate Velocity over time:
-        self.data['velocity'][:] = get_velocity_m_s(data['time_from_start'], gyro_left_smoothed,
-                                                gyro_right_smoothed, diameter=self.diameter, dist_wheels=self.dist_wheels)
-        # Process data['trajectory']:
-        self.data['trajectory'][:] = get_top_traj(self.data['disp_m'], self.data['velocity'], self.data['heading_deg'],
-                                                data['time_from_start'], diameter=self.diameter, dist_wheels=self.dist_wheels)  # use displacement
+        with self.refresh.phase('compute'):
+            self.integrate_new()
 
-        # update subplots, if there's a background make sure we update the right graphs
-        # update distance plot
-        # if no lines on the graph or if we've set a background and we're starting a new graph
-        if not self.axs[0].lines or (self.background_set and len(self.axs[0].lines) == 1):
-            self.axs[0].plot(data['time_from_start'], self.data['dist_m'])
-        # if there's a background and we're not starting a new graph
-        elif self.background_set:
-            self.axs[0].lines[self.line_pos].set_data(data['time_from_start'], self.data['dist_m'])
-        # if there's no background and we're not starting a new graph
-        else:
-            self.axs[0].lines[0].set_data(data['time_from_start'], self.data['dist_m'])
+            # raw samples go to the database a chunk at a time while we record, so a long test never has to go in one piece
+            # the _id is when recording started
+            if self.chunk_writer is None:
+                self.chunk_writer = ChunkWriter(self.test_collection, self.test_chunks, test_id(datetime.fromtimestamp(self.start_time)))
+            self.chunk_writer.write({'elapsed_time_s': self.data['time_from_start'],
+                                     'gyro_right': self.data['gyro_right'],
+                                     'gyro_left': self.data['gyro_left'],
+                                     'accel_right': self.data['accel_right'],
+                                     'accel_left': self.data['accel_left']})
 
-        # update trajectory plot
-        if not self.axs[1].lines or (self.background_set and len(self.axs[1].lines) == 1):
-            self.axs[1].plot([i[0] for i in self.data['trajectory']], [i[1] for i in self.data['trajectory']])
-        elif self.background_set:
-            self.axs[1].lines[self.line_pos].set_data([i[0] for i in self.data['trajectory']], [i[1] for i in self.data['trajectory']])
-        else:
-            self.axs[1].lines[0].set_data([i[0] for i in self.data['trajectory']], [i[1] for i in self.data['trajectory']])
+        # the integrating above always has to happen, the drawing can wait a frame if we're behind
+        # (never once recording has stopped, save_data wants the last of it on screen)
+        if not (self.control.recording and self.refresh.skip_render()):
+            with self.refresh.phase('render'):
+                self.draw_graphs()
 
-        # update heading plot
-        if not self.axs[2].lines or (self.background_set and len(self.axs[2].lines) == 1):
-            self.axs[2].plot(data['time_from_start'], self.data['heading_deg'])
-        elif self.background_set:
-            self.axs[2].lines[self.line_pos].set_data(data['time_from_start'], self.data['heading_deg'])
-        else:
-            self.axs[2].lines[0].set_data(data['time_from_start'], self.data['heading_deg'])
+        delay = self.refresh.end_frame()
 
-        # update velocity plot
-        if not self.axs[3].lines or (self.background_set and len(self.axs[3].lines) == 1):
-            self.axs[3].plot(data['time_from_start'], self.data['velocity'])
-        elif self.background_set:
-            self.axs[3].lines[self.line_pos].set_data(data['time_from_start'], self.data['velocity'])
-        else:
-            self.axs[3].lines[0].set_data(data['time_from_start'], self.data['velocity'])
+        # if recording stops, we'll fall through this statement and end the function loop
+        # otherwise keep calling it in the interval
+        if self.control.recording:
+            self.tab.after(delay, self.update_graphs)
 
+    def integrate_new(self) -> None:
+        """
+        :param None
+        :returns None
 
-        # update the limits of the axes
-        for ax in self.axs:
-            ax.relim()
-            ax.autoscale()
+        low passes and integrates the samples that are new since the last call, the compute half of update_graphs
+        """
+        # read only views of time and gyros, new samples only get added by decode_packets on this thread
+        # and every channel is appended together, so these are always the same length
+        data = {'time_from_start': self.data['time_from_start'],
+                'gyro_left': self.data['gyro_left'],
+                'gyro_right': self.data['gyro_right']}
+
+        # low pass the new samples only, both wheels in one go. the filter carries its state over from the last tick
+        # so samples already smoothed (and drawn and integrated) never change
+        smoothed = len(self.smoothed)
+        new_smoothed = self.lowpass.process(np.stack([data['gyro_left'][smoothed:], data['gyro_right'][smoothed:]]))
+        self.smoothed.extend(gyro_left=new_smoothed[0], gyro_right=new_smoothed[1])
+
+        # only integrate the samples that arrived since the last tick, the integrator carries everything before them
+        # (and only scale those too, the whole history would make every tick slower than the last)
+        integrated = self.integrator.count
+        self.integrator.update(data['time_from_start'][integrated:],
+                               self.smoothed['gyro_left'][integrated:]*self.left_gain,
+                               self.smoothed['gyro_right'][integrated:]*self.right_gain)
+        self.kinematics = self.integrator.result
+
+    def draw_graphs(self) -> None:
+        """
+        :param None
+        :returns None
 
-        # Redraw the canvas
-        self.canvas.draw()
-        self.canvas.flush_events()  
+        puts everything integrated so far on the graphs, the render half of update_graphs
+        """
+        time_from_start = self.data['time_from_start']
 
-        # if recording stops, we'll fall through this statement and end the function loop
-        # otherwise keep calling it in the interval
-        if not self.recording_stopped:
-            self.tab.after(update_frequency, self.update_graphs)
+        # update subplots, if there's a background make sure we update the right graphs
+        # (distance, trajectory, heading, velocity)
+        series = [(time_from_start, self.kinematics.distance),
+                  (self.kinematics.x, self.kinematics.y),
+                  (time_from_start, self.kinematics.heading),
+                  (time_from_start, self.kinematics.velocity)]
+        live = []
+        for ax, (x, y) in zip(self.axs, series):
+            # if no lines on the graph or if we've set a background and we're starting a new graph
+            if not ax.lines or (self.background_set and len(ax.lines) == 1):
+                line, = ax.plot(x, y)
+            # if there's a background and we're not starting a new graph
+            elif self.background_set:
+                line = ax.lines[self.line_pos]
+            # if there's no background and we're not starting a new graph
+            else:
+                line = ax.lines[0]
+            live.append((line, x, y))
+
+        # first draw of a new recording, fit the axes to it rather than growing them from the last one
+        if not self.drawn:
+            self.renderer.reset()
+            self.drawn = True
+        # only the live lines get redrawn, the axes grow (and the whole figure is redrawn) only when the data runs past them
+        self.renderer.draw(live)
+        self.canvas.flush_events()
+
+    def update_link_stats(self) -> None:
+        """
+        :param None
+        :returns None
+
+        shows the latest link stats under the record button, from our own telemetry or the ble process's
+        """
+        link_stats = self.telemetry.snapshot() if self.ingest is None else self.ingest_link_stats
+        if link_stats:
+            self.link_stats_label['text'] = (f'{link_summary(link_stats)}\n'
+                                             f'graphs {self.refresh.rate_hz:.1f} Hz, {self.refresh.skipped} skipped')
 
     def set_background(self, data: dict) -> None:
         """
@@ -363,14 +390,15 @@ class RecordData:
         just plot data from the other data dictionary and rescale graphs
         """
         self.background_set = True
-        if not self.recording_started:
+        if not self.control.recording:
             self.line_pos = len(self.axs[0].lines) + 1
 
         
-        self.axs[0].plot(data['elapsed_time_s'], data['distance_m'], label="Distance")
-        self.axs[1].plot(data['traj_x'], data['traj_y'], label="Trajectory")
-        self.axs[2].plot(data['elapsed_time_s'], data['heading_deg'], label="Heading")
-        self.axs[3].plot(data['elapsed_time_s'], data['velocity'], label="Velocity")
+        # long tests only get handed to matplotlib at about a point per pixel, see gui/lod.py
+        LODLine(self.axs[0], data['elapsed_time_s'], data['distance_m'], label="Distance")
+        LODLine(self.axs[1], data['traj_x'], data['traj_y'], label="Trajectory")
+        LODLine(self.axs[2], data['elapsed_time_s'], data['heading_deg'], label="Heading")
+        LODLine(self.axs[3], data['elapsed_time_s'], data['velocity'], label="Velocity")
 
         for ax in self.axs:
             ax.relim()
@@ -419,188 +447,173 @@ class RecordData:
         self.left_gain = calibration['left_gain']
         self.right_gain = calibration['right_gain']
 
+        # new geometry means everything has to be integrated again
+        self.integrator = KinematicsIntegrator(Geometry(self.diameter, self.dist_wheels))
+
         print()
         print(f'Calibration set to {calibration_name}')
         print(f'Diameter: {self.diameter}, Distance between wheels: {self.dist_wheels}, Left Gain: {self.left_gain}, Right Gain: {self.right_gain}')
         print()
 
+    def log_settings(self) -> dict:
+        """
+        :param None
+        :returns the calibration and gyro filter in use, for the packet log header (see base_ble/packet_log.py)
+        """
+        return log_settings(Geometry(self.diameter, self.dist_wheels), self.left_gain, self.right_gain, self.config.get('gyro_filter'))
 
-    async def connect_to_device(self, left_address: str, right_address: str) -> None:
+    async def connect_to_device(self, left_address: str, right_address: str, from_cache: bool = False) -> bool:
         """
         :param left_address: address of left smarthub (this isn't actually a string but it acts as one)
                  right_address: address of right smarthub
-        :returns None
+                 from_cache: the addresses came from the address cache, so if they don't connect just return False (no popup)
+        :returns whether we ever connected
 
         async loop because we have bleak stuff going on
 
-        connects to the left and right smarthubs
+        connects to the left and right smarthubs at the same time
         waits in the loop for the signal from the user to start the test
         once the test starts, it starts notifications and reads data from the smarthubs by calling parse_data
         attempts to check for a disconnect but more than likely will fail out from another error first if there is one
+        a smarthub that drops out mid recording gets reconnected in the background (see reconnect_dropped), the recording carries on
         will show popup with info if there are errors but may not appear properly on mac
 
         TODO: ADD DISCONNECT BUTTONS FOR LEFT AND RIGHT SMARTHUBS (otherwise you will have to manually restart them)
         """
+        # the buttons and bleak's disconnect callback all talk to the loop below through this
+        self.control.attach()
+        connected = False
+
         try:
-            # have to nest these, cant do them at same time
-            async with BleakClient(left_address) as left_client:
+            # both at once, if one of them fails the other one gets disconnected
+            async with connect_pair(self.ble_client, left_address, right_address, disconnected_callback=self.control.dropped) as (left_client, right_client):
+                connected = True
                 self.left_smarthub_connection['text'] = 'Connected'
                 self.left_smarthub_connection['foreground'] = '#217346'
-                async with BleakClient(right_address) as right_client:
-                    self.right_smarthub_connection['text'] = 'Connected'
-                    self.right_smarthub_connection['foreground'] = '#217346'
-
-                    # this button currently doesn't turn back to off if we disconnect
-                    self.connect_button['text'] = 'Connected'
-
-                    # if we've successfully made the connection and we have a operator id, we're ready to start recording
-                    if self.operator_id is not None:
-                        self.start_recording_button['state'] = 'normal'
-
-                    # this is the uuid we've set for the smarthubs to put data on
-                    ch = "00002a56-0000-1000-8000-00805f9b34fb"
-
-                    # lets us pick a calibration if we want to (we should be doing this every time)
-                    self.select_calibration()
+                self.right_smarthub_connection['text'] = 'Connected'
+                self.right_smarthub_connection['foreground'] = '#217346'
 
-                    # once we successfully start our notifications we don't want to start them again
+                # this button currently doesn't turn back to off if we disconnect
+                self.connect_button['text'] = 'Connected'
+
+                # if we've successfully made the connection and we have a operator id, we're ready to start recording
+                if self.operator_id is not None:
+                    self.start_recording_button['state'] = 'normal'
+
+                # this is the uuid we've set for the smarthubs to put data on
+                ch = "00002a56-0000-1000-8000-00805f9b34fb"
+
+                # lets us pick a calibration if we want to (we should be doing this every time)
+                self.select_calibration()
+
+                # once we successfully start our notifications we don't want to start them again
+                self.notifications_started = False
+
+                def update_data(_, data: bytearray, side: str) -> None:
+                    """
+                    :param _: not used, given by callback
+                                data: 18 len bytearray of raw data
+                                side: 'left' or 'right' to know which smarthub the data is from
+                    :returns None
+
+                    hands the notification to parse_data, the left and right frames get lined up later by self.merger
+                    (this used to wait for one left and one right here, which lost a frame whenever one side sent two in a row)
+                    """
+                    self.parse_data(side, data)
+
+                async def start_notifications(self, left_client: BleakClient, right_client: BleakClient, ch: str) -> None:
+                    """
+                    :param left_client: BleakClient object for left smarthub
+                             right_client: BleakClient object for right smarthub
+                             ch: uuid for the characteristic we're reading from
+                    :returns None
+
+                    starts notifications for the left and right smarthubs
+                    """
+                    self.notifications_started = True
+                    await resubscribe('left', left_client)
+                    await resubscribe('right', right_client)
+
+                async def resubscribe(side: str, client: BleakClient) -> None:
+                    # also how a smarthub that dropped out mid recording gets its notifications back
+                    await client.start_notify(ch, lambda ch, data: update_data(ch, data, side))
+
+                # one pass per recording, sleeping on self.control in between so an idle connection costs nothing
+                while True:
+
+                    # if we haven't started recording, just sit here until the start button (or a disconnect) wakes us up
+                    if await self.control.wait_until(RecordingControl.RECORDING, RecordingControl.CLOSED) == RecordingControl.CLOSED:
+                        break
+
+                    # if we've started recording, start updating our graphs and make sure our data dictionary is empty
+                    self.start_time = time.time()
+                    self.reset_data()
+                    self.packet_log = PacketLog(raw_log_path(), self.log_settings())
+                    self.telemetry = LinkTelemetry(self.merger, stats_log_path(self.packet_log.path))
+                    print(f'started loop, logging to {self.packet_log.path}')
+
+                    # this acts like a threading instance, calling with after will send it back to the main tkinter thread
+                    self.tab.after(0, self.update_graphs)
+
+                    await start_notifications(self, left_client, right_client, ch)
+
+                    # all the other stuff is happening asynchronously, so we just sleep until the stop button or a disconnect
+                    # a smarthub dropping out wakes us up too, it gets reconnected into the same recording with a gap marked where it was gone
+                    while await self.control.wait_until(RecordingControl.IDLE, RecordingControl.CLOSED, RecordingControl.RECONNECTING) == RecordingControl.RECONNECTING:
+                        await reconnect_dropped(self.control, {'left': left_client, 'right': right_client}, resubscribe,
+                                                lambda: time.time() - self.start_time, (self.merger, self.packet_log))
+                    if self.control.state == RecordingControl.CLOSED:
+                        break
+
+                    # we've stopped recording, stop notifications (the stop button saves the data)
+                    await left_client.stop_notify(ch)
+                    await right_client.stop_notify(ch)
                     self.notifications_started = False
 
-                    # reset data every time we've processed new values
-                    self.new_data_left = None
-                    self.new_data_right = None
-
-                    def update_data(_, data: bytearray, side: str) -> None:
-                        """
-                        :param _: not used, given by callback
-                                    data: 18 len bytearray of raw data
-                                    side: 'left' or 'right' to know which smarthub the data is from
-                        :returns None
-
-                        updates the data from the smarthubs
-                        can't send data to parse_data until we have both left and right data
-                        wait until we've gotten a message from both, if the new data is from a side we already have data from, update the last_{}_message
-                        after we send data to parse_data, clear it so we can get new data
-
-                        see thesis for details i have a flowchart there
-                        """
-
-                        # this just runs on first function call, kinda like static keyword in C
-                        if not hasattr(self, 'last_left_message'):
-                            self.last_left_message = None
-                            self.last_right_message = None
-
-                        if side == 'left':
-                            # if it's actually new data and not just a repeat
-                            if self.last_left_message != data:
-                                self.last_left_message = data
-                                self.new_data_left = data
-                                # if there's data on the other side too, send it to parse_data and clear buffers
-                                if self.new_data_right is not None:
-                                    self.parse_data(self.new_data_left, self.new_data_right)
-                                    self.new_data_left = None
-                                    self.new_data_right = None
-                        elif side == 'right':
-                            # if it's actually new data and not just a repeat
-                            if self.last_right_message != data:
-                                self.last_right_message = data
-                                self.new_data_right = data
-                                # if there's data on the other side too, send it to parse_data and clear buffers
-                                if self.new_data_left is not None:
-                                    self.parse_data(self.new_data_left, self.new_data_right)
-                                    self.new_data_left = None
-                                    self.new_data_right = None
-
-                    async def start_notifications(self, left_client: BleakClient, right_client: BleakClient, ch: str) -> None:
-                        """
-                        :param left_client: BleakClient object for left smarthub
-                                 right_client: BleakClient object for right smarthub
-                                 ch: uuid for the characteristic we're reading from
-                        :returns None
-
-                        starts notifications for the left and right smarthubs
-                        """
-                        self.notifications_started = True
-                        await left_client.start_notify(ch, lambda ch, data: update_data(ch, data, 'left'))
-                        await right_client.start_notify(ch, lambda ch, data: update_data(ch, data, 'right'))
-
-                    # just so we know to only intialize the loop once
-                    initial_loop = True
-
-                    # this continually cycles, even if we're not recording
-                    while True:
-
-                        # if we haven't started recording, just sit here and wait
-                        if self.recording_started == False:
-                            self.recording_stopped = False
-                            # await asyncio.sleep(0)
-                            initial_loop = True
-                            continue
-
-                        # if we've stopped recording, stop notifications
-                        # this should only run once, since next loop iteration will get stuck in the first if statement
-                        if self.recording_stopped == True:
-                            self.recording_started = False
-                            await left_client.stop_notify(ch)
-                            await right_client.stop_notify(ch)
-
-                            self.notifications_started = False
-
-                            # update_graphs_thread.join()
-                            continue
-                            
-                        # if we've started recording, start updating our graphs and make sure our data dictionary is empty
-                        if initial_loop:
-                            self.start_time = time.time()
-                            initial_loop = False
-                            self.reset_data()
-                            print('started loop')
-
-                            # this acts like a threading instance, calling with after will send it back to the main tkinter thread
-                            self.tab.after(0, self.update_graphs)
-
-                            # update_graphs_thread = threading.Thread(target=self.update_graphs, daemon=True)
-                            # update_graphs_thread.start()
-
-                        # if we've started recording, start notifications
-                        if not self.notifications_started:
-                            await start_notifications(self, left_client, right_client, ch)
-
-                        # all the other stuff is happening asynchronously, so we can just wait here and let the other threads do their thing
-                        await asyncio.sleep(1)
-
-                        # this doesn't always work since the is_connected flag doesn't always update properly
-                        if time.time() - self.start_time > 2:
-                            if not left_client.is_connected:
-                                self.left_smarthub_connection['text'] = 'Disconnected'
-                                self.left_smarthub_connection['foreground'] = '#a92222'
-                                print('left not connected')
-                                await right_client.disconnect()
-                                break
-                            if not right_client.is_connected:
-                                self.right_smarthub_connection['text'] = 'Disconnected'
-                                self.right_smarthub_connection['foreground'] = '#a92222'
-                                print('right not connected')
-                                await left_client.disconnect()
-                                break
+                # bleak told us a smarthub dropped, leaving the async with blocks disconnects the other one
+                if not left_client.is_connected:
+                    self.left_smarthub_connection['text'] = 'Disconnected'
+                    self.left_smarthub_connection['foreground'] = '#a92222'
+                    print('left not connected')
+                if not right_client.is_connected:
+                    self.right_smarthub_connection['text'] = 'Disconnected'
+                    self.right_smarthub_connection['foreground'] = '#a92222'
+                    print('right not connected')
 
         # various errors we can get, these will kill the program a lot of times so we should restart program and restart smarthubs when we see them
         except BleakError as e:
             print(f"Failed to connect: {e}")
+            if from_cache and not connected:
+                return False
             popup = tk.Toplevel()
             ttk.Label(popup, text=f"Device went out of range, please retry connection: BleakError {e}", font=font.Font(size=14)).grid(row=0, column=0, pady=10, padx=50, columnspan=3)
-            return
+            return connected
         except OSError as e:
             print(e)
+            if from_cache and not connected:
+                return False
             popup = tk.Toplevel()
             ttk.Label(popup, text=f"Device went out of range, please retry connection: OSERrror {e}", font=font.Font(size=14)).grid(row=0, column=0, pady=10, padx=50, columnspan=3)
-            return
+            return connected
 
         except TimeoutError as e:
             print(f"Timeout error: {e}")
-            return
+            return connected
+
+        # the connection's gone, save whatever was being recorded. on the tk thread, where the stop button saves too
+        self.tab.after(0, self.stop_after_disconnect)
+        return True
 
-        self.save_data()
+    def stop_after_disconnect(self) -> None:
+        """
+        :param None
+        :returns None
+
+        stops and saves a recording the connection went out from under, the same as pressing stop
+        runs on the tk thread, so if stop was already pressed (and saved the test) this does nothing
+        """
+        if self.start_recording_button['text'] == 'Stop Recording':
+            self.start_recording()
 
     def missing_smarthubs(self, left: bool = False, right: bool = False) -> None:
         """
@@ -634,7 +647,8 @@ class RecordData:
         :returns None
 
         gets called when we click the find smarthubs button
-        looks for the left and right smarthubs with the id we're looking for
+        goes straight to the addresses they had last time if we've seen them before
+        otherwise looks for the left and right smarthubs with the id we're looking for
         if we can't find one or both of them, we call missing_smarthubs
         if we find both, we connect to the devices with _connect_to_device
         """
@@ -643,27 +657,19 @@ class RecordData:
         self.right_smarthub_connection['text'] = 'Disconnected'
         self.right_smarthub_connection['foreground'] = '#a92222'
 
-        # adjust timeout if having a hard time finding them
+        # try where they were last time first, a scan is only needed if they've never been seen or their addresses changed
+        cached = self.address_cache.get(smarthub_id)
+        if cached is not None:
+            self.smarthub_id = smarthub_id
+            if await self.connect_to_device(*cached, from_cache=True):
+                return
+            print(f'cached addresses for smarthub {smarthub_id} did not connect, scanning')
+            self.address_cache.forget(smarthub_id)
+
+        # adjust timeout if having a hard time finding them, the scan stops as soon as both have been seen
         # also run bleak_test to see rssi vals
-        # devices = await BleakScanner.discover(timeout=8.0)
-        devices = await BleakScanner.discover(timeout=5.0, return_adv=True)
-
-        left_address = None
-        right_address = None
-
-        for d, val in devices.items():
-            device, adv = val
-            if adv.local_name is None:
-                continue
-            print(d, adv.local_name)
-            if isinstance(adv.local_name, str):
-                if f'Left Smarthub: {smarthub_id}' == adv.local_name:
-                    print("Left Smarthub Identified")
-                    left_address = d
-                if f'Right Smarthub: {smarthub_id}' == adv.local_name:
-                    print("Right Smarthub Identified")
-                    right_address = d
-        
+        left_address, right_address = (await scan_for([smarthub_id], timeout=5.0))[smarthub_id]
+
         if left_address is None or right_address is None:
             self.missing_smarthubs(left=left_address is None, right=right_address is None)
             print('smarthub not found')
@@ -679,6 +685,7 @@ class RecordData:
             return
         
         # if we've made it this far, we've identified both of them
+        self.address_cache.put(smarthub_id, (left_address, right_address))
         self.smarthub_id = smarthub_id
         await self.connect_to_device(left_address, right_address)
 
@@ -690,12 +697,16 @@ class RecordData:
         gets called when we click the connect button
         starts a new thread to run the async function _find_smarthubs
 
-        i haven't noticed any performance issues with threading vs multiprocessing but this could be redesigned to initialize it to a new core
-        and use shared memory to pass the data back to the main thread if it does become an issue in the future
+        with "ble_process": true in config.json, bleak runs in its own process instead and passes the data back in shared memory,
+        see connect_ingest_process
         """
 
         self.connect_button['text'] = 'Connecting...'
 
+        if self.config.get('ble_process', False):
+            self.connect_ingest_process(smarthub_id=smarthub_id)
+            return
+
         def ble_task():
             # bleak needs its own event loop outside of tkinter
             loop = asyncio.new_event_loop()
@@ -706,6 +717,77 @@ class RecordData:
         ble_thread = threading.Thread(target=ble_task, daemon=True)
         ble_thread.start()
 
+    def connect_ingest_process(self, smarthub_id: str = None, addresses: Tuple[str, str] = None) -> None:
+        """
+        :param smarthub_id: id of the smarthubs to scan for
+                 addresses: (left, right) to connect to without scanning
+        :returns None
+
+        the multiprocessing version of connect_smarthubs, bleak runs in its own process and sends decoded samples back
+        through shared memory, so slow redraws here can't hold up notifications (or the other way around)
+        the process can't touch tkinter, poll_ingest picks up its status messages and updates the labels
+        """
+        if self.ingest is not None:
+            self.ingest.close()
+
+        self.left_smarthub_connection['text'] = 'Disconnected'
+        self.left_smarthub_connection['foreground'] = '#a92222'
+        self.right_smarthub_connection['text'] = 'Disconnected'
+        self.right_smarthub_connection['foreground'] = '#a92222'
+
+        self.smarthub_id = smarthub_id
+        self.ingest = IngestProcess()
+        self.ingest.start(smarthub_id=smarthub_id, addresses=addresses,
+                          ble_client=None if self.ble_client is BleakClient else self.ble_client)
+        self.poll_ingest()
+
+    def poll_ingest(self) -> None:
+        """
+        :param None
+        :returns None
+
+        handles status messages from the ble process every 100 ms, the same label and popup updates the ble thread does
+        """
+        for message in self.ingest.messages():
+            kind = message[0]
+            if kind == 'found':
+                _, left_found, right_found = message
+                if not (left_found and right_found):
+                    self.missing_smarthubs(left=not left_found, right=not right_found)
+                    self.connect_button['text'] = 'Connect'
+            elif kind == 'connected':
+                label = self.left_smarthub_connection if message[1] == 'left' else self.right_smarthub_connection
+                label['text'] = 'Connected'
+                label['foreground'] = '#217346'
+                if message[1] == 'right':
+                    self.connect_button['text'] = 'Connected'
+                    if self.operator_id is not None:
+                        self.start_recording_button['state'] = 'normal'
+                    self.select_calibration()
+            elif kind == 'recording':
+                print(f'ble process logging to {message[1]}')
+                self.ingest_log_path = message[1]
+            elif kind == 'link':
+                self.ingest_link_stats = message[1]
+            elif kind == 'recorded' and self.start_recording_button['text'] == 'Stop Recording':
+                # a smarthub dropped mid recording, stop and save like the button would
+                self.ingest_stats, self.ingest_link_stats = message[1:]
+                self.start_recording()
+            elif kind == 'disconnected':
+                label = self.left_smarthub_connection if message[1] == 'left' else self.right_smarthub_connection
+                label['text'] = 'Disconnected'
+                label['foreground'] = '#a92222'
+                print(f'{message[1]} not connected')
+            elif kind == 'error':
+                print(message[1])
+                popup = tk.Toplevel()
+                ttk.Label(popup, text=f"Device went out of range, please retry connection: {message[1]}", font=font.Font(size=14)).grid(row=0, column=0, pady=10, padx=50, columnspan=3)
+            elif kind == 'exited':
+                self.connect_button['text'] = 'Connect'
+                return
+
+        self.tab.after(100, self.poll_ingest)
+
     def start_recording(self) -> None:
         """
         :param None
@@ -713,17 +795,29 @@ class RecordData:
 
         starts and stops recording based on the button text
         if you click the button and nothing happens it means there was an error
-        this function doesn't actually call anything itself, but controlling self.recording_started and self.recording_stopped will very much disrupt the flow of other code
+        this function doesn't actually call anything itself, self.control wakes up connect_to_device in the ble thread
         """
         if self.start_recording_button['text'] == 'Start Recording':
             print('recording started')
-            self.recording_started = True
+            self.control.start()
+
+            # connect_to_device does this in thread mode, the ble process only sends samples
+            if self.ingest is not None:
+                self.start_time = time.time()
+                self.reset_data()
+                self.ingest_stats = None
+                self.ingest_link_stats = {}
+                self.ingest_log_path = None
+                self.ingest.start_recording(self.log_settings())
+                self.tab.after(0, self.update_graphs)
 
             self.start_recording_button['text'] = 'Stop Recording'
 
         elif self.start_recording_button['text'] == 'Stop Recording':
             print('recording stopped')
-            self.recording_stopped = True
+            self.control.stop()
+            if self.ingest is not None:
+                self.ingest.stop_recording()
             self.save_data()
 
             self.start_recording_button['text'] = 'Start Recording'
@@ -733,23 +827,38 @@ class RecordData:
         :param None
         :returns None
 
-        resets the data dictionary to empty lists
+        resets the sample store (raw values) and the smoothed values
+        also resets the low pass, the stream merger and the kinematics integrator
         has to be reset every time we start recording
         """
-        self.data = {
-            'accel_right': [],
-            'accel_left': [],
-            'gyro_right': [],
-            'gyro_left': [],
-            'time_from_start': [],
-            'gyro_right_smoothed': [],
-            'gyro_left_smoothed': [],
-            'dist_m': [],
-            'disp_m': [],
-            'heading_deg': [],
-            'velocity': [],
-            'trajectory': [],
-        }
+        # raw values, one column per channel (see CHANNEL_DTYPES)
+        self.data = SampleStore(INGEST_DTYPES)
+
+        # smoothed values, update_graphs adds the new samples every tick
+        self.smoothed = SampleStore({
+            'gyro_right': np.float64,
+            'gyro_left': np.float64,
+        })
+        # causal low pass that keeps its state between ticks, the saved test gets the zero phase version
+        self.lowpass = StreamingLowpass()
+
+        # raw frames from both sides waiting to be lined up and decoded
+        self.merger = StreamMerger()
+        # notification rate, jitter, loss and latency, connect_to_device swaps in one that writes a stats log while recording
+        self.telemetry = LinkTelemetry(self.merger)
+
+        # running distance, heading and position for the live graphs
+        self.integrator = KinematicsIntegrator(Geometry(self.diameter, self.dist_wheels))
+        # distance, displacement, velocity, heading, x and y arrays, replaced every update
+        self.kinematics = self.integrator.result
+        # whether this recording has been on the graphs yet
+        self.drawn = False
+        # one that never got finished was a recording that got thrown away, take its chunks back out
+        if self.chunk_writer is not None:
+            self.chunk_writer.discard()
+        self.chunk_writer = None
+        # how often update_graphs runs, from how long it's been taking
+        self.refresh = RefreshScheduler()
 
         # self.start_time_left = 0
         # self.start_time_right = 0
@@ -762,7 +871,7 @@ class RecordData:
         :param None
         :returns None
 
-        saves the data to the database
+        saves the data to the database, as a header and a chunk per minute of recording (see base_ble/chunk_store.py)
         gets called after we stop recording
 
         we have to normalize the list lengths so view_data can deal with it properly, so make it the shortest length seen
@@ -771,40 +880,69 @@ class RecordData:
         we have a small delay to make sure we got all the data
         """
 
+        # everything that arrived is on disk, the log stays behind as a backup of the raw notifications
+        if self.packet_log is not None:
+            self.packet_log.close()
+
         # bad sign if this is true
-        if len(self.data['time_from_start']) < 1:
+        if len(self.data) < 1:
             print('no data recorded')
             return
 
-        # this is the default _id for the database
-        test_datetime = datetime.now()
-        datetime_str = f"{test_datetime.month}/{test_datetime.day}/{test_datetime.year}_{test_datetime.hour}:{test_datetime.minute}:{test_datetime.second}"
         self.additional_notes = self.additional_notes_entry.get(1.0, 'end')
 
         # confirm we got all the data, just give some time to the update_graph to process it all
         time.sleep(0.1)
+        self.decode_packets(flush=True)
         self.update_graphs()
+        merge_stats = self.merger.stats if self.ingest is None else (self.ingest_stats or {})
+        if merge_stats:
+            print(f'merged {merge_summary(merge_stats)}')
+        if self.ingest is None:
+            self.telemetry.close()
+            link_stats = self.telemetry.snapshot()
+        else:
+            link_stats = self.ingest_link_stats
+        if link_stats:
+            print(link_summary(link_stats))
         time.sleep(0.1)
 
-        # find shortest length of data
-        min_len = min(len(v) for v in self.data.values())
+        # the live low pass is causal so it lags a little, now that we have the whole recording
+        # smooth it again with the zero phase version (or whatever config.json asks for) and redo the kinematics once against that for the saved test
+        gyro_left_smoothed, gyro_right_smoothed = smooth(np.stack([self.data['gyro_left'], self.data['gyro_right']]),
+                                                         self.data['time_from_start'], self.smoothing)
+        self.kinematics = compute_kinematics(self.data['time_from_start'],
+                                             gyro_left_smoothed*self.left_gain,
+                                             gyro_right_smoothed*self.right_gain,
+                                             Geometry(self.diameter, self.dist_wheels))
 
+        # find shortest length of data
+        min_len = min(len(self.data), len(gyro_left_smoothed), min(len(v) for v in self.kinematics))
+
+        # every series, the raw ones have mostly gone to the database already while we were recording,
+        # the chunk writer adds the rest to those chunks and saves whatever's left (see base_ble/chunk_store.py)
+        series = {}
+        series['elapsed_time_s'] = self.data['time_from_start'][:min_len]
+        series['gyro_right'] = self.data['gyro_right'][:min_len]
+        series['gyro_left'] = self.data['gyro_left'][:min_len]
+        series['gyro_right_smoothed'] = gyro_right_smoothed[:min_len]
+        series['gyro_left_smoothed'] = gyro_left_smoothed[:min_len]
+        series['accel_right'] = self.data['accel_right'][:min_len]
+        series['accel_left'] = self.data['accel_left'][:min_len]
+        series['distance_m'] = self.kinematics.distance[:min_len]
+        series['heading_deg'] = self.kinematics.heading[:min_len]
+        series['displacement_m'] = self.kinematics.displacement[:min_len]
+        series['velocity'] = self.kinematics.velocity[:min_len]
+        series['traj_x'] = self.kinematics.x[:min_len]
+        series['traj_y'] = self.kinematics.y[:min_len]
+
+        # everything else goes in the header
         post = {}
-        post['_id'] = datetime_str
-        post['elapsed_time_s'] = self.data['time_from_start'][:min_len]
-        post['gyro_right'] = self.data['gyro_right'][:min_len]
-        post['gyro_left'] = self.data['gyro_left'][:min_len]
-        post['gyro_right_smoothed'] = list(self.data['gyro_right_smoothed'][:min_len])
-        post['gyro_left_smoothed'] = list(self.data['gyro_left_smoothed'][:min_len])
-        post['accel_right'] = self.data['accel_right']
-        post['accel_left'] = self.data['accel_left']
-        post['distance_m'] = self.data['dist_m'][:min_len]
-        post['heading_deg'] = self.data['heading_deg'][:min_len]
-        post['displacement_m'] = self.data['disp_m'][:min_len]
-        post['velocity'] = self.data['velocity'][:min_len]
-        post['traj_x'] = [i[0] for i in self.data['trajectory']][:min_len]
-        post['traj_y'] = [i[1] for i in self.data['trajectory']][:min_len]
         post['user_id'] = self.operator_id
+        # how many frames had to be interpolated or were dropped as duplicates
+        post['merge_stats'] = dict(merge_stats)
+        # notification rate, jitter, loss and latency for each side, to tell a slow computer from a bad radio
+        post['link_stats'] = dict(link_stats)
 
         # pull in the test name string if it exists
         test_name = self.test_name_var.get()
@@ -814,12 +952,26 @@ class RecordData:
 
         post['additional_notes'] = self.additional_notes
 
-        # post to database
-        id = self.test_collection.insert_one(post).inserted_id
+        # post to database, the header goes in last so the test only shows up once it's all there
+        try:
+            id = self.chunk_writer.finish(series, **post)
+        except ChunkWriteError as e:
+            # the recording is still all in the packet log, stop and reset anyway so the next test can start
+            log_path = self.packet_log.path if self.packet_log is not None else self.ingest_log_path
+            print(f'could not save the test: {e}')
+            if log_path is None:
+                text = "Test could not be saved to the database, and there is no packet log to restore it from"
+            else:
+                print(f'rebuild it with: python -m base_ble.packet_log {log_path} --output <test>.json '
+                      f'--diameter {self.diameter} --dist_wheels {self.dist_wheels} '
+                      f'--left_gain {self.left_gain} --right_gain {self.right_gain}')
+                text = f"Test could not be saved to the database, it can be restored from {log_path}"
+            popup = tk.Toplevel()
+            ttk.Label(popup, text=text, font=font.Font(size=14)).grid(row=0, column=0, pady=10, padx=50, columnspan=3)
+        self.chunk_writer = None
 
         # confirm we reset and stopped everything properly
-        self.recording_started = False
-        self.recording_stopped = True
+        self.control.stop()
         self.reset_data()
 
 
@@ -874,6 +1026,10 @@ class RecordData:
         self.start_recording_button = ttk.Button(self.tab, text='Start Recording', command=lambda: self.start_recording(), state='disabled', style='Custom.TButton')
         self.start_recording_button.grid(row=12, column=0, pady=10, columnspan=3, sticky='nsew')
 
+        # link health while recording, see update_link_stats
+        self.link_stats_label = ttk.Label(self.tab, text='', justify='left', font=font.Font(size=10))
+        self.link_stats_label.grid(row=13, column=0, pady=5, columnspan=3, sticky='nsw')
+
         ttk.Separator(self.tab, orient='horizontal').grid(row=20, column=0, pady=10, columnspan=3, sticky='sew')
         
         # Run Name
@@ -922,6 +1078,8 @@ class RecordData:
                 ax.set_facecolor('whitesmoke')
 
             self.canvas = FigureCanvasTkAgg(self.fig, master=self.tab)
+            # blits the live lines in update_graphs, cut down to about a point per pixel
+            self.renderer = BlitRenderer(self.canvas, decimate=decimate)
 
         border = dpi/400
         self.fig.subplots_adjust(left=0.05, right=0.95, bottom=0.075, top=0.95, wspace=border, hspace=border)
@@ -5,6 +5,7 @@ from tkinter import *
 from tkinter.ttk import *
 
 from tkinter import font
+import time
 from typing import TypedDict, List, Callable, Optional, Union
 
 class Bar(TypedDict):
@@ -13,6 +14,58 @@ class Bar(TypedDict):
     Value: float
 
 num_t = Union[int, float]
+
+
+class Throttle:
+    """
+    Calls callback at most rate_hz times a second, with the latest values.
+    Values that come in too soon are held and delivered once the interval is up,
+    so the last values are never lost. rate_hz=None calls straight through.
+    """
+
+    def __init__(self, widget, callback: Callable[[List[float]], None], rate_hz: Optional[float] = None):
+        self.widget = widget
+        self.callback = callback
+        self.interval_ms = None if not rate_hz else 1000.0 / rate_hz
+        self._last = 0.0
+        self._pending = None
+        self._after_id = None
+
+    def __call__(self, values: List[float]):
+        if self.interval_ms is None:
+            self.callback(values)
+            return
+        self._pending = values
+        if self._after_id is not None:
+            return
+        wait = self.interval_ms - (time.monotonic() - self._last) * 1000
+        if wait <= 0:
+            self._fire()
+        else:
+            self._after_id = self.widget.after(int(wait), self._fire)
+
+    def _fire(self):
+        self._after_id = None
+        if self._pending is None:
+            return
+        values, self._pending = self._pending, None
+        self._last = time.monotonic()
+        self.callback(values)
+
+    def cancel(self):
+        """Drops anything held back without calling."""
+        if self._after_id is not None:
+            self.widget.after_cancel(self._after_id)
+            self._after_id = None
+        self._pending = None
+
+    def flush(self):
+        """Delivers anything held back right away."""
+        if self._after_id is not None:
+            self.widget.after_cancel(self._after_id)
+        self._fire()
+
+
 class Slider(Frame):
     LINE_COLOR = "#eeeeee"
     LINE_WIDTH = 3
@@ -66,7 +119,10 @@ class Slider(Frame):
             self.slider_y = self.canv_H * 2 / 5
         self.slider_x = Slider.BAR_RADIUS  # x pos of the slider (left side)
 
-        self._val_change_callback = lambda lis: None
+        self._val_change_callback = Throttle(self, lambda lis: None)
+        self._drag_callback = Throttle(self, lambda lis: None)
+        self._release_callback = lambda lis: None
+        self._dragging = False
 
         self.bars: List[Bar] = []
         self.selected_idx = None  # current selection bar index
@@ -80,10 +136,11 @@ class Slider(Frame):
         self.canv.pack()
         self.canv.bind("<Motion>", self._mouseMotion)
         self.canv.bind("<B1-Motion>", self._moveBar)
+        self.canv.bind("<ButtonRelease-1>", self._release, add="+")
         if removable:
             self.canv.bind("<3>", self._removeBar)
         if addable:
-            self.canv.bind("<ButtonRelease-1>", self._addBar)
+            self.canv.bind("<ButtonRelease-1>", self._addBar, add="+")
 
         self.__addTrack(
             self.slider_x, self.slider_y, self.canv_W - self.slider_x, self.slider_y
@@ -95,8 +152,33 @@ class Slider(Frame):
         values = [bar["Value"] for bar in self.bars]
         return sorted(values)
     
-    def setValueChangeCallback(self, callback: Callable[[List[float]], None]):
-        self._val_change_callback = callback
+    def setValueChangeCallback(self, callback: Callable[[List[float]], None], rate_hz: Optional[float] = None):
+        """
+        Called whenever a bar moves. With rate_hz, at most that many times a second,
+        the values it ends on are always delivered (at the latest on release).
+        """
+        self._val_change_callback.cancel()
+        self._val_change_callback = Throttle(self, callback, rate_hz)
+
+    def setDragCallback(self, callback: Callable[[List[float]], None], rate_hz: Optional[float] = None):
+        """
+        Called while a bar is being dragged, for a cheap preview. Anything held back
+        by rate_hz is dropped on release, the release callback gets the final values.
+        """
+        self._drag_callback.cancel()
+        self._drag_callback = Throttle(self, callback, rate_hz)
+
+    def setReleaseCallback(self, callback: Callable[[List[float]], None]):
+        """Called once with the final values when a drag ends."""
+        self._release_callback = callback
+
+    def _release(self, event):
+        if not self._dragging:
+            return
+        self._dragging = False
+        self._drag_callback.cancel()
+        self._val_change_callback.flush()
+        self._release_callback(self.getValues())
 
     def _mouseMotion(self, event):
         x = event.x
@@ -201,7 +283,9 @@ class Slider(Frame):
         self.bars[idx]["Ids"] = self.__addBar(pos)
         self.bars[idx]["Pos"] = pos
         self.bars[idx]["Value"] = pos * (self.max_val - self.min_val) + self.min_val
+        self._dragging = True
         self._val_change_callback(self.getValues())
+        self._drag_callback(self.getValues())
 
     def __calcPos(self, x):
         """calculate position from x coordinate"""
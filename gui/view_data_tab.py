@@ -3,25 +3,30 @@ from tkinter import font, Label
 from tkinter import ttk
 import time
 import csv
-import bisect
 import pandas as pd
 import math
+import numpy as np
 from gui.tk_slider_widget import Slider
+from gui.lod import LODLine
 
 
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.figure import Figure
 from matplotlib.ticker import MultipleLocator
 
-from base_ble.calc import (
-    get_displacement_m,
-    get_distance_m,
-    get_velocity_m_s,
-    get_heading_deg,
-    get_top_traj
-)
+from base_ble.calc import compute_kinematics
+from base_ble.chunk_store import delete_test, load_test
 from base_ble.data_analyze import export_metrics, calculate_bout, Metrics
 
+# slider moves get drawn at most this often (ms), about a screen refresh
+SCALE_REFRESH_MS = 16
+# how often the slider sends its values while it's being dragged (Hz)
+SCALE_DRAG_HZ = 30
+# fraction of the usual points the lines get while the slider is being dragged, full detail comes back on release
+PREVIEW_DETAIL = 0.25
+# all show_data (and download_metrics) needs out of a test, the raw channels only get fetched to download them
+PLOTTED_SERIES = ['distance_m', 'traj_x', 'traj_y', 'heading_deg', 'velocity']
+
 def draw_grid_lines(tab):
     """
     :param tab: notebook object
@@ -46,11 +51,15 @@ class ViewData:
     functions:
     find_test_runs -> retrieves all test runs for a given id, makes drop down menu to select test run
     zoom -> zooms in or out of the graph
+    fetch_test -> gets a test (or just some of its series) from the database, all the series cut to the same length
     download_metrics -> downloads metrics data
     download_raw_data -> downloads raw data
     delete_test -> deletes a test run
     set_record_background -> sets background of record_data_tab to the current test run
     show_data -> shows data on the graph
+    traj_tick_spacing -> gridline spacing for the trajectory plot
+    scale -> slider callback, draws the new time range at most once per screen refresh, as a preview while dragging
+    draw_range -> shows just the time range on every line already on the graphs
     load_csv -> loads a csv file into the window and shows plots
     initialize_tab -> sets up user id entry and load csv button
     
@@ -63,6 +72,8 @@ class ViewData:
         self.record_data_tab = record_data_tab
         # mongodb client
         self.test_collection = database.Smarthub.test_collection
+        # newer tests keep their data in here a minute at a time, the document in test_collection is just the header
+        self.test_chunks = database.Smarthub.test_chunks
         # filepath to save data
         self.filepath = filepath
         # screen params
@@ -72,9 +83,15 @@ class ViewData:
 
         # graph info
         self.last_scale_update = time.time()
+        # time range from the slider that hasn't been drawn yet (and whether it's just a preview), and the after() id of the draw that will
+        self.scale_vals = None
+        self.scale_preview = False
+        self.scale_after = None
         self.overlay = tk.BooleanVar(value=False)
 
         self.prev_data = []
+        # lines and time array of every test on the graphs, lines the same order as the axes
+        self.plotted = []
 
         # self.initialize_tab(auto=True)
         self.initialize_tab(auto=False)
@@ -144,6 +161,25 @@ class ViewData:
                 self.dpi -= 10
                 self.show_data(None, dpi=self.dpi)
 
+    def fetch_test(self, test_id, series=None):
+        """
+        :param test_id: _id of the test
+                 series: only these series (plus elapsed_time_s and the header fields), None for all of them
+        :returns the test, None if it isn't in the database
+        """
+        data = load_test(self.test_collection, self.test_chunks, test_id, series=series)
+        if data is None:
+            return None
+
+        # sometimes the lengths mismatch, but traj should be shortest
+        min_len = len(data['traj_x'])
+
+        # truncate rest of value if longer than traj
+        for key, value in data.items():
+            if len(value) > min_len:
+                data[key] = value[:min_len]
+        return data
+
     @staticmethod
     def download_metrics(data, name=None):
         """
@@ -198,6 +234,10 @@ class ViewData:
         if '.csv' not in filename:
             filename += '.csv'
 
+        # show_data only fetched the plotted series, get the rest of the test now
+        if '_id' in data:
+            data = self.fetch_test(data['_id']) or data
+
         max_length = len(data['elapsed_time_s'])
 
         # Pad shorter lists with None
@@ -226,8 +266,8 @@ class ViewData:
 
         """
 
-        # deletes run from db
-        self.test_collection.delete_one({'_id': data['_id']})
+        # deletes run from db, header and chunks
+        delete_test(self.test_collection, self.test_chunks, data['_id'])
 
         # delete all widgets in notebook
         for widget in self.tab.winfo_children():
@@ -235,7 +275,7 @@ class ViewData:
 
         # remove all attributes from class except for the ones initialized in setup
         for attr in dir(self):
-            if not attr.startswith('__') and attr not in ['tab', 'record_data_tab', 'test_collection'] and not callable(getattr(self, attr)):
+            if not attr.startswith('__') and attr not in ['tab', 'record_data_tab', 'test_collection', 'test_chunks'] and not callable(getattr(self, attr)):
                 delattr(self, attr)
 
         self.last_scale_update = time.time()
@@ -441,17 +481,9 @@ class ViewData:
         if data is None:
             test_name = self.valid_ids[self.new_valid_ids.index(self.select_test_run.get())]
 
-            # get first entry from database that matches _id
-            data = self.test_collection.find({'_id': test_name})[0]
-
-            # sometimes the lengths mismatch, but traj should be shortest
-            min_len = len(data['traj_x'])
+            # just what gets plotted, put back together from its chunks if it has them
+            data = self.fetch_test(test_name, series=PLOTTED_SERIES)
 
-            # truncate rest of value if longer than traj
-            for key, value in data.items():
-                if len(value) > min_len:
-                    data[key] = value[:min_len]
-                
 
         # if we don't have our graphs made yet
         if not hasattr(self, 'fig'):
@@ -516,10 +548,15 @@ class ViewData:
 
         # if for whatever reason we don't have all our values made yet, create them
         # this should only be the case on super outdated data
-        if 'heading_deg' not in data:
-            data['heading_deg'] = get_heading_deg(data['elapsed_time_s'], data['gyro_left_smoothed'], data['gyro_right_smoothed'])
-        if 'velocity' not in data:
-            data['velocity'] = get_velocity_m_s(data['elapsed_time_s'], data['gyro_left_smoothed'], data['gyro_right_smoothed'])
+        if 'heading_deg' not in data or 'velocity' not in data:
+            kinematics = compute_kinematics(data['elapsed_time_s'], data['gyro_left_smoothed'], data['gyro_right_smoothed'], trajectory=False)
+            data.setdefault('heading_deg', kinematics.heading.tolist())
+            data.setdefault('velocity', kinematics.velocity.tolist())
+
+        # a slider move still waiting to be drawn was for the old slider
+        if self.scale_after is not None:
+            self.tab.after_cancel(self.scale_after)
+            self.scale_after = None
 
         # check the overlay button, if it's not checked we want to clear the graphs before putting new data on them
         overlay = self.overlay.get()
@@ -528,28 +565,27 @@ class ViewData:
                 ax.clear()
 
             self.prev_data = []
+            self.plotted = []
         # keep track of all the data we've plotted so far
         self.prev_data.append(data)
 
         # plot the data, force trajectory to be equally scaled
-        self.axs[0].plot(data['elapsed_time_s'], data['distance_m'])
-        self.axs[1].plot(data['traj_x'], data['traj_y'])
+        # each line only gets about a point per pixel (see gui/lod.py), picked again whenever the limits change
+        # the lines are kept so the time range slider can change what they show without plotting them again
+        lines = [LODLine(self.axs[0], data['elapsed_time_s'], data['distance_m']),
+                 LODLine(self.axs[1], data['traj_x'], data['traj_y']),
+                 LODLine(self.axs[2], data['elapsed_time_s'], data['heading_deg']),
+                 LODLine(self.axs[3], data['elapsed_time_s'], data['velocity'])]
+        self.plotted.append({'time': lines[0].x, 'lines': lines})
         self.axs[1].set_aspect('equal', adjustable='datalim')
 
         # give the option to show gridlines on trajectory plot
         if gridlines:
             self.axs[1].grid(True)
-            # supposed to try to make gridlines spaced at 8 intervals, only works for actual wheelchair data
-            if max(data['traj_x']) - min(data['traj_x']) > 8:
-                tick_spacing = math.ceil((max(data['traj_x']) - min(data['traj_x']))/8)
-            else:
-                tick_spacing = math.ceil(max(data['traj_x']) - min(data['traj_x']))/8
+            tick_spacing = self.traj_tick_spacing(lines[1].x)
             self.axs[1].xaxis.set_major_locator(MultipleLocator(tick_spacing))  # Set x-axis major tick spacing to 2 for the second subplot
             self.axs[1].yaxis.set_major_locator(MultipleLocator(tick_spacing))  # Set y-axis major tick spacing to 2 for the second subplot
 
-        self.axs[2].plot(data['elapsed_time_s'], data['heading_deg'])
-        self.axs[3].plot(data['elapsed_time_s'], data['velocity'])
-
         # use function for label setting
         self.set_subplot_labels(self.axs)
 
@@ -563,65 +599,17 @@ class ViewData:
         # put metadata in widgets
         self.populate_metadata(data)
 
-        
-        def scale(vals):
-            """
-            :param vals: values to scale to
-            :returns None
-
-            this scales the graph to the time values from slider
-
-            
-            """
-            # can make it so this doesn't update too fast
-            self.last_scale_update = time.time()
-            overlay = self.overlay.get()
-            for ax in self.axs:
-                ax.clear()
-
-            # iterates through all the data we've stored so far
-            for data_list in self.prev_data:
-
-                # find the index of the left and right values in the data
-                left_elem = bisect.bisect_left(data['elapsed_time_s'], vals[0])
-                right_elem = bisect.bisect_right(data['elapsed_time_s'], vals[1])
-
-                # only plot the data between these indexes
-                self.axs[0].plot(data_list['elapsed_time_s'][left_elem:right_elem], data_list['distance_m'][left_elem:right_elem])
-                self.axs[1].plot(data_list['traj_x'][left_elem:right_elem], data_list['traj_y'][left_elem:right_elem])
-                self.axs[2].plot(data_list['elapsed_time_s'][left_elem:right_elem], data_list['heading_deg'][left_elem:right_elem])
-                self.axs[3].plot(data_list['elapsed_time_s'][left_elem:right_elem], data_list['velocity'][left_elem:right_elem])
-
-                # do the same gridline stuff, could prob make this a function
-                if self.trajectory_gridlines_check.get():
-                    self.axs[1].grid(True)
-                    if max(data_list['traj_x']) - min(data_list['traj_x']) > 8:
-                        tick_spacing = math.ceil((max(data_list['traj_x']) - min(data_list['traj_x']))/8)
-                    else:
-                        tick_spacing = math.ceil(max(data_list['traj_x']) - min(data_list['traj_x']))/8
-                    self.axs[1].xaxis.set_major_locator(MultipleLocator(tick_spacing))
-                    self.axs[1].yaxis.set_major_locator(MultipleLocator(tick_spacing))
-
-            # once we're done plotting, set the labels and draw the canvas
-            self.set_subplot_labels(self.axs)
-
-            for ax in self.axs:
-                ax.relim()
-                ax.autoscale()
-            self.canvas.draw()
-            self.canvas.flush_events()    
-
         # set up for slider
         max_time = 0
         min_time = 1000000
 
         # make end of slider the last value of the last data list
         # make start of slider first value if after 
-        for data_list in self.prev_data:
-            if data['elapsed_time_s'][-1] > max_time:
-                max_time = data['elapsed_time_s'][-1]
-            if data['elapsed_time_s'][0] < min_time:
-                min_time = data['elapsed_time_s'][0]
+        for plotted in self.plotted:
+            if plotted['time'][-1] > max_time:
+                max_time = plotted['time'][-1]
+            if plotted['time'][0] < min_time:
+                min_time = plotted['time'][0]
 
         # make slider with info from file
         slider = Slider(
@@ -635,13 +623,72 @@ class ViewData:
             removable=False,
             addable=False,
         )
-        slider.setValueChangeCallback(scale)
+        # cheap previews while dragging, the full detail once it's let go
+        slider.setDragCallback(lambda vals: self.scale(vals, preview=True), rate_hz=SCALE_DRAG_HZ)
+        slider.setReleaseCallback(self.scale)
         slider.grid(row=102, rowspan=3, column=3, columnspan=100, sticky='nsew')
         Label(self.tab, text='Time Range (sec)', font=font.Font(size=14)).grid(row=101, column=3, columnspan=100, sticky='nsew')
         self.canvas_widgets.append(slider)
 
         # draw_grid_lines(self.tab)
 
+    @staticmethod
+    def traj_tick_spacing(traj_x):
+        """
+        :param traj_x: trajectory x values
+        :returns major tick spacing for the trajectory gridlines
+
+        supposed to try to make gridlines spaced at 8 intervals, only works for actual wheelchair data
+        """
+        span = float(np.max(traj_x) - np.min(traj_x))
+        if span > 8:
+            return math.ceil(span/8)
+        return math.ceil(span)/8
+
+    def scale(self, vals, preview=False):
+        """
+        :param vals: values to scale to
+        :param preview: draw with fewer points, for while the slider is still being dragged
+        :returns None
+
+        this scales the graph to the time values from slider
+        it only keeps the latest values and draws them once per screen refresh (SCALE_REFRESH_MS),
+        whatever came in last always gets drawn
+        """
+        self.scale_vals = list(vals)
+        self.scale_preview = preview
+        if self.scale_after is not None:
+            return
+        wait = SCALE_REFRESH_MS - (time.time() - self.last_scale_update) * 1000
+        self.scale_after = self.tab.after(max(int(wait), 0), self.draw_range)
+
+    def draw_range(self):
+        """
+        :param None
+        :returns None
+
+        updates the lines already on the graphs in place to the slider's time range, nothing gets cleared or plotted again
+        """
+        self.scale_after = None
+        self.last_scale_update = time.time()
+        vals = self.scale_vals
+
+        # iterates through all the data we've plotted so far, each test has its own time array
+        for plotted in self.plotted:
+            # find the index of the left and right values in the data
+            left_elem = int(np.searchsorted(plotted['time'], vals[0], side='left'))
+            right_elem = int(np.searchsorted(plotted['time'], vals[1], side='right'))
+
+            # only show the data between these indexes
+            for line in plotted['lines']:
+                line.set_range(left_elem, right_elem, PREVIEW_DETAIL if self.scale_preview else 1.0)
+
+        for ax in self.axs:
+            ax.relim()
+            ax.autoscale()
+        self.canvas.draw()
+        self.canvas.flush_events()
+
     def load_csv(self):
         """
         :param: None
@@ -6,6 +6,7 @@ import sys
 import os
 import glob
 import platform
+import multiprocessing
 from gui.view_data_tab import ViewData
 from gui.record_data_tab import RecordData
 from gui.calibrate_tab import Calibrate
@@ -206,6 +207,8 @@ class SmarthubApp:
 
 
 if __name__ == '__main__':
+    # the ble process (see base_ble/ble_process.py) gets spawned, which needs this in the pyinstaller executable
+    multiprocessing.freeze_support()
 
     app = SmarthubApp()
 
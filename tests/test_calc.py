@@ -0,0 +1,153 @@
+import numpy as np
+import pytest
+
+from base_ble.params import WHEEL_DIAM_IN, DIST_WHEELS_IN, IN_TO_M
+from base_ble.calc import (
+    compute_kinematics,
+    get_displacement_m,
+    get_distance_m,
+    get_heading_deg,
+    get_top_traj,
+    get_velocity_m_s,
+    Geometry,
+    KinematicsIntegrator,
+)
+
+
+# the loops calc.py used before it was vectorized, kept as they were so the numbers can be checked against them
+
+def loop_displacement_m(time_from_start, rot_l, rot_r, diameter=WHEEL_DIAM_IN, dist_wheels=DIST_WHEELS_IN):
+    rot_l = np.array(rot_l)
+    rot_r = np.array(rot_r)
+    time_from_start = np.array(time_from_start)
+
+    dist_m = [0]
+    for i in range(len(rot_r) - 1):
+        dx_r = (rot_l[i]+rot_r[i])/2 * (time_from_start[i + 1] - time_from_start[i])
+        dx_m = dx_r * (diameter * IN_TO_M / 2)
+        dist_m.append(dx_m + dist_m[-1])
+    return dist_m
+
+
+def loop_distance_m(time_from_start, rot_l, rot_r, diameter=WHEEL_DIAM_IN, dist_wheels=DIST_WHEELS_IN):
+    rot_l = abs(np.array(rot_l))
+    rot_r = abs(np.array(rot_r))
+    return loop_displacement_m(time_from_start, rot_l, rot_r, diameter, dist_wheels)
+
+
+def loop_velocity_m_s(time_from_start, rot_l, rot_r, diameter=WHEEL_DIAM_IN, dist_wheels=DIST_WHEELS_IN):
+    rot_l = np.array(rot_l)
+    rot_r = np.array(rot_r)
+
+    vel_ms = [0]
+    for i in range(len(rot_r) - 1):
+        v_r = (rot_r[i]) * diameter/2*IN_TO_M
+        v_l = (rot_l[i]) * diameter/2*IN_TO_M
+        v_curr = (v_r+v_l)/2
+        vel_ms.append(v_curr)
+    return vel_ms
+
+
+def loop_heading_deg(time_from_start, rot_l, rot_r, diameter=WHEEL_DIAM_IN, dist_wheels=DIST_WHEELS_IN):
+    rot_l = np.array(rot_l)
+    rot_r = np.array(rot_r)
+    time_from_start = np.array(time_from_start)
+
+    heading_deg = [0]
+    for i in range(len(rot_r) - 1):
+        w = ((rot_r[i]-rot_l[i]) * diameter*IN_TO_M/2) / (dist_wheels*IN_TO_M)
+        dh = w * (time_from_start[i + 1] - time_from_start[i])
+        dh = dh*180/np.pi
+        heading_deg.append(dh + heading_deg[-1])
+    return heading_deg
+
+
+def loop_top_traj(disp_m, vel_ms, heading_deg, time_from_start):
+    x, y = [], []
+    dx, dy = 0, 0
+
+    for i in range(len(disp_m) - 1):
+        dx += vel_ms[i]*np.cos(heading_deg[i]*np.pi/180) * (time_from_start[i + 1] - time_from_start[i])
+        dy += vel_ms[i]*np.sin(heading_deg[i]*np.pi/180) * (time_from_start[i + 1] - time_from_start[i])
+        x.append(dx)
+        y.append(dy)
+    return [[x[i], y[i]] for i in range(len(x))]
+
+
+def recording(n, seed=0):
+    """
+    :returns time (sec) with jittery steps around 68 Hz, and left / right wheel rotation (rps) going both ways
+    """
+    rng = np.random.default_rng(seed)
+    time_from_start = np.cumsum(rng.uniform(0.01, 0.02, n))
+    rot_l = rng.normal(0.5, 1.0, n)
+    rot_r = rng.normal(0.5, 1.0, n)
+    return time_from_start, rot_l, rot_r
+
+
+LENGTHS = [0, 1, 2, 20000]
+GEOMETRIES = [Geometry(), Geometry(24.0, 20.5)]
+
+
+@pytest.mark.parametrize('n', LENGTHS)
+@pytest.mark.parametrize('geometry', GEOMETRIES)
+def test_functions_match_loops(n, geometry):
+    t, l, r = recording(n)
+    diameter, dist_wheels = geometry
+
+    np.testing.assert_array_equal(get_displacement_m(t, l, r, diameter, dist_wheels), loop_displacement_m(t, l, r, diameter, dist_wheels))
+    np.testing.assert_array_equal(get_distance_m(t, l, r, diameter, dist_wheels), loop_distance_m(t, l, r, diameter, dist_wheels))
+    np.testing.assert_array_equal(get_velocity_m_s(t, l, r, diameter, dist_wheels), loop_velocity_m_s(t, l, r, diameter, dist_wheels))
+    np.testing.assert_array_equal(get_heading_deg(t, l, r, diameter, dist_wheels), loop_heading_deg(t, l, r, diameter, dist_wheels))
+
+    disp = loop_displacement_m(t, l, r, diameter, dist_wheels)
+    vel = loop_velocity_m_s(t, l, r, diameter, dist_wheels)
+    heading = loop_heading_deg(t, l, r, diameter, dist_wheels)
+    expected = np.array(loop_top_traj(disp, vel, heading, t)).reshape(-1, 2)
+    np.testing.assert_array_equal(get_top_traj(disp, vel, heading, t, diameter, dist_wheels), expected)
+
+
+@pytest.mark.parametrize('n', LENGTHS)
+@pytest.mark.parametrize('geometry', GEOMETRIES)
+def test_compute_kinematics_matches_loops(n, geometry):
+    t, l, r = recording(n)
+    diameter, dist_wheels = geometry
+    kinematics = compute_kinematics(t, l, r, geometry)
+
+    heading = loop_heading_deg(t, l, r, diameter, dist_wheels)
+    vel = loop_velocity_m_s(t, l, r, diameter, dist_wheels)
+    disp = loop_displacement_m(t, l, r, diameter, dist_wheels)
+    traj = np.array(loop_top_traj(disp, vel, heading, t)).reshape(-1, 2)
+
+    np.testing.assert_array_equal(kinematics.distance, loop_distance_m(t, l, r, diameter, dist_wheels))
+    np.testing.assert_array_equal(kinematics.displacement, disp)
+    np.testing.assert_array_equal(kinematics.velocity, vel)
+    np.testing.assert_array_equal(kinematics.heading, heading)
+    np.testing.assert_array_equal(kinematics.x, traj[:, 0])
+    np.testing.assert_array_equal(kinematics.y, traj[:, 1])
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_integrator_matches_batch(seed):
+    t, l, r = recording(5000, seed)
+    expected = compute_kinematics(t, l, r, GEOMETRIES[1])
+
+    # random piece sizes, empty and single sample pieces included
+    rng = np.random.default_rng(seed)
+    integrator = KinematicsIntegrator(GEOMETRIES[1])
+    start = 0
+    while start < len(t):
+        end = min(start + int(rng.choice([0, 1, 2, rng.integers(3, 400)])), len(t))
+        integrator.update(t[start:end], l[start:end], r[start:end])
+        start = end
+
+    assert integrator.count == len(t)
+    for name, value in zip(expected._fields, integrator.result):
+        np.testing.assert_array_equal(value, getattr(expected, name), err_msg=name)
+
+
+def test_integrator_empty():
+    integrator = KinematicsIntegrator()
+    assert integrator.update([], [], []) == 0
+    for value, expected in zip(integrator.result, compute_kinematics([], [], [])):
+        np.testing.assert_array_equal(value, expected)
@@ -0,0 +1,232 @@
+import numpy as np
+import pytest
+
+from base_ble.calc import (
+    compute_kinematics,
+    compute_kinematics_batch,
+    forward_difference_jacobian,
+    get_distance_m,
+    get_heading_deg,
+    Geometry,
+)
+from base_ble.calibrate import minimize_function, minimize_function_batch, minimize_function_jacobian
+
+
+def recording(n, seed=0, rate_hz=68.0):
+    rng = np.random.default_rng(seed)
+    time_from_start = np.cumsum(rng.uniform(0.8, 1.2, n) / rate_hz)
+    return time_from_start, rng.normal(0.8, 0.5, n), rng.normal(0.8, 0.5, n)
+
+
+def central_difference_jacobian(function, params, step=1e-6):
+    """
+    :returns (results, params) jacobian of function from central differences, one call per probe
+    """
+    params = np.asarray(params, dtype=float)
+    columns = []
+    for j in range(len(params)):
+        h = step * max(abs(params[j]), 1.0)
+        up, down = params.copy(), params.copy()
+        up[j] += h
+        down[j] -= h
+        columns.append((np.asarray(function(up)) - np.asarray(function(down))) / (2 * h))
+    return np.column_stack(columns)
+
+
+def forward_difference_columns(function, params):
+    """
+    :returns the jacobian forward_difference_jacobian should give, one function call per probe with its step sizes
+    """
+    params = np.asarray(params, dtype=float)
+    steps = np.sqrt(np.finfo(float).eps) * np.abs(params)
+    steps[steps == 0] = np.sqrt(np.finfo(float).eps)
+    base = np.asarray(function(params), dtype=float)
+    columns = []
+    for j in range(len(params)):
+        probe = params.copy()
+        probe[j] += steps[j]
+        columns.append((np.asarray(function(probe), dtype=float) - base) / steps[j])
+    return np.column_stack(columns)
+
+
+# compute_kinematics_batch
+
+@pytest.mark.parametrize('trajectory', [True, False])
+def test_batch_rows_match_compute_kinematics(trajectory):
+    t, l, r = recording(3000)
+    diameter = np.array([24.0, 20.0, 26.5, 1.0])
+    dist_wheels = np.array([26.0, 22.0, 19.0, 20.0])
+    left_gain = np.array([1.0, 1.13, 0.9, 20.0])
+    right_gain = np.array([1.0, 1.12, 1.1, 21.0])
+
+    batch = compute_kinematics_batch(t, l, r, Geometry(diameter, dist_wheels), left_gain, right_gain, trajectory=trajectory)
+    for i in range(len(diameter)):
+        expected = compute_kinematics(t, l*left_gain[i], r*right_gain[i], Geometry(diameter[i], dist_wheels[i]), trajectory=trajectory)
+        for name, rows in zip(expected._fields, batch):
+            if getattr(expected, name) is None:
+                assert rows is None
+            else:
+                np.testing.assert_array_equal(rows[i], getattr(expected, name), err_msg=f'{name} row {i}')
+
+
+def test_batch_broadcasts_single_values():
+    t, l, r = recording(500, seed=1)
+    batch = compute_kinematics_batch(t, l, r, Geometry(24.0, np.array([20.0, 26.0])), 1.13, 1.12)
+    assert batch.distance.shape == (2, len(t))
+    assert batch.x.shape == (2, len(t) - 1)
+    for i, dist_wheels in enumerate([20.0, 26.0]):
+        expected = compute_kinematics(t, l*1.13, r*1.12, Geometry(24.0, dist_wheels))
+        np.testing.assert_array_equal(batch.heading[i], expected.heading)
+
+
+@pytest.mark.parametrize('n', [0, 1, 2])
+def test_batch_short_recordings(n):
+    t, l, r = recording(n, seed=2)
+    batch = compute_kinematics_batch(t, l, r, Geometry(np.array([24.0, 20.0]), 26.0))
+    for i in range(2):
+        expected = compute_kinematics(t, l, r, Geometry([24.0, 20.0][i], 26.0))
+        for name, rows in zip(expected._fields, batch):
+            np.testing.assert_array_equal(rows[i], getattr(expected, name), err_msg=name)
+
+
+# forward_difference_jacobian
+
+def test_forward_difference_jacobian_known_function():
+    def batch(params):
+        a, b, c = np.atleast_2d(params).T
+        return np.column_stack((a**2 + b, np.sin(b) * c, np.exp(c / 10)))
+
+    p = np.array([1.5, -0.3, 2.0])
+    a, b, c = p
+    expected = np.array([[2*a, 1, 0],
+                         [0, np.cos(b)*c, np.sin(b)],
+                         [0, 0, np.exp(c / 10) / 10]])
+    np.testing.assert_allclose(forward_difference_jacobian(batch, p), expected, rtol=1e-6, atol=1e-7)
+
+
+def test_forward_difference_jacobian_zero_parameter():
+    # a parameter at 0 still gets a step
+    jacobian = forward_difference_jacobian(lambda params: np.atleast_2d(params)**2 + np.atleast_2d(params), np.array([0.0, 2.0]))
+    np.testing.assert_allclose(np.diag(jacobian), [1.0, 5.0], rtol=1e-6)
+
+
+# calibrate tab: minimize_function
+
+def calibration_list(seed=0):
+    rng = np.random.default_rng(seed)
+    steps = []
+    for name in ['forward1', 'forward2', 'forward3', 'forward4', 'turnright1', 'turnright2', 'turnleft1', 'turnleft2']:
+        t, l, r = recording(int(rng.integers(300, 700)), seed=int(rng.integers(1 << 30)))
+        if 'turnright' in name:
+            r = -r
+        elif 'turnleft' in name:
+            l = -l
+        steps.append({'name': name, 'time_from_start': t.tolist(), 'gyro_left': l.tolist(), 'gyro_right': r.tolist()})
+    return steps
+
+
+def loop_minimize_function(p, calibration_list):
+    # minimize_function before it was batched, one call per step and candidate
+    D, W, ml, mr = p
+
+    forwards = [val for val in calibration_list if 'forward' in val['name']]
+    turnrights = [val for val in calibration_list if 'turnright' in val['name']]
+    turnlefts = [val for val in calibration_list if 'turnleft' in val['name']]
+
+    left_distances = []
+    right_distances = []
+    for forward in forwards:
+        times = forward['time_from_start']
+        gyro_left = np.array(forward['gyro_left'])
+        gyro_right = np.array(forward['gyro_right'])
+        left_distances.append(get_distance_m(times, gyro_left*ml, gyro_left*ml, D, W)[-1])
+        right_distances.append(get_distance_m(times, gyro_right*mr, gyro_right*mr, D, W)[-1])
+    eq1 = 20 - np.sum(left_distances)
+    eq2 = 20 - np.sum(right_distances)
+
+    headings = [get_heading_deg(c['time_from_start'], np.array(c['gyro_left'])*ml, np.array(c['gyro_right'])*mr, D, W)[-1]
+                for c in turnrights+forwards[0:2]]
+    eq3 = 360 - (-np.sum(headings))
+
+    headings = [get_heading_deg(c['time_from_start'], np.array(c['gyro_left'])*ml, np.array(c['gyro_right'])*mr, D, W)[-1]
+                for c in turnlefts+forwards[2:4]]
+    eq4 = 360 - np.sum(headings)
+
+    return [eq1*18, eq2*18, eq3, eq4]
+
+
+CANDIDATES = np.array([[24.0, 26.0, 1.13, 1.12],
+                       [20.0, 22.0, 1.0, 1.0],
+                       [26.5, 19.0, 0.8, 1.3]])
+
+
+def test_minimize_function_batch_matches_loop():
+    calibration = calibration_list()
+    batch = minimize_function_batch(CANDIDATES, calibration)
+    assert batch.shape == (len(CANDIDATES), 4)
+    for row, p in zip(batch, CANDIDATES):
+        np.testing.assert_allclose(row, loop_minimize_function(p, calibration), rtol=1e-12, atol=1e-9)
+        np.testing.assert_array_equal(minimize_function(p, calibration), row)
+
+
+@pytest.mark.parametrize('p', CANDIDATES)
+def test_minimize_function_jacobian(p):
+    calibration = calibration_list(seed=1)
+    jacobian = minimize_function_jacobian(p, calibration)
+    assert jacobian.shape == (4, 4)
+
+    # the same forward differences as probing minimize_function one parameter at a time, laid out the way fsolve wants (results, params)
+    np.testing.assert_allclose(jacobian, forward_difference_columns(lambda q: minimize_function(q, calibration), p),
+                               rtol=1e-9, atol=1e-9)
+    # and close to the real derivative
+    expected = central_difference_jacobian(lambda q: minimize_function(q, calibration), p)
+    np.testing.assert_allclose(jacobian, expected, rtol=1e-4, atol=1e-4 * np.abs(expected).max())
+
+
+# new calibrate tab: minimize_turnaround (needs pymongo, minimize_traj imports it)
+
+def turnaround_test(seed=0, rate_hz=68.0):
+    """
+    :returns out 5 s, spin about 180 degrees on the spot, back 5 s, with a bit of noise, at the gains fsolve starts from
+    """
+    rng = np.random.default_rng(seed)
+    straight = int(5 * rate_hz)
+    turn = int(3 * rate_hz)
+    left = np.concatenate((np.full(straight, 0.05), np.full(turn, 1.0), np.full(straight, 0.05)))
+    right = np.concatenate((np.full(straight, 0.05), np.full(turn, -1.0), np.full(straight, 0.05)))
+    n = len(left)
+    return {'elapsed_time_s': (np.arange(n) / rate_hz).tolist(),
+            'gyro_left_smoothed': (left + rng.normal(0, 0.002, n)).tolist(),
+            'gyro_right_smoothed': (right + rng.normal(0, 0.002, n)).tolist()}
+
+
+@pytest.fixture
+def minimize_traj():
+    pytest.importorskip('pymongo')
+    from base_ble import minimize_traj
+    # the turn is found once and kept on the function, start each test fresh
+    for attr in ('start_turn', 'end_turn'):
+        if hasattr(minimize_traj.minimize_turnaround, attr):
+            delattr(minimize_traj.minimize_turnaround, attr)
+    yield minimize_traj
+    for attr in ('start_turn', 'end_turn'):
+        if hasattr(minimize_traj.minimize_turnaround, attr):
+            delattr(minimize_traj.minimize_turnaround, attr)
+
+
+def test_minimize_turnaround_batch_matches_single(minimize_traj):
+    test = turnaround_test()
+    candidates = np.array([[20.0, 20.0, 20.0], [21.0, 19.5, 22.0], [18.0, 20.5, 19.0]])
+    batch = minimize_traj.minimize_turnaround_batch(candidates, test)
+    assert batch.shape == (3, 3)
+    for row, p in zip(batch, candidates):
+        np.testing.assert_array_equal(minimize_traj.minimize_turnaround(p, test), row)
+
+
+def test_minimize_turnaround_jacobian(minimize_traj):
+    test = turnaround_test(seed=1)
+    p = np.array([20.0, 20.0, 20.0])
+    jacobian = minimize_traj.minimize_turnaround_jacobian(p, test)
+    assert jacobian.shape == (3, 3)
+    np.testing.assert_allclose(jacobian, forward_difference_columns(lambda q: minimize_traj.minimize_turnaround(q, test), p),
+                               rtol=1e-9, atol=1e-9)
@@ -0,0 +1,320 @@
+import numpy as np
+import pytest
+
+from base_ble.chunk_store import (
+    chunk_id,
+    ChunkWriteError,
+    ChunkWriter,
+    delete_test,
+    insert_test,
+    load_test,
+    STORAGE_FIELDS,
+    TIME_KEY,
+)
+
+
+def matches(document, query):
+    for key, value in query.items():
+        if isinstance(value, dict):
+            if '$gte' in value and not document[key] >= value['$gte']:
+                return False
+            if '$lte' in value and not document[key] <= value['$lte']:
+                return False
+        elif document.get(key) != value:
+            return False
+    return True
+
+
+class Cursor:
+    """
+    sorts on the whole documents and only hands out the projected fields, the way mongo does
+    """
+
+    def __init__(self, documents, projection=None):
+        self.documents = documents
+        self.projection = projection
+
+    def sort(self, key, direction):
+        return Cursor(sorted(self.documents, key=lambda document: document[key] * direction), self.projection)
+
+    def __iter__(self):
+        for document in self.documents:
+            if self.projection is None:
+                yield dict(document)
+            else:
+                yield {key: value for key, value in document.items() if key == '_id' or key in self.projection}
+
+
+class FakeCollection:
+    """
+    the bits of a pymongo collection chunk_store uses, in memory
+
+    fail: the next this many replace_one / update_one calls raise, as if the connection dropped
+    ops: (name, _id or query, upsert) of every call that went through, shared between collections to see the order
+    """
+
+    def __init__(self, ops=None):
+        self.documents = {}
+        self.fail = 0
+        self.ops = [] if ops is None else ops
+
+    def _maybe_fail(self):
+        if self.fail > 0:
+            self.fail -= 1
+            raise ConnectionError('connection dropped')
+
+    def create_index(self, keys):
+        pass
+
+    def insert_one(self, document):
+        assert document['_id'] not in self.documents
+        self.documents[document['_id']] = dict(document)
+        self.ops.append(('insert_one', document['_id'], False))
+
+    def replace_one(self, query, document, upsert=False):
+        self._maybe_fail()
+        if query['_id'] in self.documents or upsert:
+            self.documents[query['_id']] = dict(document)
+        self.ops.append(('replace_one', query['_id'], upsert))
+
+    def update_one(self, query, update):
+        self._maybe_fail()
+        self.documents[query['_id']].update(update['$set'])
+        self.ops.append(('update_one', query['_id'], False))
+
+    def find_one(self, query):
+        found = [document for document in self.documents.values() if matches(document, query)]
+        return dict(found[0]) if found else None
+
+    def find(self, query, projection=None):
+        return Cursor([document for document in self.documents.values() if matches(document, query)], projection)
+
+    def delete_one(self, query):
+        self.documents.pop(query['_id'], None)
+        self.ops.append(('delete_one', query['_id'], False))
+
+    def delete_many(self, query):
+        for key in [key for key, document in self.documents.items() if matches(document, query)]:
+            del self.documents[key]
+        self.ops.append(('delete_many', query, False))
+
+
+RAW = ('gyro_left', 'gyro_right', 'accel_left', 'accel_right')
+
+
+def recording(duration_s=35.0, rate_hz=68.0, seed=0):
+    """
+    :returns raw series and the whole test (the raw ones plus what's only worked out at the end)
+    """
+    rng = np.random.default_rng(seed)
+    time_s = np.arange(0, duration_s, 1 / rate_hz)
+    raw = {TIME_KEY: time_s}
+    raw.update({key: rng.normal(0, 1, len(time_s)) for key in RAW})
+    full = dict(raw)
+    full['distance_m'] = np.cumsum(np.abs(raw['gyro_left'])) / rate_hz
+    full['heading_deg'] = np.cumsum(raw['gyro_right'] - raw['gyro_left'])
+    return raw, full
+
+
+def record(writer, raw, step=300):
+    """
+    passes raw to write a bit more at a time, the way the record tab does while recording
+    """
+    for n in range(step, len(raw[TIME_KEY]) + step, step):
+        writer.write({key: value[:n] for key, value in raw.items()})
+
+
+def assert_series_equal(test, series):
+    for key, value in series.items():
+        np.testing.assert_array_equal(test[key], value, err_msg=key)
+
+
+def test_write_and_finish():
+    collection, chunks = FakeCollection(), FakeCollection()
+    raw, full = recording()
+    writer = ChunkWriter(collection, chunks, 'T', chunk_s=10, retry_s=0.001)
+    record(writer, raw)
+    writer._queue.join()
+    # chunks go in while recording, the header doesn't
+    assert len(chunks.documents) == 3
+    assert collection.documents == {}
+
+    assert writer.finish(full, user_id='u', test_name='t') == 'T'
+    header = collection.documents['T']
+    assert header['chunked'] and header['chunk_s'] == 10
+    assert header['n_chunks'] == len(chunks.documents) == 4
+    assert header['n_samples'] == len(full[TIME_KEY])
+    assert header['series'] == list(full)
+    assert header['user_id'] == 'u'
+    for index in range(4):
+        chunk = chunks.documents[chunk_id('T', index)]
+        assert index * 10 <= chunk['t0'] <= chunk['t1'] < (index + 1) * 10
+        assert set(full) <= set(chunk)
+
+    test = load_test(collection, chunks, 'T')
+    assert_series_equal(test, full)
+    assert test['user_id'] == 'u'
+    assert not set(STORAGE_FIELDS) & set(test)
+
+
+def test_finish_trims_to_shortest():
+    collection, chunks = FakeCollection(), FakeCollection()
+    _, full = recording(duration_s=12)
+    n = len(full[TIME_KEY])
+    full['accel_left'] = np.append(full['accel_left'], 1.0)
+    full['distance_m'] = full['distance_m'][:n - 5]
+    ChunkWriter(collection, chunks, 'T', chunk_s=5, retry_s=0.001).finish(full)
+
+    assert collection.documents['T']['n_samples'] == n - 5
+    test = load_test(collection, chunks, 'T')
+    assert all(len(test[key]) == n - 5 for key in full)
+    assert_series_equal(test, {key: value[:n - 5] for key, value in full.items()})
+
+
+def test_finish_adds_late_series_to_saved_chunks():
+    collection, chunks = FakeCollection(), FakeCollection()
+    raw, full = recording()
+    writer = ChunkWriter(collection, chunks, 'T', chunk_s=10, retry_s=0.001)
+    record(writer, raw)
+    writer.finish(full)
+
+    # the chunks write saved only get the series they were missing, the last one goes in whole
+    updates = [op for op in chunks.ops if op[0] == 'update_one']
+    assert [op[1] for op in updates] == [chunk_id('T', index) for index in range(3)]
+    assert_series_equal(load_test(collection, chunks, 'T'), full)
+
+
+def test_finish_resends_failed_chunks():
+    collection, chunks = FakeCollection(), FakeCollection()
+    raw, full = recording()
+    writer = ChunkWriter(collection, chunks, 'T', chunk_s=10, retries=2, retry_s=0.001)
+    # the first chunk fails every try, the second one goes in on its second
+    chunks.fail = 3
+    record(writer, raw)
+    writer._queue.join()
+    assert sorted(writer.stored) == [1, 2]
+    assert isinstance(writer.error, ConnectionError)
+
+    writer.finish(full)
+    # all of the first chunk again, not just the late series
+    assert ('replace_one', chunk_id('T', 0), True) in chunks.ops
+    assert_series_equal(load_test(collection, chunks, 'T'), full)
+
+
+def test_header_goes_in_last():
+    ops = []
+    collection, chunks = FakeCollection(ops), FakeCollection(ops)
+    raw, full = recording()
+    # saving the same test again replaces the header that's there
+    collection.documents['T'] = {'_id': 'T', 'old': True}
+    writer = ChunkWriter(collection, chunks, 'T', chunk_s=10, retry_s=0.001)
+    record(writer, raw)
+    writer.finish(full, user_id='u')
+
+    assert ops[-1] == ('replace_one', 'T', True)
+    assert sum(1 for op in ops if op[1] == 'T') == 1
+    assert 'old' not in collection.documents['T']
+    assert not writer._thread.is_alive()
+
+
+def test_finish_raises_when_chunks_fail():
+    collection, chunks = FakeCollection(), FakeCollection()
+    raw, full = recording()
+    writer = ChunkWriter(collection, chunks, 'T', chunk_s=10, retries=2, retry_s=0.001)
+    chunks.fail = 10 ** 9
+    record(writer, raw)
+    with pytest.raises(ChunkWriteError, match='could not be saved'):
+        writer.finish(full)
+    # no header, so the test never shows up half saved
+    assert collection.documents == {}
+    assert load_test(collection, chunks, 'T') is None
+    assert not writer._thread.is_alive()
+
+
+def test_finish_raises_when_header_fails():
+    collection, chunks = FakeCollection(), FakeCollection()
+    _, full = recording()
+    collection.fail = 10 ** 9
+    with pytest.raises(ChunkWriteError, match='header'):
+        ChunkWriter(collection, chunks, 'T', chunk_s=10, retries=2, retry_s=0.001).finish(full)
+    assert collection.documents == {}
+
+
+def test_discard():
+    collection, chunks = FakeCollection(), FakeCollection()
+    raw, _ = recording()
+    chunks.documents['other#00000'] = {'_id': 'other#00000', 'test_id': 'other'}
+    writer = ChunkWriter(collection, chunks, 'T', chunk_s=10, retry_s=0.001)
+    record(writer, raw)
+    writer.discard()
+    writer._thread.join()
+    assert list(chunks.documents) == ['other#00000']
+    assert collection.documents == {}
+
+
+def saved_both_ways(full, **fields):
+    """
+    :returns header and chunk collections with the same test saved as a single document (_id 'single') and in chunks ('chunked')
+    """
+    collection, chunks = FakeCollection(), FakeCollection()
+    document = {key: np.asarray(value).tolist() for key, value in full.items()}
+    document.update(fields)
+    collection.insert_one(dict(document, _id='single'))
+    insert_test(collection, chunks, dict(document, _id='chunked'), chunk_s=10)
+    return collection, chunks
+
+
+@pytest.mark.parametrize('start_s, end_s', [(None, None), (12.0, 27.5), (None, 5.0), (31.0, None), (100.0, None)])
+@pytest.mark.parametrize('series', [None, ['distance_m', 'heading_deg'], ['distance_m', 'not_a_series'], []])
+def test_load_chunked_matches_single(start_s, end_s, series):
+    _, full = recording()
+    collection, chunks = saved_both_ways(full, user_id='u', merge_stats={'paired': 1})
+    single = load_test(collection, chunks, 'single', start_s, end_s, series)
+    chunked = load_test(collection, chunks, 'chunked', start_s, end_s, series)
+
+    names = list(full) if series is None else [TIME_KEY] + [key for key in series if key in full]
+    assert set(single) == set(chunked) == set(names) | {'_id', 'user_id', 'merge_stats'}
+    for key in names:
+        np.testing.assert_array_equal(single[key], chunked[key], err_msg=key)
+    assert single['merge_stats'] == chunked['merge_stats']
+
+    time_s = full[TIME_KEY]
+    keep = (time_s >= (-np.inf if start_s is None else start_s)) & (time_s <= (np.inf if end_s is None else end_s))
+    assert_series_equal(chunked, {key: full[key][keep] for key in names})
+
+
+def test_load_missing_series_nan_filled():
+    collection, chunks = FakeCollection(), FakeCollection()
+    _, full = recording()
+    ChunkWriter(collection, chunks, 'T', chunk_s=10, retry_s=0.001).finish(full)
+    # a chunk saved before finish could add distance_m to it
+    chunk = chunks.documents[chunk_id('T', 1)]
+    del chunk['distance_m']
+
+    test = load_test(collection, chunks, 'T', series=['distance_m'])
+    distance = np.asarray(test['distance_m'])
+    start, n = chunk['start'], chunk['n']
+    assert np.isnan(distance[start:start + n]).all()
+    assert np.isnan(distance).sum() == n
+    np.testing.assert_array_equal(np.delete(distance, np.s_[start:start + n]),
+                                  np.delete(full['distance_m'], np.s_[start:start + n]))
+
+
+def test_load_no_such_test():
+    assert load_test(FakeCollection(), FakeCollection(), 'T') is None
+
+
+def test_delete_test():
+    _, full = recording()
+    collection, chunks = saved_both_ways(full)
+    insert_test(collection, chunks, dict({key: value.tolist() for key, value in full.items()}, _id='kept'), chunk_s=10)
+
+    delete_test(collection, chunks, 'chunked')
+    assert load_test(collection, chunks, 'chunked') is None
+    assert not any(chunk['test_id'] == 'chunked' for chunk in chunks.documents.values())
+    assert_series_equal(load_test(collection, chunks, 'kept'), full)
+
+    # single documents have no chunks to go with them
+    delete_test(collection, chunks, 'single')
+    assert load_test(collection, chunks, 'single') is None
+    assert set(collection.documents) == {'kept'}
@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+from base_ble.decode import decode_frames, FRAME_LEN, SAMPLES_PER_FRAME
+
+
+# RecordData.convert_from_raw before it went through decode_frames, kept as it was to check the numbers against
+
+def loop_convert_from_raw(raw_data):
+    accel_data = []
+    gyro_data = []
+
+    for i in range(4):
+        accel_data.append((raw_data[2*i+2] + raw_data[2*i+3]*256) / 1000)
+        gyro_data.append((raw_data[2*i+10] + raw_data[2*i+11]*256) / 100)
+
+        if (raw_data[0] & (1 << i)) == (1 << i):
+            accel_data[i] *= -1
+
+        if (raw_data[1] & (1 << i)) == (1 << i):
+            gyro_data[i] *= -1
+    return accel_data, gyro_data
+
+
+def random_frames(n, seed=0):
+    rng = np.random.default_rng(seed)
+    frames = [rng.integers(0, 256, FRAME_LEN, dtype=np.uint8).tobytes() for _ in range(n)]
+    # every sign pattern and the ends of the value range show up at least once
+    edges = [bytes([bits, 15 - bits]) + b'\x00\x00' + b'\xff\xff' * 3 + b'\x00\x00' * 4 for bits in range(16)]
+    return frames + edges
+
+
+def assert_bits_equal(actual, expected):
+    # same value and the same sign, -0.0 included
+    actual = np.asarray(actual, dtype=float)
+    expected = np.asarray(expected, dtype=float)
+    np.testing.assert_array_equal(actual, expected)
+    np.testing.assert_array_equal(np.signbit(actual), np.signbit(expected))
+
+
+def test_batch_matches_loop():
+    frames = random_frames(500)
+    accel, gyro = decode_frames(frames)
+    assert accel.shape == gyro.shape == (len(frames), SAMPLES_PER_FRAME)
+    for frame, accel_row, gyro_row in zip(frames, accel, gyro):
+        expected_accel, expected_gyro = loop_convert_from_raw(frame)
+        assert_bits_equal(accel_row, expected_accel)
+        assert_bits_equal(gyro_row, expected_gyro)
+
+
+def test_back_to_back_bytes_match_list():
+    frames = random_frames(50, seed=1)
+    for a, b in zip(decode_frames(b''.join(frames)), decode_frames(frames)):
+        assert_bits_equal(a, b)
+
+
+@pytest.mark.parametrize('raw_type', [bytes, bytearray, memoryview])
+def test_single_frame(raw_type):
+    for frame in random_frames(20, seed=2):
+        accel, gyro = decode_frames(raw_type(frame))
+        assert accel.shape == gyro.shape == (1, SAMPLES_PER_FRAME)
+        expected_accel, expected_gyro = loop_convert_from_raw(frame)
+        assert_bits_equal(accel[0], expected_accel)
+        assert_bits_equal(gyro[0], expected_gyro)
+
+
+def test_left_right_pair():
+    # the calibrate tab decodes a left and right frame together, row 0 left and row 1 right
+    left, right = random_frames(2, seed=3)[:2]
+    _, gyro = decode_frames((left, right))
+    left_gyro, right_gyro = gyro.tolist()
+    assert_bits_equal(left_gyro, loop_convert_from_raw(left)[1])
+    assert_bits_equal(right_gyro, loop_convert_from_raw(right)[1])
+
+
+def test_out_arrays():
+    frames = random_frames(10, seed=4)
+    accel_out = np.empty((len(frames), SAMPLES_PER_FRAME))
+    gyro_out = np.empty((len(frames), SAMPLES_PER_FRAME))
+    accel, gyro = decode_frames(frames, accel_out, gyro_out)
+    assert accel is accel_out and gyro is gyro_out
+    expected = decode_frames(frames)
+    assert_bits_equal(accel, expected[0])
+    assert_bits_equal(gyro, expected[1])
+
+
+def test_bad_input():
+    with pytest.raises(ValueError):
+        decode_frames(b'\x00' * (FRAME_LEN + 1))
+    with pytest.raises(ValueError):
+        decode_frames(random_frames(2), accel_out=np.empty((1, SAMPLES_PER_FRAME)))
+
+
+def test_record_tab_convert_from_raw():
+    # needs everything the gui imports
+    pytest.importorskip('bleak')
+    pytest.importorskip('pymongo')
+    from gui.record_data_tab import RecordData
+
+    for frame in random_frames(20, seed=5):
+        accel, gyro = RecordData.convert_from_raw(bytearray(frame))
+        expected_accel, expected_gyro = loop_convert_from_raw(frame)
+        assert_bits_equal(accel, expected_accel)
+        assert_bits_equal(gyro, expected_gyro)
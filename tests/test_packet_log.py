@@ -0,0 +1,288 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from base_ble import packet_log
+from base_ble.calc import Geometry
+from base_ble.decode import FRAME_LEN
+from base_ble.filters import make_filter
+from base_ble.packet_log import (
+    GAP_END,
+    GAP_START,
+    log_settings,
+    MAGIC_V1,
+    PacketLog,
+    read_log,
+    read_settings,
+    RECORD_DTYPE,
+    replay_log,
+)
+from base_ble.stream_merger import FRAME_PERIOD_S, sample_offsets, StreamMerger
+from base_ble.test_document import build_test
+
+
+SETTINGS = log_settings(Geometry(24.0, 20.5), 1.13, 1.12, {'name': 'savgol', 'window_s': 0.2})
+
+
+def notifications(n, seed=0):
+    """
+    :returns (side, time, frame) for n frames from each side, in arrival order with a bit of jitter
+    """
+    rng = np.random.default_rng(seed)
+    arrivals = []
+    for side in ('left', 'right'):
+        times = np.arange(n) * FRAME_PERIOD_S + rng.uniform(0, 0.01, n)
+        arrivals += [(side, float(t), rng.integers(0, 256, FRAME_LEN, dtype=np.uint8).tobytes()) for t in times]
+    return sorted(arrivals, key=lambda arrival: arrival[1])
+
+
+def with_gap(arrivals, start, end):
+    """
+    :returns arrivals with a smarthub dropping out at start and coming back at end, ('begin_gap', time, None) marks them
+    """
+    events = [arrival for arrival in arrivals if arrival[1] < start] + [('begin_gap', start, None)]
+    events += [arrival for arrival in arrivals if start <= arrival[1] < end] + [('end_gap', end, None)]
+    return events + [arrival for arrival in arrivals if arrival[1] >= end]
+
+
+def write_log(path, events, settings=SETTINGS, **kwargs):
+    log = PacketLog(path, settings, **kwargs)
+    for side, time_received, message in events:
+        if message is None:
+            getattr(log, side)(time_received)
+        else:
+            log.append(side, time_received, message)
+    log.close()
+    return log
+
+
+def merge_and_build(events, geometry, left_gain, right_gain, smoothing):
+    """
+    :returns the test a live recording of events would have saved, without going through a file
+    """
+    merger = StreamMerger()
+    for side, time_received, message in events:
+        if message is None:
+            getattr(merger, side)(time_received)
+        else:
+            merger.push(side, time_received, message)
+    merged = merger.drain(np.inf, flush=True)
+    time_from_start = merged.time[:, np.newaxis] - sample_offsets()
+    return build_test(time_from_start, merged.accel_left, merged.accel_right, merged.gyro_left, merged.gyro_right,
+                      geometry, left_gain, right_gain, smoothing)
+
+
+def assert_tests_equal(actual, expected):
+    for key, value in expected.items():
+        np.testing.assert_array_equal(actual[key], value, err_msg=key)
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'raw.shlog')
+    arrivals = notifications(200)
+    log = write_log(path, arrivals)
+
+    records = read_log(path)
+    assert len(records) == log.count == len(arrivals)
+    for record, (side, time_received, message) in zip(records, arrivals):
+        assert packet_log.SIDES[record['side']] == side
+        assert record['time'] == time_received
+        assert record['frame'].tobytes() == message
+    assert read_settings(path) == SETTINGS
+
+    # nothing given, the settings from the header
+    expected = merge_and_build(arrivals, Geometry(24.0, 20.5), 1.13, 1.12, make_filter(SETTINGS['gyro_filter']))
+    test = replay_log(path)
+    assert_tests_equal(test, expected)
+    assert test['merge_stats']['paired'] + test['merge_stats']['interpolated_left'] + test['merge_stats']['interpolated_right'] \
+        == len(test['elapsed_time_s']) // 4
+
+    # anything given wins over the header
+    expected = merge_and_build(arrivals, Geometry(), 1.0, 1.2, make_filter())
+    assert_tests_equal(replay_log(path, Geometry(), 1.0, 1.2, make_filter()), expected)
+
+
+def test_reopen_appends(tmp_path):
+    path = str(tmp_path / 'raw.shlog')
+    arrivals = notifications(20, seed=1)
+    write_log(path, arrivals[:10])
+    # the header is only written once, the settings passed the second time are ignored
+    write_log(path, arrivals[10:], settings=log_settings())
+    assert len(read_log(path)) == len(arrivals)
+    assert read_settings(path) == SETTINGS
+
+
+def test_truncated_trailing_record(tmp_path):
+    path = str(tmp_path / 'raw.shlog')
+    arrivals = notifications(20, seed=2)
+    write_log(path, arrivals)
+    size = os.path.getsize(path)
+    whole = read_log(path)
+
+    # a crash half way through writing the next record
+    with open(path, 'ab') as f:
+        f.write(b'\x01' * (RECORD_DTYPE.itemsize // 2))
+    assert os.path.getsize(path) == size + RECORD_DTYPE.itemsize // 2
+    np.testing.assert_array_equal(read_log(path), whole)
+    assert_tests_equal(replay_log(path), merge_and_build(arrivals, Geometry(24.0, 20.5), 1.13, 1.12,
+                                                         make_filter(SETTINGS['gyro_filter'])))
+
+
+def test_gap_markers(tmp_path):
+    path = str(tmp_path / 'raw.shlog')
+    arrivals = notifications(100, seed=3)
+    gap = (2.0, 3.0)
+    events = with_gap(arrivals, *gap)
+    write_log(path, events)
+
+    records = read_log(path)
+    markers = records[records['side'] >= GAP_START]
+    assert markers['side'].tolist() == [GAP_START, GAP_END]
+    assert markers['time'].tolist() == list(gap)
+    assert not markers['frame'].any()
+
+    test = replay_log(path)
+    stats = test['merge_stats']
+    assert stats['gaps'] == [list(gap)]
+    # what came in between the markers was dropped, and the rows jump over the outage
+    dropped = sum(1 for _, time_received, _ in arrivals if gap[0] <= time_received < gap[1])
+    assert stats['gap_left'] + stats['gap_right'] == dropped
+    assert np.diff(test['elapsed_time_s']).max() > gap[1] - gap[0] - FRAME_PERIOD_S
+    assert_tests_equal(test, merge_and_build(events, Geometry(24.0, 20.5), 1.13, 1.12, make_filter(SETTINGS['gyro_filter'])))
+
+
+def test_v1_log(tmp_path):
+    # before the settings header, the records straight after the magic
+    path = str(tmp_path / 'raw.shlog')
+    arrivals = notifications(20, seed=4)
+    records = np.zeros(len(arrivals), dtype=RECORD_DTYPE)
+    for record, (side, time_received, message) in zip(records, arrivals):
+        record['side'] = packet_log.SIDES.index(side)
+        record['time'] = time_received
+        record['frame'] = np.frombuffer(message, dtype=np.uint8)
+    with open(path, 'wb') as f:
+        f.write(MAGIC_V1 + records.tobytes())
+
+    np.testing.assert_array_equal(read_log(path), records)
+    assert read_settings(path) == log_settings()
+    assert_tests_equal(replay_log(path), merge_and_build(arrivals, Geometry(), log_settings()['left_gain'],
+                                                         log_settings()['right_gain'], make_filter()))
+
+
+def test_not_a_log(tmp_path):
+    path = tmp_path / 'raw.shlog'
+    path.write_bytes(b'not a log at all')
+    with pytest.raises(ValueError):
+        read_log(str(path))
+
+
+def test_empty_log(tmp_path):
+    path = str(tmp_path / 'raw.shlog')
+    write_log(path, [])
+    assert len(read_log(path)) == 0
+    with pytest.raises(ValueError):
+        replay_log(path)
+
+
+@pytest.fixture
+def fsyncs(monkeypatch):
+    """
+    :returns list that gets a time.monotonic() for every fsync
+    """
+    calls = []
+    fsync = os.fsync
+
+    def counting_fsync(fd):
+        calls.append(time.monotonic())
+        fsync(fd)
+
+    monkeypatch.setattr(packet_log.os, 'fsync', counting_fsync)
+    return calls
+
+
+def wait_for(condition, timeout_s=5.0):
+    end = time.monotonic() + timeout_s
+    while not condition():
+        if time.monotonic() > end:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def test_flusher_syncs_every_n_records(tmp_path, fsyncs):
+    log = PacketLog(str(tmp_path / 'raw.shlog'), SETTINGS, sync_every=8, sync_interval_s=60.0)
+    # the header gets synced
+    assert len(fsyncs) == 1
+    for side, time_received, message in notifications(4, seed=5)[:7]:
+        log.append(side, time_received, message)
+    time.sleep(0.05)
+    assert len(fsyncs) == 1
+
+    side, time_received, message = notifications(1, seed=6)[0]
+    log.append(side, time_received, message)
+    assert wait_for(lambda: len(fsyncs) == 2)
+    log.close()
+    assert len(fsyncs) == 3
+
+
+def test_flusher_syncs_every_interval(tmp_path, fsyncs):
+    log = PacketLog(str(tmp_path / 'raw.shlog'), SETTINGS, sync_every=10000, sync_interval_s=0.05)
+    side, time_received, message = notifications(1, seed=7)[0]
+    log.append(side, time_received, message)
+    assert wait_for(lambda: len(fsyncs) == 2)
+    # nothing new, nothing to sync
+    time.sleep(0.2)
+    assert len(fsyncs) == 2
+    log.close()
+
+
+def test_close_racing_append(tmp_path, fsyncs):
+    path = str(tmp_path / 'raw.shlog')
+    log = PacketLog(path, SETTINGS, sync_every=4, sync_interval_s=0.01)
+    header_size = os.path.getsize(path)
+    arrivals = notifications(50, seed=8)
+    errors = []
+    started = threading.Event()
+    closed = threading.Event()
+
+    def ble_thread():
+        # keeps going a while after close, the way notifications do until the client disconnects
+        try:
+            k = 0
+            after_close = 0
+            while after_close < 1000:
+                side, time_received, message = arrivals[k % len(arrivals)]
+                log.append(side, time_received + k, message)
+                if k % 97 == 0:
+                    log.begin_gap(float(k))
+                    log.end_gap(float(k))
+                k += 1
+                started.set()
+                if closed.is_set():
+                    after_close += 1
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=ble_thread)
+    thread.start()
+    started.wait()
+    time.sleep(0.05)
+    log.close()
+    closed.set()
+    thread.join()
+
+    assert errors == []
+    assert not log._flusher.is_alive()
+    # everything appended before close made it to the file whole, nothing after it did
+    assert log.count > 0
+    assert os.path.getsize(path) == header_size + log.count * RECORD_DTYPE.itemsize
+    assert len(read_log(path)) == log.count
+
+    log.append('left', 0.0, arrivals[0][2])
+    log.end_gap(0.0)
+    log.sync()
+    log.close()
+    assert os.path.getsize(path) == header_size + log.count * RECORD_DTYPE.itemsize
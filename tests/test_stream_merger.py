@@ -0,0 +1,236 @@
+import numpy as np
+import pytest
+
+from base_ble.decode import FRAME_DTYPE, SAMPLES_PER_FRAME
+from base_ble.stream_merger import FRAME_PERIOD_S, SAMPLE_RATE_HZ, merge_summary, sample_offsets, StreamMerger
+
+
+def frame(accel, gyro):
+    """
+    :param accel, gyro: 4 samples each, oldest first
+    :returns the 18 byte notification a smarthub would send for them
+    """
+    accel = np.round(np.asarray(accel, dtype=float) * 1000).astype(int)
+    gyro = np.round(np.asarray(gyro, dtype=float) * 100).astype(int)
+    raw = np.zeros(1, dtype=FRAME_DTYPE)
+    raw['accel_sign'] = int(((accel < 0) << np.arange(SAMPLES_PER_FRAME)).sum())
+    raw['gyro_sign'] = int(((gyro < 0) << np.arange(SAMPLES_PER_FRAME)).sum())
+    raw['accel'] = np.abs(accel)
+    raw['gyro'] = np.abs(gyro)
+    return raw.tobytes()
+
+
+def ramp_frame(k):
+    """
+    :returns frame k of a wheel speeding up steadily, sample n is 0.01 * n on both channels
+    """
+    samples = (k * SAMPLES_PER_FRAME + np.arange(SAMPLES_PER_FRAME)) * 0.01
+    return frame(samples, samples)
+
+
+def test_pairs_left_and_right():
+    merger = StreamMerger()
+    for k in range(10):
+        merger.push('left', k * FRAME_PERIOD_S, frame([k] * 4, [0.5, -0.5, k, -k]))
+        merger.push('right', k * FRAME_PERIOD_S + 0.005, frame([-k] * 4, [1, 2, 3, k]))
+    merged = merger.drain(np.inf, flush=True)
+
+    assert len(merged.time) == 10
+    # a pair is complete once the later frame is in
+    np.testing.assert_allclose(merged.time, np.arange(10) * FRAME_PERIOD_S + 0.005)
+    for k in range(10):
+        np.testing.assert_array_equal(merged.accel_left[k], [k] * 4)
+        np.testing.assert_array_equal(merged.gyro_left[k], [0.5, -0.5, k, -k])
+        np.testing.assert_array_equal(merged.accel_right[k], [-k] * 4)
+        np.testing.assert_array_equal(merged.gyro_right[k], [1, 2, 3, k])
+    assert merger.stats['paired'] == 10
+    assert merger.stats['interpolated_left'] == merger.stats['interpolated_right'] == 0
+    assert len(merger) == 0
+
+
+def test_interpolates_missing_frame():
+    merger = StreamMerger()
+    for k in range(5):
+        merger.push('left', k * FRAME_PERIOD_S, ramp_frame(k))
+        if k != 2:
+            merger.push('right', k * FRAME_PERIOD_S, ramp_frame(k))
+    merged = merger.drain(np.inf, flush=True)
+
+    assert len(merged.time) == 5
+    assert merger.stats['paired'] == 4
+    assert merger.stats['interpolated_right'] == 1
+    assert merger.stats['interpolated_left'] == 0
+    # the ramp is a straight line through the samples either side, so the made up frame lands on it
+    np.testing.assert_allclose(merged.gyro_right[2], merged.gyro_left[2])
+    np.testing.assert_allclose(merged.accel_right[2], merged.accel_left[2])
+    np.testing.assert_allclose(merged.gyro_right[2], [0.08, 0.09, 0.10, 0.11])
+
+
+def test_interpolates_across_drains():
+    # the frame before the missing one was handed out in an earlier drain
+    merger = StreamMerger()
+    for k in range(2):
+        merger.push('left', k * FRAME_PERIOD_S, ramp_frame(k))
+        merger.push('right', k * FRAME_PERIOD_S, ramp_frame(k))
+    merger.drain(np.inf, flush=True)
+    merger.push('left', 2 * FRAME_PERIOD_S, ramp_frame(2))
+    for k in range(3, 5):
+        merger.push('left', k * FRAME_PERIOD_S, ramp_frame(k))
+        merger.push('right', k * FRAME_PERIOD_S, ramp_frame(k))
+    merged = merger.drain(np.inf, flush=True)
+
+    assert len(merged.time) == 3
+    np.testing.assert_allclose(merged.gyro_right[0], [0.08, 0.09, 0.10, 0.11])
+
+
+def test_nothing_from_one_side():
+    merger = StreamMerger()
+    for k in range(3):
+        merger.push('left', k * FRAME_PERIOD_S, ramp_frame(k))
+    merged = merger.drain(np.inf, flush=True)
+    assert merger.stats['interpolated_right'] == 3
+    np.testing.assert_array_equal(merged.gyro_right, np.zeros((3, SAMPLES_PER_FRAME)))
+
+
+def test_drops_duplicates_within_half_period():
+    merger = StreamMerger()
+    message = ramp_frame(3)
+    assert merger.push('left', 1.0, message)
+    # the link repeating itself
+    assert not merger.push('left', 1.0 + 0.4 * FRAME_PERIOD_S, message)
+    # same bytes from the other side, or different bytes on the same side, aren't repeats
+    assert merger.push('right', 1.0 + 0.1 * FRAME_PERIOD_S, message)
+    assert merger.push('left', 1.0 + 0.45 * FRAME_PERIOD_S, ramp_frame(4))
+    # the wheel sitting still sends the same bytes a frame later, that's kept
+    assert merger.push('left', 1.0 + 1.45 * FRAME_PERIOD_S, ramp_frame(4))
+
+    assert merger.stats['duplicates_left'] == 1
+    assert merger.stats['duplicates_right'] == 0
+    assert merger.stats['received_left'] == 3
+    assert merger.stats['received_right'] == 1
+    assert len(merger) == 4
+
+
+def test_duplicate_window_starts_from_last_kept_frame():
+    merger = StreamMerger()
+    message = ramp_frame(0)
+    step = 0.3 * FRAME_PERIOD_S
+    kept = [merger.push('left', k * step, message) for k in range(4)]
+    # measured from the last frame kept, a repeat 0.6 periods after it is a new frame and the one after that is its repeat
+    assert kept == [True, False, True, False]
+
+
+def test_waits_for_latency():
+    merger = StreamMerger(latency_s=0.15)
+    for k in range(10):
+        merger.push('left', k * FRAME_PERIOD_S, ramp_frame(k))
+        merger.push('right', k * FRAME_PERIOD_S, ramp_frame(k))
+    now = 9 * FRAME_PERIOD_S
+    merged = merger.drain(now)
+    assert np.all(merged.time < now - 0.15)
+    assert len(merged.time) + len(merger) // 2 == 10
+
+    # a late partner still gets paired with a frame left waiting
+    merger.push('left', 10 * FRAME_PERIOD_S, ramp_frame(10))
+    waiting = merger.drain(10 * FRAME_PERIOD_S)
+    merger.push('right', 10 * FRAME_PERIOD_S + 0.02, ramp_frame(10))
+    rest = merger.drain(np.inf, flush=True)
+    assert len(merged.time) + len(waiting.time) + len(rest.time) == 11
+    assert merger.stats['paired'] == 11
+
+
+def test_row_times_never_go_backwards():
+    # the first pair only completes after the lone left frame behind it arrived
+    merger = StreamMerger()
+    merger.push('left', 0.0, ramp_frame(0))
+    merger.push('right', 0.04, ramp_frame(0))
+    merger.push('left', 0.03, ramp_frame(1))
+    merged = merger.drain(np.inf, flush=True)
+    np.testing.assert_array_equal(merged.time, [0.04, 0.04])
+
+    # and across drains
+    merger.push('left', 0.035, ramp_frame(2))
+    merged = merger.drain(np.inf, flush=True)
+    np.testing.assert_array_equal(merged.time, [0.04])
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_jittery_stream(seed):
+    rng = np.random.default_rng(seed)
+    n = 400
+    arrivals = []
+    for side in ('left', 'right'):
+        times = np.arange(n) * FRAME_PERIOD_S + rng.normal(0, 0.01, n)
+        # a few frames never make it
+        keep = rng.random(n) > 0.05
+        arrivals += [(t, side, k) for t, k in zip(times[keep], np.flatnonzero(keep))]
+    # notifications show up in whatever order the link hands them over
+    arrivals.sort(key=lambda arrival: arrival[0] + rng.uniform(0, 0.01))
+
+    merger = StreamMerger()
+    row_times = []
+    pushed = 0
+    for now in np.arange(0, n * FRAME_PERIOD_S + 0.5, 0.05):
+        while pushed < len(arrivals) and arrivals[pushed][0] <= now:
+            t, side, k = arrivals[pushed]
+            merger.push(side, t, ramp_frame(k))
+            pushed += 1
+        row_times.append(merger.drain(now).time)
+    row_times.append(merger.drain(np.inf, flush=True).time)
+    row_times = np.concatenate(row_times)
+
+    stats = merger.stats
+    assert np.all(np.diff(row_times) >= 0)
+    # every frame ends up in exactly one row
+    assert stats['received_left'] == stats['paired'] + stats['interpolated_right']
+    assert stats['received_right'] == stats['paired'] + stats['interpolated_left']
+    assert len(row_times) == stats['paired'] + stats['interpolated_left'] + stats['interpolated_right']
+    assert len(merger) == 0
+
+
+def test_gap_accounting():
+    merger = StreamMerger()
+    for k in range(5):
+        merger.push('left', k * FRAME_PERIOD_S, ramp_frame(k))
+        merger.push('right', k * FRAME_PERIOD_S, ramp_frame(k))
+
+    merger.begin_gap(1.0)
+    # the other side losing the link too doesn't move the start
+    merger.begin_gap(1.2)
+    assert not merger.push('left', 1.5, ramp_frame(5))
+    assert not merger.push('left', 1.6, ramp_frame(6))
+    assert not merger.push('right', 1.6, ramp_frame(6))
+    merger.end_gap(3.0)
+    # nothing to end the second time
+    merger.end_gap(3.5)
+
+    for k in range(5):
+        merger.push('left', 3.0 + k * FRAME_PERIOD_S, ramp_frame(k))
+        merger.push('right', 3.0 + k * FRAME_PERIOD_S, ramp_frame(k))
+    merged = merger.drain(np.inf, flush=True)
+
+    assert merger.stats['gaps'] == [[1.0, 3.0]]
+    assert merger.stats['gap_left'] == 2
+    assert merger.stats['gap_right'] == 1
+    assert merger.stats['paired'] == 10
+    assert len(merged.time) == 10
+    # the outage shows up as a jump in the row times
+    assert merged.time[5] - merged.time[4] > 2.5
+    assert '1 gaps (2.0 s)' in merge_summary(merger.stats)
+
+
+def test_reset_stats():
+    merger = StreamMerger()
+    merger.push('left', 0.0, ramp_frame(0))
+    merger.push('left', 0.0, ramp_frame(0))
+    merger.begin_gap(1.0)
+    merger.end_gap(2.0)
+    merger.reset_stats()
+    assert merger.stats['gaps'] == []
+    assert all(value == 0 for key, value in merger.stats.items() if key != 'gaps')
+    assert merge_summary(merger.stats).startswith('0 frames, 0 paired')
+
+
+def test_sample_offsets():
+    np.testing.assert_allclose(sample_offsets(), np.array([3, 2, 1, 0]) / SAMPLE_RATE_HZ)
+    assert FRAME_PERIOD_S == pytest.approx(SAMPLES_PER_FRAME / SAMPLE_RATE_HZ)